@@ -0,0 +1,7 @@
+"""
+Hate speech detection in Portuguese. The time when the package starts being imported is kept,
+so models can report how long importing them and their dependencies took when they start.
+"""
+import time
+
+IMPORT_STARTED = time.perf_counter()
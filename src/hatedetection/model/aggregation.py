@@ -0,0 +1,77 @@
+"""
+Aggregation of the predictions made over windows of text back to the documents they belong to.
+Reductions are computed as segment operations over NumPy arrays, where each segment contains
+the windows of one document.
+"""
+from typing import Tuple
+
+import numpy as np
+
+AGGREGATION_STRATEGIES = ('majority', 'mean_probability', 'max_probability', 'mean_logits')
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    """
+    Computes the softmax over the last axis of the given logits.
+    """
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+def aggregate_windows(logits: np.ndarray, doc_index: np.ndarray, n_docs: int,
+                      strategy: str = 'majority') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Aggregates the logits computed for each window to the document each window belongs to.
+
+    Parameters
+    ----------
+    logits: np.ndarray
+        The logits of each window, with shape `(n_windows, n_classes)`.
+    doc_index: np.ndarray
+        The position of the document each window belongs to. Windows of the same document
+        have to be contiguous, as generated by `pd.Series.explode`.
+    n_docs: int
+        The number of documents. Each document has to have at least one window.
+    strategy: str
+        How predictions are aggregated:
+         - `majority`: the class predicted by most of the windows. Ties are broken by the mean
+           probability of the tied classes. Confidence is the mean of the confidence of the
+           windows.
+         - `mean_probability`: the class with the highest mean probability across windows.
+         - `max_probability`: the class with the highest probability in any window.
+         - `mean_logits`: the class with the highest probability once logits are averaged.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The class and the confidence of each document.
+    """
+    if strategy not in AGGREGATION_STRATEGIES:
+        raise ValueError(f"Aggregation strategy {strategy} is not supported. Use any of {AGGREGATION_STRATEGIES}")
+
+    n_classes = logits.shape[1]
+    counts = np.bincount(doc_index, minlength=n_docs)
+    if (counts == 0).any():
+        raise ValueError("All the documents need to have at least one window.")
+
+    if strategy == 'mean_logits':
+        scores = softmax(_segment_sum(logits, doc_index, n_docs) / counts[:, None])
+        return scores.argmax(axis=1), scores.max(axis=1)
+
+    probs = softmax(logits)
+    if strategy == 'max_probability':
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        scores = np.maximum.reduceat(probs, starts, axis=0)
+        return scores.argmax(axis=1), scores.max(axis=1)
+
+    mean_probs = _segment_sum(probs, doc_index, n_docs) / counts[:, None]
+    if strategy == 'mean_probability':
+        return mean_probs.argmax(axis=1), mean_probs.max(axis=1)
+
+    votes = np.bincount(doc_index * n_classes + probs.argmax(axis=1),
+                        minlength=n_docs * n_classes).reshape(n_docs, n_classes)
+    confidence = np.bincount(doc_index, weights=probs.max(axis=1), minlength=n_docs) / counts
+
+    return (2 * votes + mean_probs).argmax(axis=1), confidence
+
+def _segment_sum(values: np.ndarray, doc_index: np.ndarray, n_docs: int) -> np.ndarray:
+    return np.stack([np.bincount(doc_index, weights=values[:, col], minlength=n_docs)
+                     for col in range(values.shape[1])], axis=1)
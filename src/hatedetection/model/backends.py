@@ -0,0 +1,304 @@
+"""
+Execution backends for sequence classification models. Models trained with `transformers` can
+be exported to TorchScript or ONNX and then executed with the backend that offers the lowest
+latency on the hardware where the model is deployed.
+"""
+import os
+import inspect
+import contextlib
+import logging
+from typing import Dict, List
+
+import torch
+import numpy as np
+from transformers import PreTrainedModel
+from hatedetection.model.precision import apply_precision, autocast
+
+BACKENDS = ('torch', 'torchscript', 'onnx')
+
+BACKEND_FILES = {
+    'torchscript': 'classifier.torchscript.pt',
+    'onnx': 'classifier.onnx',
+}
+
+class TorchBackend:
+    """
+    Runs the model eagerly with PyTorch, using any of the precisions in `PRECISIONS`.
+    """
+    name = 'torch'
+
+    def __init__(self, model: PreTrainedModel, precision: str = 'fp32'):
+        self.device = next(model.parameters()).device
+        self.precision = precision
+        self.model = apply_precision(model, precision)
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        with autocast(self.precision, self.device):
+            outputs = self.model(input_ids=input_ids.to(self.device), attention_mask=attention_mask.to(self.device))
+        return outputs.logits.float().cpu()
+
+class TorchScriptBackend:
+    """
+    Runs a model exported with `export_torchscript`.
+    """
+    name = 'torchscript'
+
+    def __init__(self, model_path: str):
+        self.model = torch.jit.load(model_path, map_location='cpu')
+        self.model.eval()
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model(input_ids, attention_mask).float()
+
+class OnnxBackend:
+    """
+    Runs a model exported with `export_onnx` using ONNX Runtime.
+    """
+    name = 'onnx'
+
+    def __init__(self, model_path: str, intra_op_num_threads: int = 0):
+        import onnxruntime # pylint: disable=import-outside-toplevel
+
+        self.model_path = model_path
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_num_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options,
+                                                    providers=['CPUExecutionProvider'])
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        logits, = self.session.run(['logits'], { 'input_ids': input_ids.numpy(),
+                                                 'attention_mask': attention_mask.numpy() })
+        return torch.from_numpy(logits)
+
+class _LogitsModule(torch.nn.Module):
+    """
+    Wraps a sequence classification model so it only returns the logits, which is the
+    interface used by all the backends. The wrapper is always in evaluation mode.
+    """
+    def __init__(self, model: PreTrainedModel):
+        super().__init__()
+        self.model = model
+        self.eval()
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+@contextlib.contextmanager
+def _exportable(model: PreTrainedModel):
+    """
+    Prepares the model to be exported by running it in evaluation mode on CPU. Training mode
+    and device of the model are restored afterwards.
+    """
+    training, device = model.training, next(model.parameters()).device
+    try:
+        with torch.no_grad():
+            yield _LogitsModule(model).cpu()
+    finally:
+        model.to(device).train(training)
+
+def sample_inputs(vocab_size: int, lengths: List[int] = (8, 32, 128), batch_size: int = 2,
+                  seed: int = 0) -> List[Dict[str, torch.Tensor]]:
+    """
+    Generates random inputs of different lengths, with some padding, to export models and to
+    verify the outputs of the backends.
+
+    Parameters
+    ----------
+    vocab_size: int
+        Size of the vocabulary of the model.
+    lengths: List[int]
+        The sequence lengths to generate.
+    batch_size: int
+        Number of sequences of each length.
+    seed: int
+        Seed of the random generator.
+
+    Returns
+    -------
+    List[Dict[str, torch.Tensor]]
+        Batches with the keys `input_ids` and `attention_mask`.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    batches = []
+    for length in lengths:
+        input_ids = torch.randint(0, vocab_size, (batch_size, length), generator=generator)
+        attention_mask = torch.ones((batch_size, length), dtype=torch.long)
+        attention_mask[1:, length // 2:] = 0
+        batches.append({ 'input_ids': input_ids, 'attention_mask': attention_mask })
+
+    return batches
+
+def export_torchscript(model: PreTrainedModel, model_path: str):
+    """
+    Exports the model to TorchScript by tracing it.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The model to export.
+    model_path: str
+        The file where the exported model is saved.
+    """
+    inputs = sample_inputs(model.config.vocab_size, lengths=[16])[0]
+    with _exportable(model) as module:
+        traced = torch.jit.trace(module, (inputs['input_ids'], inputs['attention_mask']))
+    torch.jit.save(traced, model_path)
+
+def export_onnx(model: PreTrainedModel, model_path: str, opset_versions: List[int] = (14, 13)):
+    """
+    Exports the model to ONNX, with dynamic batch size and sequence length. Opsets are tried in
+    order, since the latest one supported depends on the version of `torch` and recent versions
+    of `transformers` use operators not available in earlier opsets.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The model to export.
+    model_path: str
+        The file where the exported model is saved.
+    opset_versions: List[int]
+        The ONNX opsets to try, in order of preference.
+    """
+    inputs = sample_inputs(model.config.vocab_size, lengths=[16])[0]
+    options = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        options['dynamo'] = False
+
+    for opset_version in opset_versions:
+        try:
+            with _exportable(model) as module:
+                torch.onnx.export(module,
+                                  (inputs['input_ids'], inputs['attention_mask']),
+                                  model_path,
+                                  input_names=['input_ids', 'attention_mask'],
+                                  output_names=['logits'],
+                                  dynamic_axes={ 'input_ids': { 0: 'batch', 1: 'sequence' },
+                                                 'attention_mask': { 0: 'batch', 1: 'sequence' },
+                                                 'logits': { 0: 'batch' } },
+                                  opset_version=opset_version,
+                                  **options)
+            return
+        except (ValueError, RuntimeError) as error:
+            logging.warning(f"[WARN] Model can't be exported with ONNX opset {opset_version}. {error}")
+
+    raise RuntimeError(f"Model can't be exported to ONNX with any of the opsets {opset_versions}")
+
+def export_backends(model: PreTrainedModel, directory: str, backends: List[str]) -> Dict[str, str]:
+    """
+    Exports the model for each of the given backends.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The model to export.
+    directory: str
+        The directory where exported models are saved.
+    backends: List[str]
+        The backends to export the model for. The `torch` backend doesn't require exporting.
+
+    Returns
+    -------
+    Dict[str, str]
+        The path of the exported model for each backend.
+    """
+    exporters = { 'torchscript': export_torchscript, 'onnx': export_onnx }
+    paths = {}
+    for backend in backends:
+        if backend == 'torch':
+            continue
+        if backend not in exporters:
+            raise ValueError(f"Backend {backend} is not supported. Use any of {BACKENDS}")
+
+        logging.info(f"[INFO] Exporting model for backend {backend}")
+        paths[backend] = os.path.join(directory, BACKEND_FILES[backend])
+        exporters[backend](model, paths[backend])
+
+    return paths
+
+def load_backend(name: str, model: PreTrainedModel, directory: str, precision: str = 'fp32'):
+    """
+    Loads a backend for the model.
+
+    Parameters
+    ----------
+    name: str
+        The name of the backend.
+    model: PreTrainedModel
+        The model, as loaded with `transformers`. Used by the `torch` backend.
+    directory: str
+        The directory where exported models are located.
+    precision: str
+        The precision used to run the model. Only supported by the `torch` backend.
+
+    Returns
+    -------
+    Union[TorchBackend, TorchScriptBackend, OnnxBackend]
+        The backend.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend {name} is not supported. Use any of {BACKENDS}")
+    if name == 'torch':
+        return TorchBackend(model, precision)
+    if precision != 'fp32':
+        raise ValueError(f"Precision {precision} is only supported by the torch backend")
+
+    model_path = os.path.join(directory, BACKEND_FILES[name])
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"The model was not exported for backend {name}. {model_path} doesn't exist")
+
+    if name == 'torchscript':
+        return TorchScriptBackend(model_path)
+    return OnnxBackend(model_path)
+
+def check_parity(backend, reference: TorchBackend, atol: float = 1e-3) -> float:
+    """
+    Verifies that a backend generates the same outputs than eager PyTorch for sample inputs.
+    Padding positions are included in the inputs.
+
+    Parameters
+    ----------
+    backend: Union[TorchBackend, TorchScriptBackend, OnnxBackend]
+        The backend to verify.
+    reference: TorchBackend
+        The eager PyTorch backend.
+    atol: float
+        The maximum absolute difference allowed between the logits.
+
+    Returns
+    -------
+    float
+        The maximum absolute difference found.
+    """
+    max_diff = 0.0
+    with torch.inference_mode():
+        for inputs in sample_inputs(reference.model.config.vocab_size):
+            expected = reference(**inputs).numpy()
+            actual = backend(**inputs).numpy()
+            max_diff = max(max_diff, float(np.abs(expected - actual).max()))
+
+    if max_diff > atol:
+        raise ValueError(f"Backend {backend.name} outputs differ from PyTorch by {max_diff}, which is above {atol}")
+
+    return max_diff
+
+def warmup(backend, vocab_size: int, lengths: List[int], batch_sizes: List[int] = (1, 8)):
+    """
+    Runs a backend over inputs of the given lengths and batch sizes so the first requests don't
+    pay for lazy initializations, like memory allocations or kernel selection.
+
+    Parameters
+    ----------
+    backend: Union[TorchBackend, TorchScriptBackend, OnnxBackend]
+        The backend to warm up.
+    vocab_size: int
+        Size of the vocabulary of the model.
+    lengths: List[int]
+        The sequence lengths to run.
+    batch_sizes: List[int]
+        The batch sizes to run for each length.
+    """
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            for inputs in sample_inputs(vocab_size, lengths, batch_size):
+                backend(**inputs)
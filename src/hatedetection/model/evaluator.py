@@ -1,14 +1,22 @@
+import time
 import logging
 import torch
 import mlflow
 import numpy as np
+import pandas as pd
 import math
 
-from typing import Dict, Any
-from sklearn.metrics import confusion_matrix
+from typing import Dict, Any, List
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
-from statsmodels.stats.contingency_tables import mcnemar
-from hatedetection.prep.text_preparation import load_examples 
+from hatedetection.prep.text_preparation import iter_examples
+from hatedetection.model.inference import InferenceEngine
+from hatedetection.model.backends import TorchBackend
+from hatedetection.model.precision import PRECISIONS, is_supported
+from hatedetection.model.prediction_store import PredictionStore, classifier_params
+from hatedetection.model.statistics import PairedOutcomes
+from hatedetection.prep.arguments import parse_bool
+from hatedetection.prep.storage import build_cache_key, tokenizer_fingerprint
+from hatedetection.model.hate_detection_classifier import load_classifier
 
 def compute_classification_metrics(pred: Dict[str, torch.Tensor]) -> Dict[str, float]:
     """
@@ -37,8 +45,79 @@ def compute_classification_metrics(pred: Dict[str, torch.Tensor]) -> Dict[str, f
         'support': support
     }
 
+def compute_precision_report(classifier, input_ids: List[List[int]], labels: np.ndarray,
+                             precisions: List[str], latency_samples: int = 64) -> pd.DataFrame:
+    """
+    Evaluates the accuracy and the latency of the model of a classifier when running with each
+    of the given precisions. Predictions are made over windows of text, as the model sees them.
+
+    Parameters
+    ----------
+    classifier: HateDetectionClassifier
+        The classifier to evaluate.
+    input_ids: List[List[int]]
+        The token ids of each window.
+    labels: np.ndarray
+        The label id of each window.
+    precisions: List[str]
+        The precisions to evaluate. Any of `fp32`, `int8` or `bf16`. Agreement is computed against
+        the predictions made with the first one.
+    latency_samples: int
+        Number of windows used to measure the latency of single requests.
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe with one row per precision and the columns `precision`, `accuracy`, `f1`,
+        `agreement`, `throughput` (windows per second), `latency_p50_ms` and `latency_p99_ms`.
+    """
+    classifier.model.eval()
+    report, reference = [], None
+
+    for precision in precisions:
+        if precision in PRECISIONS and not is_supported(precision):
+            logging.warning(f"[WARN] Precision {precision} is skipped. It's not supported by torch {torch.__version__}.")
+            continue
+
+        try:
+            backend = TorchBackend(classifier.model, precision)
+        except ValueError as error:
+            logging.warning(f"[WARN] Precision {precision} can't be evaluated. {error}")
+            continue
+
+        engine = InferenceEngine(classifier.tokenizer, classifier.model,
+                                 max_batch_tokens=classifier.max_batch_tokens,
+                                 backend=backend)
+        engine.forward(input_ids[:latency_samples])
+
+        start = time.perf_counter()
+        predictions = engine.forward(input_ids).argmax(axis=1)
+        elapsed = time.perf_counter() - start
+
+        latencies = []
+        for sample in input_ids[:latency_samples]:
+            sample_start = time.perf_counter()
+            engine.forward([sample])
+            latencies.append((time.perf_counter() - sample_start) * 1000)
+
+        reference = predictions if reference is None else reference
+        _, _, f1, _ = precision_recall_fscore_support(labels, predictions, average='weighted')
+        report.append({
+            'precision': precision,
+            'accuracy': accuracy_score(labels, predictions),
+            'f1': f1,
+            'agreement': float(np.mean(predictions == reference)),
+            'throughput': len(input_ids) / elapsed,
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+        })
+        logging.info(f"[INFO] Precision report: {report[-1]}")
+
+    return pd.DataFrame(report)
+
 def resolve_and_compare(model_name: str, champion: str, challenger: str, eval_dataset: str,
-                        class_output: str, confidence: float = 0.05) -> Dict[str, float]:
+                        class_output: str, confidence: float = 0.05, prediction_store: str = None,
+                        sequential: bool = False) -> Dict[str, float]:
     """
     Resolves the model from it's name and runs the evaluation routine.
 
@@ -56,6 +135,11 @@ def resolve_and_compare(model_name: str, champion: str, challenger: str, eval_da
         Name of the output produced by the model where the predicted class is placed.
     confidence: float
         The condifidence level of the test (p-value). Defaults to 95% (0.05)
+    prediction_store: str
+        Directory where the predictions of each model version are stored. Predictions found
+        there are reused instead of being computed again. If None, predictions are not stored.
+    sequential: bool
+        Stops the evaluation as soon as the models are significantly different.
 
     Returns
     -------
@@ -68,7 +152,56 @@ def resolve_and_compare(model_name: str, champion: str, challenger: str, eval_da
                             _model_uri_or_none(model_name, challenger),
                             eval_dataset,
                             class_output,
-                            confidence)
+                            confidence,
+                            prediction_store,
+                            sequential)
+
+def resolve_and_compare_many(model_name: str, versions: List[str], eval_dataset: str, class_output: str = 'hate',
+                             confidence: float = 0.05, batch_size: int = 4096,
+                             prediction_store: str = None, sequential: bool = False,
+                             bootstrap_resamples: int = 1000, max_loaded_models: int = 2) -> Dict[str, pd.DataFrame]:
+    """
+    Resolves multiple versions of a model from it's name and compares all of them in a single
+    pass over the evaluation dataset. See `compute_tournament`.
+
+    Parameters
+    ----------
+    model_name: str
+        Name of the model to get. The model will be downloaded from the model registry.
+    versions: List[str]
+        Versions of the model to compare. They can be numbers, or labels like `latest` or
+        `Production`. Versions that don't exist are ignored.
+    eval_dataset: str
+        Path that leads to the dataset.
+    class_output: str
+        Name of the output produced by the model where the predicted class is placed.
+    confidence: float
+        The condifidence level of the test (p-value). Defaults to 95% (0.05)
+    batch_size: int
+        Number of examples read from the dataset on each batch.
+    prediction_store: str
+        Directory where the predictions of each model version are stored.
+    sequential: bool
+        Stops the evaluation as soon as all the versions are significantly different.
+    bootstrap_resamples: int
+        Number of resamples used to estimate confidence intervals of the difference of the
+        metrics between each pair of versions. If 0, intervals are not estimated.
+    max_loaded_models: int
+        Maximum number of models loaded at the same time.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        The results of `compute_tournament`.
+    """
+    model_paths = { version: _model_uri_or_none(model_name, version) for version in versions }
+    for version in [version for version, path in model_paths.items() if path is None]:
+        logging.warning(f"[WARN] Version {version} of model {model_name} doesn't exist")
+        del model_paths[version]
+
+    logging.info(f"[INFO] Comparing versions {', '.join(model_paths)}")
+    return compute_tournament(model_paths, eval_dataset, class_output, confidence, batch_size, prediction_store,
+                              sequential, bootstrap_resamples, max_loaded_models)
 
 def _model_uri_or_none(model_name: str, version: str) -> str:
     """
@@ -93,18 +226,19 @@ def _model_uri_or_none(model_name: str, version: str) -> str:
             if (len(client.get_latest_versions(model_name)) == 0):
                 return None
 
-        if len(client.get_latest_versions(model_name, stages=[version])) == 0:
+        elif len(client.get_latest_versions(model_name, stages=[version])) == 0:
             return None
 
     return f"models:/{model_name}/{version}"
 
 
 def compute_mcnemmar(champion_path: str, challenger_path: str, eval_dataset: str,
-                     class_output: str, confidence: float = 0.05) -> Dict[str, Any]:
+                     class_output: str, confidence: float = 0.05, prediction_store: str = None,
+                     sequential: bool = False) -> Dict[str, Any]:
     """
     Compares two hate detection models and decides if the two models make the same mistakes or not.
     Note that this method doesn't tell which one is better but if the models are statistically
-    different. It uses the McNemmar test.
+    different. It uses the McNemmar test. See `compute_tournament` for the details.
 
     Parameters
     ----------
@@ -118,38 +252,35 @@ def compute_mcnemmar(champion_path: str, challenger_path: str, eval_dataset: str
         Name of the output produced by the model where the predicted class is placed.
     confidence: float
         The condifidence level of the test (p-value). Defaults to 95% (0.05)
+    prediction_store: str
+        Directory where the predictions of each model version are stored. If None, predictions
+        are not stored.
+    sequential: bool
+        Stops the evaluation as soon as the models are significantly different. The p-value
+        is then always valid. See `compute_tournament`.
 
     Returns
     -------
     Dict[str, Dict[str, float]]:
-        A dictionary containing the keys `statistic`, `pvalue` as a result of the statistical test.
+        A dictionary containing the keys `statistic`, `pvalue` as a result of the statistical test,
+        and the difference of each metric of the challenger with respect to the champion along with
+        its confidence interval, like `accuracy_delta`, `accuracy_delta_lower` and `accuracy_delta_upper`.
     """
-    mlflow.log_param("test", "mcnemar")
+    sequential = parse_bool(sequential)
+    mlflow.log_param("test", "sequential-mcnemar" if sequential else "mcnemar")
     mlflow.log_param("confidence", confidence)
 
     if champion_path and challenger_path:
-        text, _ = load_examples(eval_dataset)
-        champion_model = mlflow.pyfunc.load_model(champion_path)
-        champion_scores = champion_model.predict_batch(text)[class_output]
-
-        logging.info("[INFO] Unloading champion object from memory")
-        del champion_model
-        torch.cuda.synchronize()
-
-        challenger_model = mlflow.pyfunc.load_model(challenger_path)
-        challenger_scores = challenger_model.predict_batch(text)[class_output]
-
-        logging.info("[INFO] Unloading challenger object from memory")
-        del challenger_model
-        torch.cuda.synchronize()
-
-        cont_table = confusion_matrix(champion_scores, challenger_scores)
-        results = mcnemar(cont_table, exact=False)
-
+        results = compute_tournament({ 'champion': champion_path, 'challenger': challenger_path },
+                                     eval_dataset, class_output, confidence,
+                                     prediction_store=prediction_store, sequential=sequential)
         metrics = {
-            "statistic": results.statistic,
-            "pvalue": results.pvalue,
+            "statistic": results['statistic'].loc['champion', 'challenger'],
+            "pvalue": results['pvalue'].loc['champion', 'challenger'],
         }
+        for metric, row in results['bootstrap'].loc[('champion', 'challenger')].iterrows():
+            metrics.update({ f"{metric}_delta": row['delta'], f"{metric}_delta_lower": row['lower'],
+                             f"{metric}_delta_upper": row['upper'] })
 
     else:
         metrics = {
@@ -160,3 +291,161 @@ def compute_mcnemmar(champion_path: str, challenger_path: str, eval_dataset: str
 
     mlflow.log_metrics(metrics)
     return metrics
+
+def compute_tournament(model_paths: Dict[str, str], eval_dataset: str, class_output: str = 'hate',
+                       confidence: float = 0.05, batch_size: int = 4096,
+                       prediction_store: str = None, sequential: bool = False,
+                       bootstrap_resamples: int = 1000, max_loaded_models: int = 2) -> Dict[str, pd.DataFrame]:
+    """
+    Compares any number of hate detection models over the evaluation dataset. The dataset is
+    streamed in batches and each batch is tokenized and split in windows once for all the loaded
+    models that share the same tokenizer and split parameters, so memory is bounded by the batch
+    size and not by the size of the dataset. Models run on whatever device they were loaded in.
+    The McNemar test is run between each pair of models.
+
+    At most `max_loaded_models` models are loaded at once. When there are more models to run, the
+    dataset is read once per group of models, and only the predicted classes of each pass are
+    kept until all the models are evaluated.
+
+    Parameters
+    ----------
+    model_paths: Dict[str, str]
+        The MLflow URI or path of each model, by name.
+    eval_dataset: str
+        Path to the evaluation dataset.
+    class_output: str
+        Name of the output produced by the model where the predicted class is placed.
+    confidence: float
+        The condifidence level of the test (p-value). Defaults to 95% (0.05)
+    batch_size: int
+        Number of examples read from the dataset on each batch.
+    prediction_store: str
+        Directory where the predictions of each model version are stored. Models with stored
+        predictions are not loaded. If None, predictions are not stored.
+    sequential: bool
+        Runs the sequential version of the McNemar test, which is checked after each batch. The
+        evaluation stops as soon as all the pairs of models are significantly different, and
+        `statistic` and `pvalue` hold the mixture likelihood ratios and the always-valid p-values
+        of `PairedOutcomes.sequential_statistic` and `sequential_pvalue`. Metrics
+        are computed over the examples evaluated up to that point. Models that store their
+        predictions still score the rest of the dataset, so they are stored in full. When models are evaluated in
+        more than one pass, all the passes read the whole dataset and the test is checked after.
+    bootstrap_resamples: int
+        Number of resamples used to estimate confidence intervals of the difference of the
+        metrics between each pair of models. See `paired_bootstrap_counts`. If 0, intervals are not
+        estimated.
+    max_loaded_models: int
+        Maximum number of models loaded at the same time. If None, all of them are loaded.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        A dictionary with the keys `metrics` (one row per model), `statistic`, `pvalue` and
+        `significant` (square dataframes with one row and column per model) and `bootstrap`
+        (one row per pair of models and metric).
+    """
+    sequential = parse_bool(sequential)
+    store = PredictionStore(prediction_store) if prediction_store else None
+    params = { name: classifier_params(path) for name, path in model_paths.items() } if store else {}
+    stored = { name: store.get(path, eval_dataset, **params[name]) for name, path in model_paths.items() } if store else {}
+    stored = { name: predictions for name, predictions in stored.items() if predictions is not None }
+
+    pending = [name for name in model_paths if name not in stored]
+    max_loaded_models = max_loaded_models or len(pending) or 1
+    passes = [pending[start:start + max_loaded_models] for start in range(0, len(pending), max_loaded_models)] or [[]]
+    logging.info(f"[INFO] Evaluating {len(model_paths)} models. {len(stored)} with stored predictions "
+                 f"and {len(pending)} in {len(passes)} passes over the dataset")
+
+    # With a single pass, outcomes are updated as the dataset is read so the sequential test can
+    # stop early. Otherwise, predicted classes are kept and outcomes are updated at the end.
+    outcomes = PairedOutcomes(list(model_paths))
+    streaming = len(passes) == 1
+    classes, labels_read = { name: [] for name in model_paths }, []
+    timings = { 'tokenize_seconds': 0.0 }
+    for pass_idx, names in enumerate(passes):
+        engines = { name: load_classifier(model_paths[name]).inference_engine() for name in names }
+        groups = {}
+        for name, engine in engines.items():
+            groups.setdefault(_tokenization_key(engine), []).append(name)
+
+        computed = { name: [] for name in engines } if store else {}
+        offset, decided = 0, False
+        for text, labels in iter_examples(eval_dataset, batch_size=batch_size):
+            predictions = { name: values.iloc[offset:offset + len(text)] for name, values in stored.items() } \
+                if pass_idx == 0 and not decided else {}
+            for group in groups.values():
+                splitter = engines[group[0]]
+                input_ids, doc_index = splitter.stats.timed('tokenize', splitter.split, text)
+                for name in group:
+                    predictions[name] = engines[name].predict_windows(input_ids, doc_index, len(text))
+
+            for name, batches in computed.items():
+                batches.append(predictions[name])
+            offset += len(text)
+
+            if decided:
+                continue
+            if streaming:
+                outcomes.update(labels.to_numpy(), { name: values[class_output].to_numpy()
+                                                     for name, values in predictions.items() })
+                if sequential and outcomes.decided(confidence):
+                    logging.info(f"[INFO] Sequential test decided after {offset} examples")
+                    decided = True
+                    if not computed:
+                        break
+                    # Predictions are stored only when they cover the whole dataset, so the models
+                    # without stored predictions keep scoring it without updating the outcomes
+                    logging.info(f"[INFO] Scoring the rest of the dataset to store the predictions of {list(computed)}")
+            else:
+                for name, values in predictions.items():
+                    classes[name].append(values[class_output].to_numpy())
+                if pass_idx == 0:
+                    labels_read.append(labels.to_numpy())
+
+        for name, batches in computed.items():
+            store.put(model_paths[name], eval_dataset, pd.concat(batches, ignore_index=True), **params[name])
+
+        timings.update({ f"{name}_forward_seconds": engine.stats.timings['forward'] for name, engine in engines.items() })
+        timings['tokenize_seconds'] += sum(engine.stats.timings['tokenize'] for engine in engines.values())
+        del engines, groups, computed
+
+    if not streaming:
+        labels_read = np.concatenate(labels_read)
+        classes = { name: np.concatenate(values) for name, values in classes.items() }
+        for offset in range(0, len(labels_read), batch_size):
+            outcomes.update(labels_read[offset:offset + batch_size],
+                            { name: values[offset:offset + batch_size] for name, values in classes.items() })
+            if sequential and outcomes.decided(confidence):
+                logging.info(f"[INFO] Sequential test decided after {offset + batch_size} examples")
+                break
+
+    metrics = outcomes.metrics()
+    statistic, pvalue = outcomes.mcnemar()
+    if sequential:
+        statistic, pvalue = outcomes.sequential_statistic(), outcomes.sequential_pvalue()
+    results = { 'metrics': metrics, 'statistic': statistic, 'pvalue': pvalue, 'significant': pvalue < confidence }
+    if bootstrap_resamples:
+        names = list(model_paths)
+        results['bootstrap'] = pd.concat({ (first, second): outcomes.bootstrap(first, second, n_resamples=bootstrap_resamples,
+                                                                               confidence=confidence)
+                                           for i, first in enumerate(names) for second in names[i + 1:] },
+                                         names=['first', 'second', 'metric'])
+
+    mlflow.log_metrics(dict(timings, examples_used=outcomes.examples))
+    mlflow.log_metrics({ f"{name}_{metric}": value for name, row in metrics.iterrows() for metric, value in row.items() })
+    if store:
+        mlflow.log_metrics({ f"prediction_store_{name}": value for name, value in store.stats().items() })
+    for name, table in results.items():
+        mlflow.log_text(table.to_csv(), f"tournament_{name}.csv")
+
+    return results
+
+def _tokenization_key(engine: InferenceEngine) -> str:
+    """
+    Builds a key that is the same for engines that split texts in the same windows.
+    """
+    return build_cache_key(tokenizer=tokenizer_fingerprint(engine.tokenizer),
+                           split_mode=engine.split_mode,
+                           split_unique_words=engine.split_unique_words,
+                           split_seq_len=engine.split_seq_len,
+                           max_length=engine.model.config.max_position_embeddings)
@@ -1,18 +1,30 @@
 import os
-import math
+import time
+import json
+import uuid
 import logging
 import pathlib
 
-from typing import Dict, Union
+from typing import Any, Dict, List, Union
+import mlflow
 from mlflow.pyfunc import PythonModel, PythonModelContext
 
-import torch
-import numpy as np
 import pandas as pd
 
 from transformers.models.auto.tokenization_auto import AutoTokenizer
-from transformers.models.auto import AutoModelForSequenceClassification
-from hatedetection.prep.text_preparation import split_to_sequences
+from hatedetection import IMPORT_STARTED
+from hatedetection.model.inference import InferenceEngine
+from hatedetection.model.backends import TorchBackend, export_backends, load_backend, check_parity, warmup
+from hatedetection.model.prediction_cache import PredictionCache
+from hatedetection.model.telemetry import DISABLED, TELEMETRY_ENV_VAR, Telemetry, build_telemetry
+from hatedetection.model.weights import load_model, save_weights, weights_fingerprint
+
+BACKEND_ENV_VAR = 'HATEDETECTION_BACKEND'
+PRECISION_ENV_VAR = 'HATEDETECTION_PRECISION'
+CACHE_PATH_ENV_VAR = 'HATEDETECTION_CACHE_PATH'
+WARMUP_ENV_VAR = 'HATEDETECTION_WARMUP'
+# Time spent since the package started being imported until this module and its dependencies were
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 
 class HateDetectionClassifier(PythonModel):
@@ -21,22 +33,168 @@ class HateDetectionClassifier(PythonModel):
         self.artifacts_path = None
         self.split_unique_words = 150
         self.split_seq_len = 200
+        self.split_mode = 'words'
         self.batch_size = 64
+        self.max_batch_tokens = 16384
+        self.aggregation = 'majority'
+        self.backend = 'torch'
+        self._precision = 'fp32'
+        self.parity_atol = 1e-3
+        self.chunk_size = 1024
+        self.pipeline_workers = 2
+        self.model_version = None
+        self.cache_size = 65536
+        self.cache_path = None
+        self.warmup_lengths = [16, 64, 256]
+        self.startup_stats = {}
+        self.telemetry = DISABLED
+        self._tokenizer = None
+        self._tokenizer_path = None
+        self._backend = None
         
     def load_context(self, context: PythonModelContext):
-        """Loads the model from an MLFlow context
+        """Loads the model from an MLFlow context. The backend and the precision used to run
+        the model are read from the `inference` artifact and can be overriden with the environment
+        variables `HATEDETECTION_BACKEND` and `HATEDETECTION_PRECISION`. Cached predictions are
+        invalidated and `HATEDETECTION_CACHE_PATH` can indicate a cache shared across processes.
+        Telemetry is enabled with the sinks given in `HATEDETECTION_TELEMETRY`, see `build_telemetry`.
+
+        Weights are memory-mapped from `safetensors` files and the tokenizer is loaded lazily.
+        If `warmup_lengths` is set, the model is warmed up before it reports ready, unless
+        `HATEDETECTION_WARMUP` is `0`. Time spent on each phase, including importing the module,
+        is available in `startup_stats`.
 
         Parameters
         ----------
         context : PythonModelContext
             Model context
         """
+        started = time.perf_counter()
         artifacts_path = os.path.dirname(context.artifacts["config"])
         logging.info("[INFO] Loading transformer")
         
-        self.build(artifacts_path, eval=True)
+        self.build(artifacts_path, eval=True, lazy_tokenizer=True)
+
+        if "inference" in context.artifacts:
+            with open(context.artifacts["inference"], 'r', encoding='utf-8') as config_file:
+                config = json.load(config_file)
+            self.backend = config.get('backend', self.backend)
+            self.precision = config.get('precision', self.precision)
+            self.parity_atol = config.get('parity_atol', self.parity_atol)
+            self.model_version = config.get('model_version', self.model_version)
+
+        self.cache_path = os.environ.get(CACHE_PATH_ENV_VAR, self.cache_path)
+        self.precision = os.environ.get(PRECISION_ENV_VAR, self.precision)
+        if os.environ.get(TELEMETRY_ENV_VAR):
+            self.enable_telemetry(build_telemetry(os.environ[TELEMETRY_ENV_VAR], flush_interval=60))
+
+        backend_started = time.perf_counter()
+        self.load_backend(os.environ.get(BACKEND_ENV_VAR, self.backend), artifacts_path)
+        self.startup_stats['backend_seconds'] = time.perf_counter() - backend_started
+
+        if self.warmup_lengths and os.environ.get(WARMUP_ENV_VAR, '1') != '0':
+            self.warmup()
+
+        self.startup_stats['import_seconds'] = IMPORT_SECONDS
+        self.startup_stats['load_context_seconds'] = time.perf_counter() - started
+        logging.info(f"[INFO] Model ready. Startup stats: {self.startup_stats}")
+
+    @property
+    def tokenizer(self):
+        """
+        The tokenizer of the model. When the model is built with `lazy_tokenizer`, the tokenizer
+        is loaded the first time it is used.
+        """
+        if self._tokenizer is None and self._tokenizer_path:
+            started = time.perf_counter()
+            self._tokenizer = AutoTokenizer.from_pretrained(self._tokenizer_path)
+            self.startup_stats['tokenizer_seconds'] = time.perf_counter() - started
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    @property
+    def precision(self) -> str:
+        """
+        The precision used to run the model at inference time. Any of `fp32`, `int8` or `bf16`.
+        Changing it discards the current backend, which is created again the next time it's used.
+        """
+        return self._precision
+
+    @precision.setter
+    def precision(self, precision: str):
+        if precision != getattr(self, '_precision', None):
+            self._backend = None
+        self._precision = precision
+
+    @property
+    def backend_runner(self):
+        """
+        The backend that runs the model. It's created once and reused by every prediction, until
+        the model is built again, another backend is loaded or the precision changes. If no
+        backend was loaded, the model runs eagerly with PyTorch.
+        """
+        if self._backend is None:
+            self._backend = TorchBackend(self.model, self.precision)
+        return self._backend
+
+    def warmup(self, lengths: List[int] = None, batch_sizes: List[int] = (1, 8)):
+        """
+        Warms up the tokenizer and the backend of the model with inputs of representative
+        lengths, so the first requests are served at full speed.
+
+        Parameters
+        ----------
+        lengths: List[int]
+            The sequence lengths to run. If None, `warmup_lengths` is used. Lengths are capped
+            to the maximum supported by the model.
+        batch_sizes: List[int]
+            The batch sizes to run for each length.
+        """
+        started = time.perf_counter()
+        self.tokenizer("warm up")
+
+        max_length = self.model.config.max_position_embeddings
+        lengths = sorted({ min(length, max_length) for length in (lengths or self.warmup_lengths) })
+        warmup(self.backend_runner, self.model.config.vocab_size, lengths, batch_sizes)
+
+        self.startup_stats['warmup_seconds'] = time.perf_counter() - started
 
-    def build(self, baseline: str, tokenizer: str = None, eval: bool = False):
+    def load_backend(self, backend: str, artifacts_path: str):
+        """
+        Loads the backend used to run the model. The outputs of exported backends are verified
+        against eager PyTorch and, if they don't match within `parity_atol`, the model falls back
+        to PyTorch. Precisions other than `fp32` are only supported by the `torch` backend.
+
+        Parameters
+        ----------
+        backend: str
+            The name of the backend. Any of `torch`, `torchscript` or `onnx`.
+        artifacts_path: str
+            The directory where the exported models are located.
+        """
+        if backend != 'torch' and self.precision != 'fp32':
+            logging.warning(f"[WARN] Precision {self.precision} is only supported by the torch backend. Using torch.")
+            backend = 'torch'
+
+        self._backend = TorchBackend(self.model, self.precision)
+        if backend == 'torch':
+            return
+
+        try:
+            candidate = load_backend(backend, self.model, artifacts_path)
+            max_diff = check_parity(candidate, self._backend, atol=self.parity_atol)
+        except (ValueError, OSError, RuntimeError, ImportError) as error:
+            logging.warning(f"[WARN] Backend {backend} can't be used, falling back to torch. {error}")
+            return
+
+        logging.info(f"[INFO] Using backend {backend}. Max difference with torch is {max_diff}")
+        self._backend = candidate
+
+    def build(self, baseline: str, tokenizer: str = None, eval: bool = False, precision: str = None,
+              lazy_tokenizer: bool = False):
         """
         Creates a `transformers` tokenizer and model using the given baseline URL. `baseline is
         the url of a `huggingface` model or the url of a folder containing a `transformer` model.
@@ -48,18 +206,44 @@ class HateDetectionClassifier(PythonModel):
         tokenizer: str
             The baseline tokenizer. This can be a huggingface URL or a local path. If None, then
             the same baseline model will be used.
+        eval: bool
+            Indicates if the model is switched to evaluation mode.
+        precision: str
+            The precision used to run the model at inference time. Any of `fp32`, `int8` or
+            `bf16`. If None, the current precision of the classifier is kept.
+        lazy_tokenizer: bool
+            Indicates if the tokenizer is loaded the first time it is used instead of now.
         """
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer or baseline)
-        self.model = AutoModelForSequenceClassification.from_pretrained(baseline)
+        self._tokenizer, self._tokenizer_path = None, tokenizer or baseline
+        if not lazy_tokenizer:
+            _ = self.tokenizer
+
+        started = time.perf_counter()
+        self.model = load_model(baseline)
+        self.startup_stats['weights_seconds'] = time.perf_counter() - started
+        self._backend = None
+        self._cache = None
+        self._weights_path = baseline
+        self._weights_version = None
+        if precision:
+            self.precision = precision
         
         if eval:
             logging.info("[INFO] Switching to evaluation mode")
             _ = self.model.eval()
     
-    def save_pretrained(self, save_directory: str = None) -> Dict[str, str]:
+    def save_pretrained(self, save_directory: str = None, export: List[str] = None) -> Dict[str, str]:
         """
         Saves the model to a directory. All the required artifacts are persisted.
 
+        Parameters
+        ----------
+        save_directory: str
+            The directory where the model is saved.
+        export: List[str]
+            Backends the model is exported for, along with the `transformers` weights. Any of
+            `torchscript` or `onnx`. The backend of the model is always exported.
+
         Returns
         -------
         Dict[str, str]
@@ -70,7 +254,14 @@ class HateDetectionClassifier(PythonModel):
 
         self.artifacts_path = save_directory or self.artifacts_path or self.model_name
         self.tokenizer.save_pretrained(self.artifacts_path)
-        self.model.save_pretrained(self.artifacts_path)
+        save_weights(self.model, self.artifacts_path)
+
+        export_backends(self.model, self.artifacts_path, sorted(set(export or []) | { self.backend }))
+        self.model_version = uuid.uuid4().hex
+        self._cache = None
+        with open(os.path.join(self.artifacts_path, 'inference.json'), 'w', encoding='utf-8') as config_file:
+            json.dump({ 'backend': self.backend, 'precision': self.precision,
+                        'parity_atol': self.parity_atol, 'model_version': self.model_version }, config_file)
 
         artifacts = {}
         for file in os.listdir(self.artifacts_path):
@@ -87,6 +278,31 @@ class HateDetectionClassifier(PythonModel):
         data: Union[list, pd.Series, pd.DataFrame]
             The data you want to run the model on.
 
+        Return
+        ------
+        pd.DataFrame
+            A dataframe with a column hate with the probabilities of the given text of containing hate.
+        """
+        return self.predict(context, data)
+
+    def predict(self, context: PythonModelContext, data: Union[list, pd.Series, pd.DataFrame], batch_size: int = None):
+        """
+        Predicts. Texts are split in windows and windows are sorted by length and batched
+        according to `max_batch_tokens`, so similar lengths are processed together. Large inputs
+        are processed in chunks of `chunk_size` texts, tokenizing the next chunks with
+        `pipeline_workers` threads while the model runs. Predictions of texts seen before are
+        taken from the `prediction_cache`. Time spent on each stage and the counters of the cache
+        are available in `last_stats`, and histograms of each stage are recorded in `telemetry` when
+        it is enabled. Results are returned in the same order than the input data.
+
+        Parameters
+        ----------
+        data: Union[list, pd.Series, pd.DataFrame]
+            The data you want to run the model on.
+        batch_size: int
+            The maximum number of windows on each batch. If None, batches are limited only by
+            `max_batch_tokens`.
+
         Return
         ------
         pd.DataFrame
@@ -94,59 +310,168 @@ class HateDetectionClassifier(PythonModel):
         """
         if isinstance(data, pd.DataFrame):
             data = data['text']
-    
-        data = data.apply(split_to_sequences,
-                          unique_words=self.split_unique_words,
-                          seq_len=self.split_seq_len).explode()
-        
-        inputs = self.tokenizer(list(data), padding=True, return_tensors='pt')
-        predictions = self.model(**inputs)
-        probs = torch.nn.Softmax(dim=1)(predictions.logits)
-        probs = probs.detach().numpy()
-        
-        logging.info("[INFO] Building results with hate probabilities")
-        classes = probs.argmax(axis=1)
-        confidence = probs.max(axis=1)
+        elif not isinstance(data, pd.Series):
+            data = pd.Series(data)
 
-        data = data.reset_index()
-        data['hate'] = classes
-        data['confidence'] = confidence
+        self.last_stats = {}
+        started = time.perf_counter()
 
-        results = data[['index', 'hate', 'confidence']].groupby('index').agg({'hate': pd.Series.mode, 'confidence': 'mean' })
+        def predict_missing(text: pd.Series) -> pd.DataFrame:
+            engine = self.inference_engine(batch_size)
+            results = engine.predict(text)
+            self.last_stats.update(engine.stats.as_dict())
+            return results
 
+        logging.info("[INFO] Building results with hate probabilities")
+        cache = self.prediction_cache()
+        results = cache.predict(data, predict_missing)
+
+        self.last_stats.update({ f"cache_{name}": value for name, value in cache.stats().items() })
+        logging.info(f"[INFO] Pipeline stats: {self.last_stats}")
+
+        if self.telemetry.enabled:
+            self.telemetry.increment('requests')
+            self.telemetry.increment('request_rows', len(data))
+            self.telemetry.observe('request_seconds', time.perf_counter() - started)
+            self.telemetry.flush_if_due()
         return results
 
+    def enable_telemetry(self, telemetry: Telemetry = None) -> Telemetry:
+        """
+        Enables the telemetry of the inference path. Latency of each stage is recorded in histograms,
+        along with counters of rows, windows, tokens and padding and the distribution of the size
+        of the batches.
 
-    def predict(self, context: PythonModelContext, data: Union[list, pd.Series, pd.DataFrame], batch_size: int = 64):
+        Parameters
+        ----------
+        telemetry: Telemetry
+            The registry to use, with its sinks. If None, a registry without sinks is created and
+            it can be read with `snapshot`.
+
+        Returns
+        -------
+        Telemetry
+            The registry.
+        """
+        self.telemetry = telemetry or Telemetry()
+        return self.telemetry
+
+    def disable_telemetry(self):
+        """
+        Disables the telemetry of the inference path.
         """
-        Predicts.
+        self.telemetry = DISABLED
+
+    def inference_engine(self, batch_size: int = None) -> InferenceEngine:
+        """
+        Builds the engine that runs the model of the classifier with its current configuration.
 
         Parameters
         ----------
-        data: Union[list, pd.Series, pd.DataFrame]
-            The data you want to run the model on.
         batch_size: int
-            The batch size to read the data. Defaults to 64.
+            The maximum number of windows on each batch. If None, batches are limited only by
+            `max_batch_tokens`.
 
-        Return
-        ------
-        pd.DataFrame
-            A dataframe with a column hate with the probabilities of the given text of containing hate.
+        Returns
+        -------
+        InferenceEngine
+            The inference engine.
         """
+        return InferenceEngine(self.tokenizer, self.model,
+                               split_mode=self.split_mode,
+                               split_unique_words=self.split_unique_words,
+                               split_seq_len=self.split_seq_len,
+                               max_batch_tokens=self.max_batch_tokens,
+                               max_batch_size=batch_size,
+                               aggregation=self.aggregation,
+                               backend=self.backend_runner,
+                               chunk_size=self.chunk_size,
+                               num_workers=self.pipeline_workers,
+                               telemetry=self.telemetry)
 
-        sample_size = len(data)
-        batches_idx = range(0, math.ceil(sample_size / batch_size))
-        scores = np.zeros((sample_size, 2))
+    def prediction_cache(self) -> PredictionCache:
+        """
+        Gets the cache of predictions of the model. Cached predictions are tied to the version of
+        the model and to the parameters that change its outputs, so the cache is created again
+        when the model is built or saved or when those parameters change. Texts repeated on the
+        same batch are scored once even when `cache_size` is 0.
 
-        for batch_idx in batches_idx:
-            bfrom = batch_idx * batch_size
-            bto = bfrom + batch_size
-            scores[bfrom:bto] = self.predict_single(context, data.iloc[bfrom:bto]).values
-        
-        return pd.DataFrame(scores, columns=['hate', 'confidence'])
+        Returns
+        -------
+        PredictionCache
+            The cache.
+        """
+        version = ':'.join(map(str, [self.model_version or self.weights_version(),
+                                     *self.prediction_params().values()]))
+        if getattr(self, '_cache', None) is None or self._cache.model_version != version:
+            self._cache = PredictionCache(version, max_entries=self.cache_size, shared_path=self.cache_path)
+        return self._cache
+
+    def prediction_params(self) -> Dict[str, Any]:
+        """
+        Gets the parameters of the classifier, other than its weights, that change its predictions.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The parameters, by name.
+        """
+        return { 'split_mode': self.split_mode, 'split_unique_words': self.split_unique_words,
+                 'split_seq_len': self.split_seq_len, 'aggregation': self.aggregation,
+                 'precision': self.precision }
+
+    def weights_version(self) -> str:
+        """
+        Gets an identifier of the weights the model was built with, used to version its predictions
+        when `model_version` is not available. It's computed the first time it's needed.
+
+        Returns
+        -------
+        str
+            The identifier of the weights.
+        """
+        if getattr(self, '_weights_version', None) is None:
+            self._weights_version = weights_fingerprint(self.model, getattr(self, '_weights_path', None))
+        return self._weights_version
 
     def __getstate__(self):
         state = self.__dict__.copy()
-        del state["tokenizer"]
         del state["model"]
+        state.pop("_tokenizer", None)
+        state.pop("_backend", None)
+        state.pop("last_stats", None)
+        state.pop("_cache", None)
+        state.pop("telemetry", None)
+        state["precision"] = state.pop("_precision")
+        state["startup_stats"] = {}
         return state
+
+    def __setstate__(self, state):
+        # Models pickled by previous versions may miss attributes added since then, so
+        # defaults are set first.
+        self.__init__()
+        if 'precision' in state:
+            state['_precision'] = state.pop('precision')
+        self.__dict__.update(state)
+
+def load_classifier(model_path: str) -> HateDetectionClassifier:
+    """
+    Loads a classifier logged in MLflow and returns the `HateDetectionClassifier` instance instead
+    of the `pyfunc` wrapper, so its inference engine can be used directly or it can be shared
+    with worker processes.
+
+    Parameters
+    ----------
+    model_path: str
+        The MLflow URI or path of the model.
+
+    Returns
+    -------
+    HateDetectionClassifier
+        The classifier, with its context already loaded.
+    """
+    model = mlflow.pyfunc.load_model(model_path)
+    # `unwrap_python_model` is not available on the versions of MLflow previous to 2.0
+    if hasattr(model, 'unwrap_python_model'):
+        return model.unwrap_python_model()
+    return model._model_impl.python_model
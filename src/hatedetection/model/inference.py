@@ -0,0 +1,333 @@
+"""
+Inference engine for transformer based text classifiers. Texts are split in windows up front,
+windows are sorted by length and batched according to a budget of tokens, so the model spends as
+little compute as possible on padding. Large inputs are processed in chunks through a pipeline
+where tokenization, model execution and aggregation of different chunks overlap.
+"""
+import copy
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import torch
+import numpy as np
+import pandas as pd
+
+from transformers import PreTrainedModel, PreTrainedTokenizer
+from hatedetection.prep.text_preparation import split_to_sequences, tokenize_to_sequences
+from hatedetection.model.aggregation import aggregate_windows
+from hatedetection.model.backends import TorchBackend
+from hatedetection.model.telemetry import DISABLED, SIZE_BUCKETS, RATIO_BUCKETS
+
+class PipelineStats:
+    """
+    Accumulates the time spent on each stage of the inference pipeline. Stages run in different
+    threads, so the sum of the time of all the stages is higher than the wall time when they
+    overlap. The time of each call is also recorded in the histogram `{stage}_seconds` of the
+    given telemetry.
+    """
+    def __init__(self, telemetry = DISABLED):
+        self.timings = { 'tokenize': 0.0, 'forward': 0.0, 'aggregate': 0.0 }
+        self.chunks = 0
+        self.wall = 0.0
+        self.telemetry = telemetry
+        self._lock = threading.Lock()
+
+    def timed(self, stage: str, func, *args):
+        """
+        Runs a function and records its time under the given stage.
+        """
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[stage] += elapsed
+            self.telemetry.observe(f"{stage}_seconds", elapsed)
+
+    def as_dict(self) -> Dict[str, float]:
+        """
+        Gets the seconds spent on each stage, the wall time, the number of chunks processed and
+        the overlap, computed as the sum of the time of the stages over the wall time.
+        """
+        stats = { f"{stage}_seconds": seconds for stage, seconds in self.timings.items() }
+        stats.update(wall_seconds=self.wall, chunks=self.chunks,
+                     overlap=sum(self.timings.values()) / self.wall if self.wall else 0.0)
+        return stats
+
+class InferenceEngine:
+    """
+    Runs a sequence classification model over arbitrary long texts. Each text is split in
+    windows following the same preprocessing used at training time and the predictions of the
+    windows are aggregated back to the text they belong to.
+
+    Parameters
+    ----------
+    tokenizer: PreTrainedTokenizer
+        The tokenizer of the model.
+    model: PreTrainedModel
+        The sequence classification model.
+    split_mode: str
+        How texts are split in windows. `words` splits on whitespace and `tokens` splits over
+        the token ids.
+    split_unique_words: int
+        Number of unique words (or tokens) to use on each window.
+    split_seq_len: int
+        Number of total words (or tokens) on each window.
+    max_batch_tokens: int
+        Maximum number of tokens, including padding, the model processes in a single batch.
+    max_batch_size: int
+        Maximum number of windows in a single batch. If None, batches are limited only by
+        `max_batch_tokens`.
+    aggregation: str
+        How the predictions of the windows are aggregated to the text. See `aggregate_windows`.
+    backend: Union[TorchBackend, TorchScriptBackend, OnnxBackend]
+        The backend used to run the model. If None, the model runs eagerly with PyTorch.
+    chunk_size: int
+        Number of texts processed together in each step of the pipeline. Windows are sorted by
+        length within each chunk.
+    num_workers: int
+        Number of threads used to tokenize chunks.
+    queue_size: int
+        Maximum number of chunks waiting to be run by the model, and waiting to be aggregated.
+    telemetry: Telemetry
+        Where the latency of each stage and the counters of rows, windows, tokens, padding and
+        batch sizes are recorded. Disabled by default.
+    """
+    def __init__(self, tokenizer: PreTrainedTokenizer, model: PreTrainedModel, split_mode: str = 'words',
+                 split_unique_words: int = 150, split_seq_len: int = 200, max_batch_tokens: int = 16384,
+                 max_batch_size: int = None, aggregation: str = 'majority', backend = None,
+                 chunk_size: int = 1024, num_workers: int = 2, queue_size: int = 2, telemetry = DISABLED):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.backend = backend or TorchBackend(model)
+        self.split_mode = split_mode
+        self.split_unique_words = split_unique_words
+        self.split_seq_len = split_seq_len
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.aggregation = aggregation
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.telemetry = telemetry
+        self.stats = PipelineStats(telemetry)
+        self._local = threading.local()
+
+    def split(self, text: pd.Series, tokenizer: PreTrainedTokenizer = None) -> Tuple[List[List[int]], np.ndarray]:
+        """
+        Splits the texts in windows of token ids, ready to be consumed by the model.
+
+        Parameters
+        ----------
+        text: pd.Series
+            The texts to split.
+        tokenizer: PreTrainedTokenizer
+            The tokenizer to use. If None, the tokenizer of the engine is used.
+
+        Returns
+        -------
+        Tuple[List[List[int]], np.ndarray]
+            The token ids of each window, and the position of the text each window belongs to.
+        """
+        text = text.reset_index(drop=True)
+        tokenizer = tokenizer or self.tokenizer
+
+        if self.split_mode == 'tokens':
+            windows = tokenize_to_sequences(text, tokenizer,
+                                            unique_tokens=self.split_unique_words,
+                                            seq_len=self.split_seq_len)
+            input_ids = list(windows)
+        else:
+            with self.telemetry.timer('window_seconds'):
+                windows = text.apply(split_to_sequences,
+                                     unique_words=self.split_unique_words,
+                                     seq_len=self.split_seq_len).explode().fillna('')
+            with self.telemetry.timer('tokenizer_seconds'):
+                input_ids = tokenizer(list(windows), truncation=True,
+                                      max_length=self.model.config.max_position_embeddings,
+                                      return_attention_mask=False,
+                                      return_token_type_ids=False)['input_ids']
+
+        doc_index = windows.index.to_numpy(dtype=np.int64)
+        if self.telemetry.enabled:
+            self.telemetry.increment('windows', len(doc_index))
+            self.telemetry.observe_many('windows_per_row', np.bincount(doc_index, minlength=len(text)),
+                                        SIZE_BUCKETS)
+        return input_ids, doc_index
+
+    def batches(self, lengths: np.ndarray) -> List[np.ndarray]:
+        """
+        Groups windows in batches. Windows are sorted by length and each batch takes as many
+        windows as possible without exceeding `max_batch_tokens` once padded.
+
+        Parameters
+        ----------
+        lengths: np.ndarray
+            The length of each window.
+
+        Returns
+        -------
+        List[np.ndarray]
+            The indices of the windows on each batch.
+        """
+        order = np.argsort(lengths, kind='stable')
+        batches, start = [], 0
+        while start < len(order):
+            end = start + 1
+            while end < len(order) and (end - start + 1) * lengths[order[end]] <= self.max_batch_tokens \
+                    and (not self.max_batch_size or end - start < self.max_batch_size):
+                end += 1
+            batches.append(order[start:end])
+            start = end
+
+        return batches
+
+    def forward(self, input_ids: List[List[int]]) -> np.ndarray:
+        """
+        Runs the model over the given windows in inference mode using the backend of the engine.
+
+        Parameters
+        ----------
+        input_ids: List[List[int]]
+            The token ids of each window.
+
+        Returns
+        -------
+        np.ndarray
+            The logits of each window, in the same order the windows were given.
+        """
+        lengths = np.fromiter(map(len, input_ids), dtype=np.int64, count=len(input_ids))
+        logits = np.zeros((len(input_ids), self.model.config.num_labels), dtype=np.float32)
+
+        with torch.inference_mode():
+            for batch in self.batches(lengths):
+                max_length = int(lengths[batch].max())
+                inputs = self._pad([input_ids[idx] for idx in batch], max_length)
+                if self.telemetry.enabled:
+                    with self.telemetry.timer('batch_seconds'):
+                        logits[batch] = self.backend(**inputs).numpy()
+                    self._record_batch(lengths[batch], max_length)
+                else:
+                    logits[batch] = self.backend(**inputs).numpy()
+
+        return logits
+
+    def predict_windows(self, input_ids: List[List[int]], doc_index: np.ndarray, n_docs: int) -> pd.DataFrame:
+        """
+        Predicts the class of texts already split in windows, as returned by `split`. Engines with
+        the same tokenizer and split parameters can share the windows of a batch of texts.
+
+        Parameters
+        ----------
+        input_ids: List[List[int]]
+            The token ids of each window.
+        doc_index: np.ndarray
+            The position of the text each window belongs to.
+        n_docs: int
+            The number of texts.
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe with the columns `hate` and `confidence`, one row per text.
+        """
+        logits = self.stats.timed('forward', self.forward, input_ids)
+        return self.stats.timed('aggregate', self._aggregate, logits, doc_index, n_docs)
+
+    def predict(self, text: pd.Series) -> pd.DataFrame:
+        """
+        Predicts the class of each of the given texts. Texts are processed in chunks of
+        `chunk_size`: while the model runs over one chunk, the next ones are tokenized by a pool
+        of threads and the previous one is aggregated. Time spent on each stage is recorded in
+        `stats`.
+
+        Parameters
+        ----------
+        text: pd.Series
+            The texts to classify.
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe with the columns `hate` and `confidence`, one row per text in the same
+            order they were given.
+        """
+        start = time.perf_counter()
+        text = text.reset_index(drop=True)
+        chunks = [text.iloc[idx:idx + self.chunk_size] for idx in range(0, len(text), self.chunk_size)]
+
+        if len(chunks) <= 1:
+            input_ids, doc_index = self.stats.timed('tokenize', self.split, text)
+            results = [self.predict_windows(input_ids, doc_index, len(text))]
+        else:
+            results = self._run_pipeline(chunks)
+
+        self.stats.chunks += len(chunks)
+        self.stats.wall += time.perf_counter() - start
+        self.telemetry.increment('rows', len(text))
+        self.telemetry.observe('predict_seconds', time.perf_counter() - start)
+
+        return pd.concat(results, ignore_index=True)
+
+    def _run_pipeline(self, chunks: List[pd.Series]) -> List[pd.DataFrame]:
+        pending_chunks = iter(chunks)
+        tokenized, aggregated, results = deque(), deque(), []
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as tokenizers, \
+             ThreadPoolExecutor(max_workers=1) as aggregator:
+
+            def submit_next():
+                chunk = next(pending_chunks, None)
+                if chunk is not None:
+                    tokenized.append((tokenizers.submit(self.stats.timed, 'tokenize', self._split_in_worker, chunk),
+                                      len(chunk)))
+
+            for _ in range(self.queue_size):
+                submit_next()
+
+            while tokenized:
+                future, n_docs = tokenized.popleft()
+                input_ids, doc_index = future.result()
+                submit_next()
+
+                logits = self.stats.timed('forward', self.forward, input_ids)
+                aggregated.append(aggregator.submit(self.stats.timed, 'aggregate', self._aggregate,
+                                                    logits, doc_index, n_docs))
+                while len(aggregated) > self.queue_size:
+                    results.append(aggregated.popleft().result())
+
+            results.extend(future.result() for future in aggregated)
+
+        return results
+
+    def _record_batch(self, lengths: np.ndarray, max_length: int):
+        tokens, padded = int(lengths.sum()), len(lengths) * max_length
+        self.telemetry.increment('batches')
+        self.telemetry.increment('tokens', tokens)
+        self.telemetry.increment('padded_tokens', padded)
+        self.telemetry.observe('batch_size', len(lengths), SIZE_BUCKETS)
+        self.telemetry.observe('batch_padding_ratio', 1 - tokens / padded, RATIO_BUCKETS)
+
+    def _split_in_worker(self, text: pd.Series) -> Tuple[List[List[int]], np.ndarray]:
+        # Fast tokenizers can't be used by multiple threads at the same time, so each worker
+        # uses its own copy.
+        if not hasattr(self._local, 'tokenizer'):
+            self._local.tokenizer = copy.deepcopy(self.tokenizer)
+        return self.split(text, self._local.tokenizer)
+
+    def _aggregate(self, logits: np.ndarray, doc_index: np.ndarray, n_docs: int) -> pd.DataFrame:
+        classes, confidence = aggregate_windows(logits, doc_index, n_docs, strategy=self.aggregation)
+        return pd.DataFrame({ 'hate': classes, 'confidence': confidence })
+
+    def _pad(self, input_ids: List[List[int]], max_length: int) -> dict:
+        batch_ids = torch.full((len(input_ids), max_length), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(input_ids), max_length), dtype=torch.long)
+        for row, ids in enumerate(input_ids):
+            batch_ids[row, :len(ids)] = torch.as_tensor(ids, dtype=torch.long)
+            attention_mask[row, :len(ids)] = 1
+
+        return { 'input_ids': batch_ids, 'attention_mask': attention_mask }
@@ -0,0 +1,75 @@
+"""
+Numeric precision modes used to run models at inference time. Models are trained in full
+precision and can then be run with int8 dynamic quantization of their linear layers or with
+bf16 autocast, trading some accuracy for lower latency on CPU.
+"""
+import logging
+import contextlib
+
+import torch
+from transformers import PreTrainedModel
+
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+def apply_precision(model: PreTrainedModel, precision: str = 'fp32') -> PreTrainedModel:
+    """
+    Prepares a model to run with the given precision. For `int8`, linear layers are quantized
+    dynamically in a copy of the model, so the given model is not modified.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The model, in full precision.
+    precision: str
+        Any of `fp32`, `int8` or `bf16`.
+
+    Returns
+    -------
+    PreTrainedModel
+        The model ready to run with the given precision.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precision {precision} is not supported. Use any of {PRECISIONS}")
+
+    if precision == 'int8':
+        if next(model.parameters()).device.type != 'cpu':
+            raise ValueError("Dynamic quantization to int8 is only supported on CPU")
+
+        logging.info("[INFO] Quantizing linear layers to int8")
+        return torch.quantization.quantize_dynamic(model, { torch.nn.Linear }, dtype=torch.qint8)
+
+    return model
+
+def is_supported(precision: str) -> bool:
+    """
+    Indicates if the installed version of `torch` can run models with the given precision. `bf16`
+    needs autocast, which is available since `torch` 1.10.
+    """
+    return precision in PRECISIONS and (precision != 'bf16' or hasattr(torch, 'autocast'))
+
+def autocast(precision: str, device: torch.device):
+    """
+    Gets the context in which the model has to be run for the given precision. For `bf16`, this
+    is an autocast context. If autocast is not available in the installed version of `torch`,
+    the model runs in full precision.
+
+    Parameters
+    ----------
+    precision: str
+        Any of `fp32`, `int8` or `bf16`.
+    device: torch.device
+        The device where the model runs.
+
+    Returns
+    -------
+    ContextManager
+        The context to run the model.
+    """
+    if precision != 'bf16':
+        return contextlib.nullcontext()
+
+    if not is_supported(precision):
+        logging.warning("[WARN] bf16 autocast requires torch>=1.10. Running in fp32.")
+        return contextlib.nullcontext()
+
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
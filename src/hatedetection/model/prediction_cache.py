@@ -0,0 +1,200 @@
+"""
+Exact-match cache of predictions. Texts are normalized and hashed along with the version of the
+model, so repeated texts (like retweets) are scored only once. Entries are kept in memory with
+LRU eviction and, optionally, in a shared SQLite tier so multiple worker processes benefit from
+the predictions made by any of them.
+"""
+import os
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text for caching purposes. Only whitespace is normalized, since it doesn't
+    change how texts are tokenized.
+    """
+    return ' '.join(str(text).split())
+
+class PredictionCache:
+    """
+    Caches the predictions of a model. Keys are hashes of the normalized text and the model
+    version, so predictions of different models are never mixed.
+
+    Parameters
+    ----------
+    model_version: str
+        The version of the model that makes the predictions.
+    max_entries: int
+        Maximum number of entries kept in memory. Least recently used entries are evicted first.
+    shared_path: str
+        Path to a SQLite database shared by multiple processes. If None, only the in-memory tier
+        is used.
+    shared_max_entries: int
+        Maximum number of entries kept in the shared tier. Oldest entries are removed first.
+    """
+    def __init__(self, model_version: str, max_entries: int = 65536, shared_path: str = None,
+                 shared_max_entries: int = 1000000):
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.shared_path = shared_path
+        self.shared_max_entries = shared_max_entries
+        self.counters = { 'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'duplicates': 0 }
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection, self._connection_pid = None, None
+
+    def key(self, text: str) -> bytes:
+        """
+        Computes the key of a text.
+        """
+        return hashlib.blake2b(f"{self.model_version}\0{normalize_text(text)}".encode('utf-8'),
+                               digest_size=16).digest()
+
+    def predict(self, text: pd.Series, predict_fn: Callable[[pd.Series], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Predicts the given texts using cached predictions when available. Texts that are repeated
+        in the batch are scored only once.
+
+        Parameters
+        ----------
+        text: pd.Series
+            The texts to predict.
+        predict_fn: Callable[[pd.Series], pd.DataFrame]
+            The function that scores the texts missing in the cache.
+
+        Returns
+        -------
+        pd.DataFrame
+            The predictions, one row per text in the same order.
+        """
+        keys = [self.key(value) for value in text]
+        unique_keys = list(dict.fromkeys(keys))
+        found = self.get_many(unique_keys)
+
+        first_position = {}
+        for position, key in enumerate(keys):
+            first_position.setdefault(key, position)
+        missing = [key for key in unique_keys if key not in found]
+
+        with self._lock:
+            self.counters['duplicates'] += len(keys) - len(unique_keys)
+
+        if missing:
+            results = predict_fn(text.iloc[[first_position[key] for key in missing]].reset_index(drop=True))
+            computed = dict(zip(missing, results.itertuples(index=False, name=None)))
+            self.put_many(computed)
+            found.update(computed)
+            columns = list(results.columns)
+        else:
+            columns = ['hate', 'confidence']
+
+        return pd.DataFrame([found[key] for key in keys], columns=columns)
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, Tuple]:
+        """
+        Gets the predictions cached for the given keys. Keys not found in memory are looked up in
+        the shared tier.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            self.counters['hits'] += len(found)
+
+        pending = [key for key in keys if key not in found]
+        if pending and self.shared_path:
+            shared = self._shared_get(pending)
+            self._remember(shared)
+            found.update(shared)
+            with self._lock:
+                self.counters['shared_hits'] += len(shared)
+
+        with self._lock:
+            self.counters['misses'] += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries: Dict[bytes, Tuple]):
+        """
+        Stores the given predictions in the cache.
+        """
+        self._remember(entries)
+        if entries and self.shared_path:
+            self._shared_put(entries)
+
+    def invalidate(self, model_version: str = None):
+        """
+        Removes all the entries of the cache, for instance, when the model is reloaded. Entries of
+        the version being replaced are also removed from the shared tier. Entries of other versions
+        are kept, since other processes may be serving them, and they are removed as the shared
+        tier reaches `shared_max_entries`.
+
+        Parameters
+        ----------
+        model_version: str
+            The new version of the model. If None, the version doesn't change.
+        """
+        with self._lock:
+            stale_version = self.model_version
+            self.model_version = model_version or self.model_version
+            self._entries.clear()
+
+        if self.shared_path:
+            with self._lock, self._shared_connection() as connection:
+                connection.execute("DELETE FROM predictions WHERE version = ?", (stale_version,))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the counters of the cache along with the number of entries in memory.
+        """
+        with self._lock:
+            return dict(self.counters, size=len(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, entries: Dict[bytes, Tuple]):
+        with self._lock:
+            self._entries.update(entries)
+            for key in entries:
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def _shared_connection(self) -> sqlite3.Connection:
+        # Connections can't be shared with forked processes, so each process opens its own.
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.shared_path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS predictions "
+                                     "(key BLOB PRIMARY KEY, version TEXT, hate INTEGER, confidence REAL)")
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _shared_get(self, keys: List[bytes]) -> Dict[bytes, Tuple]:
+        found = {}
+        with self._lock:
+            connection = self._shared_connection()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = connection.execute("SELECT key, hate, confidence FROM predictions WHERE key IN "
+                                          f"({','.join('?' * len(chunk))})", chunk)
+                found.update({ key: (hate, confidence) for key, hate, confidence in rows })
+        return found
+
+    def _shared_put(self, entries: Dict[bytes, Tuple]):
+        with self._lock:
+            with self._shared_connection() as connection:
+                connection.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                                       [(key, self.model_version, int(hate), float(confidence))
+                                        for key, (hate, confidence) in entries.items()])
+                connection.execute("DELETE FROM predictions WHERE rowid <= "
+                                   "(SELECT MAX(rowid) FROM predictions) - ?", (self.shared_max_entries,))
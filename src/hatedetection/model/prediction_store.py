@@ -0,0 +1,179 @@
+"""
+Persistent store of the predictions made by registered models over evaluation datasets. Entries
+are content-addressed by the concrete version of the model, the contents of the dataset and the
+parameters used to score it, so predictions of models that don't change (like the champion in
+Production) are computed only once per version of the evaluation dataset.
+"""
+import os
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Optional
+
+import yaml
+import mlflow
+import cloudpickle
+import numpy as np
+import pandas as pd
+
+from hatedetection.prep.readers import files_fingerprint
+from hatedetection.prep.storage import ArrayStore, build_cache_key
+from hatedetection.model.hate_detection_classifier import PRECISION_ENV_VAR
+
+PREDICTIONS_VERSION = 1
+
+def model_fingerprint(model_uri: str) -> str:
+    """
+    Computes an identifier of the contents of a model. Models in the registry referenced by a
+    stage or by `latest` are resolved to their concrete version, since the model behind those
+    labels changes over time.
+
+    Parameters
+    ----------
+    model_uri: str
+        The model URI in MLFlow format, like `models:/{name}/{version}`, or a path to a model.
+
+    Returns
+    -------
+    str
+        The identifier of the model.
+    """
+    if model_uri.startswith('models:/'):
+        model_name, version = model_uri[len('models:/'):].rsplit('/', 1)
+        client = mlflow.tracking.MlflowClient()
+        if version.isdigit():
+            model_version = client.get_model_version(model_name, version)
+        else:
+            stages = None if version == 'latest' else [version]
+            model_version = max(client.get_latest_versions(model_name, stages=stages), key=lambda mv: int(mv.version))
+        return f"{model_name}/{model_version.version}/{model_version.run_id}"
+
+    mlmodel_path = os.path.join(model_uri, 'MLmodel')
+    if os.path.exists(mlmodel_path):
+        with open(mlmodel_path, 'rb') as mlmodel_file:
+            return hashlib.sha256(mlmodel_file.read()).hexdigest()
+
+    return model_uri
+
+def classifier_params(model_uri: str) -> Dict[str, Any]:
+    """
+    Reads the parameters that change the predictions of a classifier logged in MLflow, like the
+    way texts are split in windows and windows are aggregated, from the pickled classifier, so
+    its weights don't have to be loaded. The precision set in `HATEDETECTION_PRECISION`, which is
+    applied when the model is loaded, takes precedence over the pickled one.
+
+    Parameters
+    ----------
+    model_uri: str
+        The model URI in MLFlow format, like `models:/{name}/{version}`, or a path to a model.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The parameters, see `HateDetectionClassifier.prediction_params`.
+    """
+    def model_file(name: str) -> str:
+        if os.path.isdir(model_uri):
+            return os.path.join(model_uri, name)
+        return mlflow.artifacts.download_artifacts(artifact_uri=f"{model_uri.rstrip('/')}/{name}")
+
+    with open(model_file('MLmodel'), 'r', encoding='utf-8') as mlmodel_file:
+        flavor = yaml.safe_load(mlmodel_file)['flavors']['python_function']
+    with open(model_file(flavor['python_model']), 'rb') as pickle_file:
+        params = cloudpickle.load(pickle_file).prediction_params()
+
+    params['precision'] = os.environ.get(PRECISION_ENV_VAR, params['precision'])
+    return params
+
+class PredictionStore:
+    """
+    Stores the predictions of models over datasets in a directory. Predictions are kept as arrays,
+    one per output of the model, and are memory-mapped when read.
+
+    Parameters
+    ----------
+    store_dir: str
+        The directory where predictions are stored. It can be shared by multiple jobs.
+    """
+    def __init__(self, store_dir: str):
+        self.store = ArrayStore(store_dir)
+        self.counters = { 'hits': 0, 'misses': 0 }
+
+    def key(self, model_uri: str, eval_dataset: str, **params) -> str:
+        """
+        Builds the key of the predictions of a model over a dataset.
+
+        Parameters
+        ----------
+        model_uri: str
+            The model URI in MLFlow format or a path to a model.
+        eval_dataset: str
+            The path to the dataset.
+        params:
+            Any other parameter that changes the predictions, like the ones returned by
+            `classifier_params`.
+
+        Returns
+        -------
+        str
+            The key.
+        """
+        return build_cache_key(model=model_fingerprint(model_uri),
+                               dataset=files_fingerprint(eval_dataset),
+                               predictions_version=PREDICTIONS_VERSION,
+                               **params)
+
+    def get(self, model_uri: str, eval_dataset: str, **params) -> Optional[pd.DataFrame]:
+        """
+        Gets the predictions of a model over a dataset, or None if they are not in the store.
+        See `key` for the parameters.
+        """
+        arrays = self.store.get(self.key(model_uri, eval_dataset, **params))
+        if arrays is None:
+            self.counters['misses'] += 1
+            return None
+
+        logging.info(f"[INFO] Reusing stored predictions of {model_uri}")
+        self.counters['hits'] += 1
+        return pd.DataFrame(arrays)
+
+    def put(self, model_uri: str, eval_dataset: str, predictions: pd.DataFrame, **params):
+        """
+        Stores the predictions of a model over a dataset. See `key` for the parameters.
+        """
+        self.store.put(self.key(model_uri, eval_dataset, **params),
+                       { name: np.asarray(values) for name, values in predictions.items() })
+
+    def get_or_predict(self, model_uri: str, eval_dataset: str, predict_fn: Callable[[], pd.DataFrame],
+                       **params) -> pd.DataFrame:
+        """
+        Gets the predictions of a model over a dataset from the store or, if they are not there,
+        computes them with `predict_fn` and stores them.
+
+        Parameters
+        ----------
+        model_uri: str
+            The model URI in MLFlow format or a path to a model.
+        eval_dataset: str
+            The path to the dataset.
+        predict_fn: Callable[[], pd.DataFrame]
+            The function that computes the predictions of the model over the whole dataset.
+        params:
+            Any other parameter that changes the predictions.
+
+        Returns
+        -------
+        pd.DataFrame
+            The predictions, one row per example of the dataset.
+        """
+        predictions = self.get(model_uri, eval_dataset, **params)
+        if predictions is None:
+            logging.info(f"[INFO] Computing predictions of {model_uri}")
+            predictions = predict_fn()
+            self.put(model_uri, eval_dataset, predictions, **params)
+        return predictions
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the number of predictions taken from the store and computed.
+        """
+        return dict(self.counters)
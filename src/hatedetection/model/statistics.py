@@ -0,0 +1,387 @@
+"""
+Statistics to compare classification models that are accumulated over batches of predictions, so
+evaluation datasets can be streamed instead of being held in memory.
+"""
+import math
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.special import betaln
+from statsmodels.stats.contingency_tables import mcnemar
+
+def confusion_metrics(confusion: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Computes classification metrics from confusion matrices. Precision, recall and f1 are weighted
+    by the support of each class, like in `compute_classification_metrics`.
+
+    Parameters
+    ----------
+    confusion: np.ndarray
+        Confusion matrices with true classes in the second to last axis and predicted classes in
+        the last one. Any number of leading axes is supported.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        The metrics `accuracy`, `precision`, `recall` and `f1`, with the shape of the leading axes.
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    support = confusion.sum(axis=-1)
+    true_positives = np.diagonal(confusion, axis1=-2, axis2=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.nan_to_num(true_positives / confusion.sum(axis=-2))
+        recall = np.nan_to_num(true_positives / support)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    total = np.maximum(support.sum(axis=-1), 1)
+    weights = support / total[..., None]
+
+    return {
+        'accuracy': true_positives.sum(axis=-1) / total,
+        'precision': (weights * precision).sum(axis=-1),
+        'recall': (weights * recall).sum(axis=-1),
+        'f1': (weights * f1).sum(axis=-1),
+    }
+
+def paired_bootstrap(labels: np.ndarray, first: np.ndarray, second: np.ndarray, num_labels: int = 2,
+                     n_resamples: int = 1000, confidence: float = 0.05, random_state: int = 0) -> pd.DataFrame:
+    """
+    Estimates confidence intervals of the difference in accuracy, precision, recall and f1 between
+    two models evaluated over the same examples. Examples are resampled with replacement and both
+    models are evaluated over the same resamples. Each example is encoded as a single code of its
+    true class and both predictions, and metrics only depend on how many times each code appears,
+    so the examples are reduced to those counts and resampled with `paired_bootstrap_counts`.
+
+    Parameters
+    ----------
+    labels: np.ndarray
+        The true class of each example.
+    first: np.ndarray
+        The class predicted by the first model for each example.
+    second: np.ndarray
+        The class predicted by the second model for each example.
+    num_labels: int
+        The number of classes.
+    n_resamples: int
+        The number of bootstrap resamples.
+    confidence: float
+        The confidence level of the intervals. Defaults to 95% (0.05).
+    random_state: int
+        Seed of the resamples.
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe indexed by metric with the columns `first`, `second`, `delta` (second minus
+        first), `lower` and `upper` (the bounds of the percentile interval of the delta) and
+        `pvalue` (the two-sided bootstrap p-value of the delta being 0).
+    """
+    codes = (np.asarray(labels, dtype=np.int64) * num_labels + np.asarray(first, dtype=np.int64)) * num_labels \
+        + np.asarray(second, dtype=np.int64)
+    return paired_bootstrap_counts(np.bincount(codes, minlength=num_labels ** 3), num_labels, n_resamples,
+                                   confidence, random_state)
+
+def paired_bootstrap_counts(counts: np.ndarray, num_labels: int = 2, n_resamples: int = 1000,
+                            confidence: float = 0.05, random_state: int = 0) -> pd.DataFrame:
+    """
+    Runs `paired_bootstrap` from the number of examples of each combination of true class, class
+    predicted by the first model and class predicted by the second one. Resampling the examples
+    with replacement is the same as drawing those counts from a multinomial distribution, so
+    each resample takes `num_labels ** 3` values regardless of the number of examples.
+
+    Parameters
+    ----------
+    counts: np.ndarray
+        The number of examples of each combination, with shape `[num_labels] * 3` or flattened
+        in that order.
+    num_labels: int
+        The number of classes.
+    n_resamples: int
+        The number of bootstrap resamples.
+    confidence: float
+        The confidence level of the intervals. Defaults to 95% (0.05).
+    random_state: int
+        Seed of the resamples.
+
+    Returns
+    -------
+    pd.DataFrame
+        The results of `paired_bootstrap`.
+    """
+    counts = np.asarray(counts, dtype=np.int64).reshape(-1)
+    total = int(counts.sum())
+    rng = np.random.default_rng(random_state)
+
+    resampled = rng.multinomial(total, counts / max(total, 1), size=n_resamples) if total \
+        else np.zeros((n_resamples, len(counts)), dtype=np.int64)
+    resampled = resampled.reshape(n_resamples, num_labels, num_labels, num_labels)
+    first_resampled, second_resampled = confusion_metrics(resampled.sum(axis=3)), confusion_metrics(resampled.sum(axis=2))
+
+    counts = counts.reshape(num_labels, num_labels, num_labels)
+    first_metrics, second_metrics = confusion_metrics(counts.sum(axis=2)), confusion_metrics(counts.sum(axis=1))
+
+    report = {}
+    for name in ('accuracy', 'precision', 'recall', 'f1'):
+        values = second_resampled[name] - first_resampled[name]
+        report[name] = {
+            'first': float(first_metrics[name]),
+            'second': float(second_metrics[name]),
+            'delta': float(second_metrics[name] - first_metrics[name]),
+            'lower': float(np.quantile(values, confidence / 2)),
+            'upper': float(np.quantile(values, 1 - confidence / 2)),
+            'pvalue': float(min(1.0, 2 * min(np.mean(values <= 0), np.mean(values >= 0)))),
+        }
+
+    return pd.DataFrame.from_dict(report, orient='index')
+
+class StreamingMetrics:
+    """
+    Accumulates the confusion matrix of a model, and optionally a histogram of the confidence of
+    its predictions, over batches of logits. Memory doesn't depend on the number of examples.
+
+    Parameters
+    ----------
+    num_labels: int
+        The number of classes.
+    calibration_bins: int
+        Number of equally sized bins of confidence used to measure calibration. If 0,
+        calibration is not measured.
+    """
+    def __init__(self, num_labels: int = 2, calibration_bins: int = 0):
+        self.num_labels = num_labels
+        self.calibration_bins = calibration_bins
+        self.reset()
+
+    def reset(self):
+        """
+        Removes all the accumulated counts.
+        """
+        self.confusion = np.zeros((self.num_labels, self.num_labels), dtype=np.int64)
+        self.bin_counts = np.zeros(self.calibration_bins, dtype=np.int64)
+        self.bin_confidence = np.zeros(self.calibration_bins, dtype=np.float64)
+        self.bin_correct = np.zeros(self.calibration_bins, dtype=np.int64)
+
+    def update(self, logits: np.ndarray, labels: np.ndarray):
+        """
+        Adds a batch of predictions.
+
+        Parameters
+        ----------
+        logits: np.ndarray
+            The logits of each example, with shape `(examples, num_labels)`.
+        labels: np.ndarray
+            The true class of each example.
+        """
+        logits = np.asarray(logits, dtype=np.float64)
+        labels = np.asarray(labels, dtype=np.int64)
+        predicted = logits.argmax(axis=-1)
+        self.confusion += np.bincount(labels * self.num_labels + predicted,
+                                      minlength=self.num_labels ** 2).reshape(self.num_labels, -1)
+
+        if self.calibration_bins:
+            probabilities = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            confidence = probabilities.max(axis=-1) / probabilities.sum(axis=-1)
+            bins = np.minimum((confidence * self.calibration_bins).astype(np.int64), self.calibration_bins - 1)
+            self.bin_counts += np.bincount(bins, minlength=self.calibration_bins)
+            self.bin_confidence += np.bincount(bins, weights=confidence, minlength=self.calibration_bins)
+            self.bin_correct += np.bincount(bins, weights=predicted == labels,
+                                            minlength=self.calibration_bins).astype(np.int64)
+
+    def compute(self) -> Dict[str, float]:
+        """
+        Computes the metrics from the accumulated counts.
+
+        Returns
+        -------
+        Dict[str, float]
+            The metrics `accuracy`, `f1`, `precision` and `recall`, as `compute_classification_metrics`
+            does, and the expected calibration error `ece` if calibration is measured.
+        """
+        metrics = { name: float(value) for name, value in confusion_metrics(self.confusion).items() }
+        if self.calibration_bins:
+            gaps = np.abs(self.bin_correct - self.bin_confidence)
+            metrics['ece'] = float(gaps.sum() / max(self.bin_counts.sum(), 1))
+        return metrics
+
+    def calibration(self) -> pd.DataFrame:
+        """
+        Gets the histogram of the confidence of the predictions.
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe with one row per bin and the columns `lower`, `upper`, `count`, `confidence`
+            (the average confidence in the bin) and `accuracy`.
+        """
+        edges = np.linspace(0, 1, self.calibration_bins + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.DataFrame({
+                'lower': edges[:-1],
+                'upper': edges[1:],
+                'count': self.bin_counts,
+                'confidence': self.bin_confidence / self.bin_counts,
+                'accuracy': self.bin_correct / self.bin_counts,
+            })
+
+class PairedOutcomes:
+    """
+    Accumulates the confusion matrix of each model and, for each pair of models, the number of
+    examples one of them classifies correctly while the other one doesn't. Those are the counts
+    the McNemar test needs.
+
+    Parameters
+    ----------
+    names: List[str]
+        The names of the models being compared.
+    num_labels: int
+        The number of classes.
+    prior: float
+        Parameter of the symmetric Beta prior used by the sequential test. See `sequential_pvalue`.
+    """
+    def __init__(self, names: List[str], num_labels: int = 2, prior: float = 1.0):
+        self.names = list(names)
+        self.num_labels = num_labels
+        self.prior = prior
+        self.examples = 0
+        self.confusion = np.zeros((len(self.names), num_labels, num_labels), dtype=np.int64)
+        self.wins = np.zeros((len(self.names), len(self.names)), dtype=np.int64)
+        self.joint = np.zeros((len(self.names), len(self.names), num_labels ** 3), dtype=np.int64)
+        self._sequential_log_ratio = np.zeros((len(self.names), len(self.names)))
+
+    def update(self, labels: np.ndarray, predictions: Dict[str, np.ndarray]):
+        """
+        Adds a batch of predictions.
+
+        Parameters
+        ----------
+        labels: np.ndarray
+            The true class of each example.
+        predictions: Dict[str, np.ndarray]
+            The predicted class of each example by each of the models.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        predicted = np.stack([np.asarray(predictions[name], dtype=np.int64) for name in self.names])
+
+        for idx in range(len(self.names)):
+            self.confusion[idx] += np.bincount(labels * self.num_labels + predicted[idx],
+                                               minlength=self.num_labels ** 2).reshape(self.num_labels, -1)
+
+        for i in range(len(self.names)):
+            for j in range(i + 1, len(self.names)):
+                self.joint[i, j] += np.bincount((labels * self.num_labels + predicted[i]) * self.num_labels
+                                                + predicted[j], minlength=self.num_labels ** 3)
+
+        correct = (predicted == labels).astype(np.int64)
+        self.wins += correct @ (1 - correct).T
+        self.examples += len(labels)
+
+        # The p-value is always valid only if it never increases, so the running maximum of the
+        # likelihood ratio is kept.
+        wins, losses = self.wins, self.wins.T
+        log_ratio = betaln(wins + self.prior, losses + self.prior) - betaln(self.prior, self.prior) \
+            + (wins + losses) * math.log(2)
+        self._sequential_log_ratio = np.maximum(self._sequential_log_ratio, log_ratio)
+
+    def metrics(self) -> pd.DataFrame:
+        """
+        Computes the metrics of each model. Precision, recall and f1 are weighted by the support
+        of each class, like in `compute_classification_metrics`.
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe indexed by model with the columns `accuracy`, `precision`, `recall`, `f1`
+            and `support`.
+        """
+        report = pd.DataFrame(confusion_metrics(self.confusion), index=self.names)
+        report['support'] = self.confusion.sum(axis=(1, 2))
+        return report
+
+    def mcnemar(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Runs the McNemar test between each pair of models. Pairs of models that never disagree
+        on the correctness of an example have a statistic of 0 and a p-value of 1.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, pd.DataFrame]
+            The statistic and the p-value of each pair of models, as square dataframes indexed by
+            model in both axes.
+        """
+        statistic = pd.DataFrame(0.0, index=self.names, columns=self.names)
+        pvalue = pd.DataFrame(1.0, index=self.names, columns=self.names)
+
+        for i, first in enumerate(self.names):
+            for j, second in enumerate(self.names[i + 1:], start=i + 1):
+                if self.wins[i, j] + self.wins[j, i] == 0:
+                    continue
+                results = mcnemar([[0, self.wins[i, j]], [self.wins[j, i], 0]], exact=False)
+                statistic.loc[first, second] = statistic.loc[second, first] = results.statistic
+                pvalue.loc[first, second] = pvalue.loc[second, first] = results.pvalue
+
+        return statistic, pvalue
+
+    def sequential_pvalue(self) -> pd.DataFrame:
+        """
+        Gets the always-valid p-value of the McNemar test between each pair of models. Under the
+        null hypothesis, each discordant pair favors either model with probability 1/2. The
+        p-value is the inverse of the running maximum of a mixture likelihood ratio, which mixes
+        the alternatives with a Beta(`prior`, `prior`) distribution. Unlike the p-values of
+        `mcnemar`, it can be checked after every batch and the evaluation can be stopped as soon
+        as it falls below the confidence level without inflating the type I error.
+
+        Returns
+        -------
+        pd.DataFrame
+            The p-value of each pair of models, as a square dataframe indexed by model in both axes.
+        """
+        return pd.DataFrame(np.minimum(1.0, np.exp(-self._sequential_log_ratio)), index=self.names,
+                            columns=self.names)
+
+    def sequential_statistic(self) -> pd.DataFrame:
+        """
+        Gets the statistic of the sequential McNemar test between each pair of models, which is
+        the running maximum of the mixture likelihood ratio. See `sequential_pvalue`. Ratios too
+        large to be represented are capped to the largest float.
+
+        Returns
+        -------
+        pd.DataFrame
+            The statistic of each pair of models, as a square dataframe indexed by model in both axes.
+        """
+        log_ratio = np.minimum(self._sequential_log_ratio, np.log(np.finfo(np.float64).max))
+        return pd.DataFrame(np.exp(log_ratio), index=self.names, columns=self.names)
+
+    def decided(self, confidence: float) -> bool:
+        """
+        Indicates if the sequential test rejects the null hypothesis for all the pairs of models
+        at the given confidence level, so the rest of the data can't change the decision.
+        """
+        pvalue = np.exp(-self._sequential_log_ratio)
+        return bool(np.all((pvalue < confidence) | np.eye(len(self.names), dtype=bool)))
+
+    def bootstrap(self, first: str, second: str, **kwargs) -> pd.DataFrame:
+        """
+        Runs `paired_bootstrap_counts` between two models over the counts of each combination of
+        true class and predictions, which is all the bootstrap depends on.
+
+        Parameters
+        ----------
+        first: str
+            The name of the first model.
+        second: str
+            The name of the second model.
+        kwargs:
+            Arguments of `paired_bootstrap_counts`.
+
+        Returns
+        -------
+        pd.DataFrame
+            The results of `paired_bootstrap`.
+        """
+        i, j = self.names.index(first), self.names.index(second)
+        counts = (self.joint[i, j] if i < j else self.joint[j, i]).reshape([self.num_labels] * 3)
+        if i > j:
+            counts = counts.transpose(0, 2, 1)
+
+        return paired_bootstrap_counts(counts, self.num_labels, **kwargs)
@@ -0,0 +1,330 @@
+"""
+Low overhead telemetry of the inference path. Latencies and sizes are recorded in histograms with
+fixed buckets and totals in counters, in a registry that lives in the process. The registry is
+exported by sinks, in the Prometheus text format or as MLflow metrics. When telemetry is disabled,
+`DISABLED` is used instead of a registry: its methods do nothing and callers check `enabled`
+before computing values that are only needed by telemetry.
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+TELEMETRY_ENV_VAR = 'HATEDETECTION_TELEMETRY'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+class Histogram:
+    """
+    Counts observations in buckets with fixed upper bounds, like Prometheus histograms do. An
+    observation falls in the first bucket whose bound is greater or equal than it, or in the
+    overflow bucket if there is none.
+
+    Parameters
+    ----------
+    buckets: Sequence[float]
+        The upper bounds of the buckets, in increasing order.
+    """
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """
+        Records an observation.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def observe_many(self, values: np.ndarray):
+        """
+        Records many observations at once.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        counts = np.bincount(np.searchsorted(self.buckets, values, side='left'), minlength=len(self.counts))
+        self.counts = [total + int(new) for total, new in zip(self.counts, counts)]
+        self.count += len(values)
+        self.sum += float(values.sum())
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile by linear interpolation inside the bucket it falls in. Quantiles that
+        fall in the overflow bucket are reported as the highest bound.
+        """
+        if not self.count:
+            return 0.0
+
+        rank, cumulative = q * self.count, 0
+        for idx, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if idx == len(self.buckets):
+                    return float(self.buckets[-1])
+                lower = self.buckets[idx - 1] if idx else 0.0
+                return lower + (self.buckets[idx] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return float(self.buckets[-1])
+
+class Telemetry:
+    """
+    Registry of histograms and counters, safe to use from multiple threads. Histograms are
+    created the first time they are observed.
+
+    Parameters
+    ----------
+    sinks: List
+        The sinks the registry is exported to when it is flushed. See `InProcessSink`,
+        `PrometheusSink` and `MlflowSink`.
+    flush_interval: float
+        Minimum number of seconds between flushes done by `flush_if_due`. If None, the registry is
+        flushed only when `flush` is called.
+    """
+    enabled = True
+
+    def __init__(self, sinks: List = None, flush_interval: float = None):
+        self.sinks = list(sinks or [])
+        self.flush_interval = flush_interval
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._step = 0
+
+    def increment(self, name: str, value: float = 1):
+        """
+        Adds a value to a counter.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Records an observation in a histogram. Buckets are only used when the histogram is created.
+        """
+        with self._lock:
+            self._histogram(name, buckets).observe(value)
+
+    def observe_many(self, name: str, values: np.ndarray, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Records many observations in a histogram at once.
+        """
+        with self._lock:
+            self._histogram(name, buckets).observe_many(values)
+
+    def timer(self, name: str) -> '_Timer':
+        """
+        Context manager that records the seconds its block takes in a histogram.
+        """
+        return _Timer(self, name)
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Gets the counters along with the count, sum, mean and estimated 50th, 95th and 99th
+        percentiles of each histogram.
+        """
+        with self._lock:
+            values = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                values.update({ f"{name}_count": histogram.count, f"{name}_sum": histogram.sum,
+                                f"{name}_mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                                f"{name}_p50": histogram.quantile(0.5), f"{name}_p95": histogram.quantile(0.95),
+                                f"{name}_p99": histogram.quantile(0.99) })
+        return values
+
+    def reset(self):
+        """
+        Removes all the histograms and counters.
+        """
+        with self._lock:
+            self.histograms, self.counters = {}, {}
+
+    def flush(self):
+        """
+        Exports the registry to all the sinks. Each flush is numbered, and sinks that keep a
+        history use that number as step.
+        """
+        self._flushed = time.monotonic()
+        self._step += 1
+        for sink in self.sinks:
+            try:
+                sink.export(self, self._step)
+            except Exception as error: # pylint: disable=broad-except
+                logging.warning(f"[WARN] Telemetry couldn't be exported to {type(sink).__name__}. {error}")
+
+    def flush_if_due(self):
+        """
+        Flushes the registry if `flush_interval` seconds have passed since the last flush.
+        """
+        if self.flush_interval is not None and time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def _histogram(self, name: str, buckets: Sequence[float]) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(buckets)
+        return histogram
+
+class _Timer:
+    __slots__ = ('telemetry', 'name', 'started')
+
+    def __init__(self, telemetry: Telemetry, name: str):
+        self.telemetry = telemetry
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.telemetry.observe(self.name, time.perf_counter() - self.started)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+class NullTelemetry:
+    """
+    Telemetry that records nothing. It has the interface of `Telemetry` so callers don't need to
+    check if telemetry is enabled, unless they have to compute the values they record.
+    """
+    enabled = False
+    _timer = _NullTimer()
+
+    def increment(self, name: str, value: float = 1):
+        pass
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = None):
+        pass
+
+    def observe_many(self, name: str, values: np.ndarray, buckets: Sequence[float] = None):
+        pass
+
+    def timer(self, name: str) -> _NullTimer:
+        return self._timer
+
+    def snapshot(self) -> Dict[str, float]:
+        return {}
+
+    def flush(self):
+        pass
+
+    def flush_if_due(self):
+        pass
+
+DISABLED = NullTelemetry()
+
+def render_prometheus(telemetry: Telemetry, namespace: str = 'hatedetection') -> str:
+    """
+    Renders the registry in the Prometheus text exposition format. Counters get the suffix `_total`.
+
+    Parameters
+    ----------
+    telemetry: Telemetry
+        The registry.
+    namespace: str
+        Prefix of the names of the metrics.
+
+    Returns
+    -------
+    str
+        The metrics, in text format.
+    """
+    lines = []
+    with telemetry._lock: # pylint: disable=protected-access
+        for name, value in sorted(telemetry.counters.items()):
+            lines += [f"# TYPE {namespace}_{name}_total counter", f"{namespace}_{name}_total {value}"]
+        for name, histogram in sorted(telemetry.histograms.items()):
+            metric = f"{namespace}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f"{metric}_sum {histogram.sum}", f"{metric}_count {histogram.count}"]
+
+    return '\n'.join(lines) + '\n'
+
+class InProcessSink:
+    """
+    Keeps the snapshots of the registry in memory, along with the step of each of them.
+    """
+    def __init__(self):
+        self.history: List[Dict[str, float]] = []
+
+    def export(self, telemetry: Telemetry, step: int):
+        self.history.append(dict(telemetry.snapshot(), step=step))
+
+class PrometheusSink:
+    """
+    Renders the registry in the Prometheus text format. If a path is given, the metrics are
+    written to it so they can be collected by the textfile collector of the node exporter.
+    The file is replaced atomically.
+    """
+    def __init__(self, path: str = None, namespace: str = 'hatedetection'):
+        self.path = path
+        self.namespace = namespace
+        self.text = ''
+
+    def export(self, telemetry: Telemetry, step: int):
+        self.text = render_prometheus(telemetry, self.namespace)
+        if self.path:
+            with open(f"{self.path}.tmp", 'w', encoding='utf-8') as metrics_file:
+                metrics_file.write(self.text)
+            os.replace(f"{self.path}.tmp", self.path)
+
+class MlflowSink:
+    """
+    Logs the snapshot of the registry as metrics of the active MLflow run.
+    """
+    def __init__(self, prefix: str = 'inference_'):
+        self.prefix = prefix
+
+    def export(self, telemetry: Telemetry, step: int):
+        import mlflow # pylint: disable=import-outside-toplevel
+
+        mlflow.log_metrics({ f"{self.prefix}{name}": value for name, value in telemetry.snapshot().items() },
+                           step=step)
+
+def build_telemetry(spec: str, flush_interval: float = None) -> Telemetry:
+    """
+    Builds a registry with the sinks given as a comma separated list of `memory`, `mlflow` and
+    `prometheus`. A path can be given to the Prometheus sink as `prometheus=/path/to/file.prom`.
+
+    Parameters
+    ----------
+    spec: str
+        The sinks, for instance `memory,prometheus=/var/lib/node_exporter/hatedetection.prom`.
+    flush_interval: float
+        Minimum number of seconds between flushes done by `flush_if_due`.
+
+    Returns
+    -------
+    Telemetry
+        The registry.
+    """
+    sinks = []
+    for name, _, argument in (item.strip().partition('=') for item in spec.split(',') if item.strip()):
+        if name == 'memory':
+            sinks.append(InProcessSink())
+        elif name == 'prometheus':
+            sinks.append(PrometheusSink(argument or None))
+        elif name == 'mlflow':
+            sinks.append(MlflowSink())
+        elif name not in ('1', 'true'):
+            raise ValueError(f"Telemetry sink {name} is not supported. Use memory, prometheus or mlflow.")
+
+    return Telemetry(sinks, flush_interval)
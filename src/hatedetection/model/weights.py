@@ -0,0 +1,126 @@
+"""
+Persistence of model weights in `safetensors` format. Weights stored this way are memory-mapped
+instead of being unpickled, which makes the startup of models faster and doesn't run code from the
+files. Recent versions of `transformers` handle the format natively, while previous ones load the
+weights through the `safetensors` package.
+"""
+import os
+import hashlib
+import logging
+
+import torch
+import transformers.utils
+from transformers import PreTrainedModel
+from transformers.models.auto import AutoConfig, AutoModelForSequenceClassification
+
+SAFE_WEIGHTS_NAME = 'model.safetensors'
+PICKLE_WEIGHTS_NAME = 'pytorch_model.bin'
+
+def _native_safetensors() -> bool:
+    return hasattr(transformers.utils, 'SAFE_WEIGHTS_NAME')
+
+def save_weights(model: PreTrainedModel, directory: str, remove_pickle: bool = False):
+    """
+    Saves the configuration and the weights of a model in a directory, with the weights in
+    `safetensors` format. Versions of `transformers` that don't support the format also write
+    the weights in `pytorch_model.bin`, which is kept for the tools that read it.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The model to save.
+    directory: str
+        The directory where the model is saved.
+    remove_pickle: bool
+        Indicates if `pytorch_model.bin` is removed once the weights are saved in `safetensors`
+        format, to save space.
+    """
+    model.save_pretrained(directory)
+
+    if not os.path.exists(os.path.join(directory, SAFE_WEIGHTS_NAME)):
+        from safetensors.torch import save_file # pylint: disable=import-outside-toplevel
+
+        logging.info("[INFO] Converting weights to safetensors")
+        state_dict = { name: tensor.detach().cpu().contiguous() for name, tensor in model.state_dict().items() }
+        save_file(state_dict, os.path.join(directory, SAFE_WEIGHTS_NAME), metadata={ 'format': 'pt' })
+
+    pickle_path = os.path.join(directory, PICKLE_WEIGHTS_NAME)
+    if remove_pickle and os.path.exists(pickle_path):
+        os.remove(pickle_path)
+
+def load_model(directory: str) -> PreTrainedModel:
+    """
+    Loads a sequence classification model from a directory or a `huggingface` URL. Weights in
+    `safetensors` format are preferred when available. Previous versions of `transformers` don't
+    support them, so the model is built from its configuration and the file is memory-mapped with
+    `safe_open`. Tensors are then copied into the model one at a time, so the weights are never
+    held twice in memory.
+
+    Parameters
+    ----------
+    directory: str
+        The directory where the model is, or a `huggingface` URL.
+
+    Returns
+    -------
+    PreTrainedModel
+        The model.
+    """
+    safe_path = os.path.join(directory, SAFE_WEIGHTS_NAME)
+    if _native_safetensors() or not os.path.exists(safe_path):
+        return AutoModelForSequenceClassification.from_pretrained(directory)
+
+    from safetensors import safe_open # pylint: disable=import-outside-toplevel
+
+    model = AutoModelForSequenceClassification.from_config(AutoConfig.from_pretrained(directory))
+    state_dict = model.state_dict()
+    with safe_open(safe_path, framework='pt') as weights:
+        names = set(weights.keys())
+        missing, unexpected = state_dict.keys() - names, names - state_dict.keys()
+        if missing or unexpected:
+            raise RuntimeError(f"Weights in {safe_path} don't match the model. Missing: {sorted(missing)}. "
+                               f"Unexpected: {sorted(unexpected)}")
+
+        with torch.no_grad():
+            for name in names:
+                state_dict[name].copy_(weights.get_tensor(name))
+
+    return model.eval()
+
+def weights_fingerprint(model: PreTrainedModel, directory: str = None) -> str:
+    """
+    Computes an identifier of the weights of a model, for models that don't have a version. If
+    the model was loaded from a directory, its configuration and weights files are hashed.
+    Otherwise, the configuration and the tensors of the model are.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The model.
+    directory: str
+        The directory the model was loaded from, if any.
+
+    Returns
+    -------
+    str
+        The identifier of the weights.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    files = []
+    if directory and os.path.isdir(directory):
+        weights = [os.path.join(directory, name) for name in (SAFE_WEIGHTS_NAME, PICKLE_WEIGHTS_NAME)
+                   if os.path.exists(os.path.join(directory, name))]
+        files = [os.path.join(directory, 'config.json')] + weights[:1] if weights else []
+
+    if files:
+        for path in files:
+            with open(path, 'rb') as weights_file:
+                for block in iter(lambda: weights_file.read(1 << 20), b''):
+                    digest.update(block)
+    else:
+        digest.update(model.config.to_json_string().encode('utf-8'))
+        for name, tensor in model.state_dict().items():
+            digest.update(name.encode('utf-8'))
+            digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+
+    return f"weights-{digest.hexdigest()}"
@@ -0,0 +1,51 @@
+"""
+Parsing of the arguments given to jobs in the command line. Jobs may receive their arguments
+as strings, like `--sequential true` or `--scales 1000,10000`, depending on how they are invoked,
+so functions that are used as jobs parse them with these helpers before using them.
+"""
+from typing import List, Union
+
+TRUE_VALUES = ('yes', 'true', 't', 'y', '1')
+FALSE_VALUES = ('no', 'false', 'f', 'n', '0')
+
+def parse_bool(value: Union[bool, str]) -> bool:
+    """
+    Parses a boolean given in the command line. Strings like `true`, `yes` or `1` are parsed as
+    True and strings like `false`, `no` or `0` as False, ignoring the case.
+
+    Parameters
+    ----------
+    value: Union[bool, str]
+        The value to parse.
+
+    Returns
+    -------
+    bool
+        The boolean.
+    """
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    if str(value).strip().lower() in TRUE_VALUES:
+        return True
+    if str(value).strip().lower() in FALSE_VALUES:
+        return False
+    raise ValueError(f"Unable to understand '{value}' as boolean.")
+
+def parse_int_list(values: Union[str, List]) -> List[int]:
+    """
+    Parses a list of integers given in the command line. Lists may arrive as a comma separated
+    string, like `1,2,4`, or as a list whose items may also be comma separated strings.
+
+    Parameters
+    ----------
+    values: Union[str, List]
+        The values to parse.
+
+    Returns
+    -------
+    List[int]
+        The integers.
+    """
+    if isinstance(values, (str, int)):
+        values = [values]
+    return [int(item) for value in values for item in str(value).split(',') if item.strip()]
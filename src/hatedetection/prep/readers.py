@@ -0,0 +1,212 @@
+"""
+This module provides streaming readers for the tabular formats supported by the data loading
+procedures. Files are read in batches of bounded size using `pyarrow` and text columns are
+returned using Arrow-backed string dtypes.
+"""
+import os
+import glob
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+SUPPORTED_FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+CSV_BLOCK_SIZE = 1 << 22
+
+def resolve_files(data_path: str) -> List[str]:
+    """
+    Resolves the files that are matched by a given path. Wildcards are supported. If the path
+    is a directory, then all the files of the supported formats inside of it are used.
+
+    Parameters
+    ----------
+    data_path: str
+        The path where the data is located.
+
+    Returns
+    -------
+    List[str]
+        The matched files, sorted by name.
+    """
+    if os.path.isdir(data_path):
+        files = [file for ext in SUPPORTED_FORMATS for file in glob.glob(os.path.join(data_path, f"*{ext}"))]
+    else:
+        if _file_format(data_path) is None:
+            raise TypeError(f'Only {", ".join(SUPPORTED_FORMATS)} files are supported by the loading \
+data procedure.')
+        files = glob.glob(data_path)
+
+    if not files:
+        raise FileNotFoundError(f"Path or directory {data_path} doesn't exists")
+
+    return sorted(files)
+
+def files_fingerprint(data_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Computes a hash of the contents of all the files matched by the given path. The hash
+    changes if any file is added, removed, renamed or modified.
+
+    Parameters
+    ----------
+    data_path: str
+        The path where the data is located. Wildcards are supported.
+    block_size: int
+        Number of bytes to read at once from each file.
+
+    Returns
+    -------
+    str
+        The hash of the files.
+    """
+    fingerprint = hashlib.sha256()
+    for file in resolve_files(data_path):
+        fingerprint.update(os.path.basename(file).encode())
+        with open(file, 'rb') as data_file:
+            while block := data_file.read(block_size):
+                fingerprint.update(block)
+
+    return fingerprint.hexdigest()
+
+def read_batches(data_path: str, columns: List[str] = None, batch_size: int = 65536,
+                 num_workers: int = None, prefetch: int = 2) -> Iterator[pd.DataFrame]:
+    """
+    Reads all the files matched by the given path in batches of no more than `batch_size`
+    rows. Files are read in parallel by up to `num_workers` threads, but batches are yielded
+    in the order of the files. Each reader keeps no more than `prefetch` batches in memory
+    waiting to be consumed.
+
+    Parameters
+    ----------
+    data_path: str
+        The path where the data is located. Wildcards are supported.
+    columns: List[str]
+        The columns to read. If None, all the columns are read.
+    batch_size: int
+        Maximum number of rows on each batch.
+    num_workers: int
+        Number of files to read concurrently. Defaults to the number of CPUs, up to 4.
+    prefetch: int
+        Number of batches each reader can have in memory before being consumed.
+
+    Returns
+    -------
+    Iterator[pd.DataFrame]
+        Batches of the data. Text columns use the `string[pyarrow]` dtype.
+    """
+    files = resolve_files(data_path)
+    num_workers = max(1, min(num_workers or min(os.cpu_count() or 1, 4), len(files)))
+
+    if num_workers == 1:
+        for file in files:
+            yield from _read_file_batches(file, columns, batch_size)
+        return
+
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=prefetch) for _ in files]
+
+    def produce(file: str, batches: queue.Queue):
+        try:
+            for batch in _read_file_batches(file, columns, batch_size):
+                if not _put(batches, batch, stop):
+                    return
+            _put(batches, None, stop)
+        except Exception as error: # pylint: disable=broad-except
+            _put(batches, error, stop)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for file, batches in zip(files, queues):
+            executor.submit(produce, file, batches)
+        try:
+            for batches in queues:
+                while (batch := batches.get()) is not None:
+                    if isinstance(batch, Exception):
+                        raise batch
+                    yield batch
+        finally:
+            stop.set()
+
+def _put(batches: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Puts an item in the queue unless the consumer has stopped reading.
+    """
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _file_format(file_path: str) -> str:
+    return SUPPORTED_FORMATS.get(os.path.splitext(str(file_path))[1].lower())
+
+def _read_file_batches(file_path: str, columns: List[str], batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Reads a single file in batches of no more than `batch_size` rows.
+    """
+    file_format = _file_format(file_path)
+    if file_format == 'csv':
+        record_batches = _read_csv(file_path, columns)
+    elif file_format == 'parquet':
+        record_batches = pq.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=columns)
+    else:
+        record_batches = _read_ipc(file_path, columns)
+
+    pending, pending_rows = [], 0
+    for record_batch in record_batches:
+        pending.append(record_batch)
+        pending_rows += record_batch.num_rows
+        while pending_rows >= batch_size:
+            table = pa.Table.from_batches(pending)
+            yield _to_pandas(table.slice(0, batch_size))
+            pending = table.slice(batch_size).to_batches()
+            pending_rows -= batch_size
+
+    if pending_rows:
+        yield _to_pandas(pa.Table.from_batches(pending))
+
+def _read_csv(file_path: str, columns: List[str]) -> Iterator[pa.RecordBatch]:
+    convert_options = pa_csv.ConvertOptions(include_columns=columns,
+                                            column_types={ 'text': pa.string() })
+    reader = pa_csv.open_csv(file_path,
+                             read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+                             parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                             convert_options=convert_options)
+    yield from reader
+
+def _read_ipc(file_path: str, columns: List[str]) -> Iterator[pa.RecordBatch]:
+    source = pa.memory_map(file_path)
+    try:
+        reader = pa.ipc.open_file(source)
+        record_batches = (reader.get_batch(idx) for idx in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        record_batches = pa.ipc.open_stream(source)
+
+    for record_batch in record_batches:
+        if columns:
+            record_batch = pa.RecordBatch.from_arrays(
+                [record_batch.column(record_batch.schema.get_field_index(name)) for name in columns],
+                names=columns)
+        yield record_batch
+
+def _arrow_types_mapper(arrow_type: pa.DataType):
+    if arrow_type in (pa.string(), pa.large_string()):
+        return pd.StringDtype('pyarrow')
+    return None
+
+def _to_pandas(table: pa.Table) -> pd.DataFrame:
+    return table.to_pandas(types_mapper=_arrow_types_mapper)
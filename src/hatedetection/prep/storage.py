@@ -0,0 +1,125 @@
+"""
+Keyed storage of arrays on disk, shared by the cache of tokenized datasets and the store of
+predictions, along with the helpers used to build their keys from the inputs the stored arrays
+depend on.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+from transformers import PreTrainedTokenizer
+
+class ArrayStore:
+    """
+    Stores sets of arrays (like encoded ids, labels or predictions) in a directory. Each set of
+    arrays is identified by a key, which is usually built with `build_cache_key`. Arrays are
+    stored in `.npy` format and memory-mapped in copy-on-write mode when read, so they are not
+    copied in memory.
+
+    Parameters
+    ----------
+    cache_dir: str
+        The directory where the arrays are stored. It can be shared by multiple processes.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Gets the arrays stored under the given key.
+
+        Parameters
+        ----------
+        key: str
+            The key of the entry.
+
+        Returns
+        -------
+        Optional[Dict[str, np.ndarray]]
+            The arrays, memory-mapped in copy-on-write mode, or None if the key is not in the store.
+        """
+        entry_path = os.path.join(self.cache_dir, key)
+        manifest_path = os.path.join(entry_path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+
+        logging.info(f"[INFO] Loading arrays from entry {key}")
+        return { name: np.load(os.path.join(entry_path, f"{name}.npy"), mmap_mode='c')
+                 for name in manifest['arrays'] }
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray]):
+        """
+        Stores the given arrays under a key. Entries are written to a temporary location first
+        and then moved, so concurrent readers never see partially written entries.
+
+        Parameters
+        ----------
+        key: str
+            The key of the entry.
+        arrays: Dict[str, np.ndarray]
+            The arrays to store.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_path = os.path.join(self.cache_dir, key)
+        staging_path = tempfile.mkdtemp(prefix=f".{key}-", dir=self.cache_dir)
+
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging_path, f"{name}.npy"), np.ascontiguousarray(array))
+            with open(os.path.join(staging_path, 'manifest.json'), 'w', encoding='utf-8') as manifest_file:
+                json.dump({ 'arrays': list(arrays.keys()) }, manifest_file)
+
+            os.rename(staging_path, entry_path)
+            logging.info(f"[INFO] Arrays stored in entry {key}")
+        except OSError:
+            if not os.path.exists(os.path.join(entry_path, 'manifest.json')):
+                raise
+            logging.info(f"[INFO] Entry {key} was already written by another process")
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+def tokenizer_fingerprint(tokenizer: PreTrainedTokenizer) -> str:
+    """
+    Computes a fingerprint of a tokenizer which changes when the vocabulary or any of the
+    tokenization steps of the tokenizer change.
+
+    Parameters
+    ----------
+    tokenizer: PreTrainedTokenizer
+        The tokenizer.
+
+    Returns
+    -------
+    str
+        The fingerprint of the tokenizer.
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(type(tokenizer).__name__.encode())
+    fingerprint.update(json.dumps([tokenizer.padding_side, tokenizer.model_max_length,
+                                   tokenizer.all_special_tokens]).encode())
+
+    if tokenizer.is_fast:
+        fingerprint.update(tokenizer.backend_tokenizer.to_str().encode())
+    else:
+        fingerprint.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+
+    return fingerprint.hexdigest()
+
+def build_cache_key(**parts) -> str:
+    """
+    Builds a cache key from the given parts. Parts have to be serializable as JSON.
+
+    Returns
+    -------
+    str
+        The key.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
@@ -0,0 +1,142 @@
+"""
+Generation of synthetic corpora with the same schema than the hate speech datasets, to measure how
+data preparation, training and scoring behave at sizes larger than the samples available. Texts
+are bags of words drawn from a vocabulary with a Zipf distribution, so they have realistic token
+frequencies but no meaning.
+"""
+import os
+import logging
+from typing import List
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+CATEGORIES = ['Sexism', 'Body', 'Racism', 'Ideology', 'Homophobia', 'Origin', 'Religion', 'Health',
+              'OtherLifestyle']
+SEED_WORDS = ['mude', 'seus', 'pensamentos', 'e', 'você', 'pode', 'mudar', 'seu', 'mundo', 'quando',
+              'não', 'a', 'direção', 'do', 'vento', 'de', 'sua', 'vela', 'que', 'o', 'em', 'para',
+              'com', 'um', 'uma', 'os', 'no', 'se', 'na', 'por', 'mais', 'as', 'dos', 'como', 'mas']
+SYLLABLES = ['ba', 'be', 'bi', 'bo', 'ca', 'ce', 'ci', 'co', 'da', 'de', 'di', 'do', 'fa', 'fe',
+             'ga', 'go', 'la', 'le', 'li', 'lo', 'ma', 'me', 'mi', 'mo', 'na', 'ne', 'no', 'pa',
+             'pe', 'po', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'so', 'ta', 'te', 'ti', 'to', 'va',
+             'ção', 'ões', 'nh', 'lh', 'ão', 'ém']
+
+def build_vocabulary(size: int = 30000, random_state: int = 0) -> np.ndarray:
+    """
+    Builds a vocabulary of made up words, starting with common Portuguese words.
+
+    Parameters
+    ----------
+    size: int
+        The number of words.
+    random_state: int
+        Seed used to make up the words.
+
+    Returns
+    -------
+    np.ndarray
+        The words, sorted from the most to the least frequent.
+    """
+    rng = np.random.default_rng(random_state)
+    words = dict.fromkeys(SEED_WORDS[:size])
+    while len(words) < size:
+        words[''.join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))] = None
+
+    return np.array(list(words), dtype=object)
+
+def generate_corpus(output_dir: str, rows: int, file_format: str = 'csv', rows_per_file: int = 1000000,
+                    mean_words: float = 16, length_sigma: float = 0.4, max_words: int = 500,
+                    duplicate_rate: float = 0.0, hate_rate: float = 0.22, vocabulary_size: int = 30000,
+                    zipf_exponent: float = 1.1, chunk_size: int = 100000, random_state: int = 0) -> List[str]:
+    """
+    Generates a corpus with the columns `text`, `hate` and one column per category of hate, like
+    `Sexism` or `Racism`. Rows are generated in chunks, so memory doesn't depend on the size of
+    the corpus.
+
+    Parameters
+    ----------
+    output_dir: str
+        The directory where the files are written.
+    rows: int
+        The number of rows of the corpus.
+    file_format: str
+        The format of the files. Either `csv` or `parquet`.
+    rows_per_file: int
+        The maximum number of rows on each file.
+    mean_words: float
+        The median number of words of each text. Lengths follow a log-normal distribution.
+    length_sigma: float
+        The standard deviation of the logarithm of the lengths. Higher values produce more very
+        short and very long texts.
+    max_words: int
+        The maximum number of words of each text.
+    duplicate_rate: float
+        The proportion of rows that repeat the text of a previous row, like retweets do.
+    hate_rate: float
+        The proportion of rows labeled as hate.
+    vocabulary_size: int
+        The number of different words.
+    zipf_exponent: float
+        The exponent of the Zipf distribution of word frequencies.
+    chunk_size: int
+        The number of rows generated at once.
+    random_state: int
+        Seed of the generator.
+
+    Returns
+    -------
+    List[str]
+        The paths of the files written.
+    """
+    if file_format not in ('csv', 'parquet'):
+        raise ValueError(f"Format {file_format} is not supported. Use csv or parquet.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(random_state)
+    vocabulary = build_vocabulary(vocabulary_size, random_state)
+    frequencies = 1.0 / np.arange(1, vocabulary_size + 1) ** zipf_exponent
+    frequencies /= frequencies.sum()
+
+    files, pool = [], None
+    for file_start in range(0, rows, rows_per_file):
+        path = os.path.join(output_dir, f"part-{len(files):05d}.{file_format}")
+        writer = None
+        for start in range(file_start, min(file_start + rows_per_file, rows), chunk_size):
+            size = min(chunk_size, rows - start, file_start + rows_per_file - start)
+            table = _generate_chunk(rng, size, vocabulary, frequencies, mean_words, length_sigma, max_words,
+                                    duplicate_rate, hate_rate, pool)
+            pool = table.column('text').to_numpy(zero_copy_only=False)[-10000:]
+
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema) if file_format == 'parquet' \
+                    else pa_csv.CSVWriter(path, table.schema)
+            writer.write_table(table)
+        writer.close()
+        files.append(path)
+        logging.info(f"[INFO] Synthetic corpus file {path} written")
+
+    return files
+
+def _generate_chunk(rng: np.random.Generator, size: int, vocabulary: np.ndarray, frequencies: np.ndarray,
+                    mean_words: float, length_sigma: float, max_words: int, duplicate_rate: float,
+                    hate_rate: float, pool: np.ndarray) -> pa.Table:
+    lengths = np.clip(rng.lognormal(np.log(mean_words), length_sigma, size).astype(np.int64), 1, max_words)
+    words = vocabulary[rng.choice(len(vocabulary), size=int(lengths.sum()), p=frequencies)]
+    text = np.array([' '.join(row) for row in np.split(words, np.cumsum(lengths)[:-1])], dtype=object)
+
+    duplicated = np.flatnonzero(rng.random(size) < duplicate_rate)
+    if len(duplicated):
+        # Rows repeat texts of previous chunks or of earlier rows of the same chunk
+        sources = np.concatenate([pool, text]) if pool is not None else text
+        offset = len(sources) - size
+        duplicated = duplicated[duplicated + offset > 0]
+        text[duplicated] = sources[(rng.random(len(duplicated)) * (duplicated + offset)).astype(np.int64)]
+
+    hate = (rng.random(size) < hate_rate).astype(np.int64)
+    category = rng.integers(0, len(CATEGORIES), size)
+    columns = { 'text': pa.array(text, type=pa.string()), 'hate': pa.array(hate) }
+    columns.update({ name: pa.array(hate * (category == idx)) for idx, name in enumerate(CATEGORIES) })
+
+    return pa.table(columns)
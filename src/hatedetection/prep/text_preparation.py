@@ -2,13 +2,16 @@
 This modules provides consistent preprocessing for all the text used in models at training
 and inference type.
 """
-import os
-import glob
 import math
-from typing import List, Tuple, Union
+from typing import Iterator, List, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
+from transformers import PreTrainedTokenizerFast
+from hatedetection.prep.readers import read_batches
+
+EXAMPLE_COLUMNS = ['text', 'hate']
 
 def split_to_sequences(text: str, unique_words, seq_len) -> List[str]:
     """
@@ -41,12 +44,89 @@ def split_to_sequences(text: str, unique_words, seq_len) -> List[str]:
     seqs = [' '.join(words[seq*unique_words:seq*unique_words + seq_len]) for seq in range(n_seq)]
     return seqs
 
+def split_to_token_sequences(token_ids: List[int], unique_tokens: int, seq_len: int) -> List[List[int]]:
+    """
+    Splits a sequence of token ids of an arbitrary length to sub-sequences of no more than
+    `seq_len` tokens. It works as `split_to_sequences` but the windows are cut directly over
+    the ids generated by a tokenizer instead of over whitespace separated words, so the
+    length of each window is exactly the number of tokens the model will see.
+
+    Parameters
+    ----------
+    token_ids : List[int]
+        Token ids you want to split in multiple subsequences. Special tokens should not be
+        included.
+    unique_tokens : int
+        Number of unique tokens to use on each subsequence.
+    seq_len : int
+        Number of total tokens to output on each sequence. Each sequence would then contain
+        `seq_len - unique_tokens` from the previous subsequence (context) and then `unique_tokens`
+        from the current subsequence being generated.
+
+    Returns
+    -------
+    List[List[int]]
+        A list of sub-sequences of token ids of no more than `seq_len`. Empty inputs generate
+        a single empty sub-sequence.
+    """
+    assert unique_tokens<seq_len
+
+    n_seq = max(1, math.ceil(len(token_ids)/unique_tokens))
+    return [token_ids[seq*unique_tokens:seq*unique_tokens + seq_len] for seq in range(n_seq)]
+
+def tokenize_to_sequences(text: pd.Series, tokenizer: PreTrainedTokenizerFast,
+                          unique_tokens: int, seq_len: int) -> pd.Series:
+    """
+    Tokenizes each of the texts once and splits the resulting token ids in overlapping windows
+    using `split_to_token_sequences`. The special tokens the tokenizer adds around the text
+    (like `[CLS]` and `[SEP]`) are added to each of the windows so they are ready to be consumed
+    by the model.
+
+    Parameters
+    ----------
+    text : pd.Series
+        Texts you want to tokenize and split.
+    tokenizer : PreTrainedTokenizerFast
+        The tokenizer to use. Fast tokenizers are recommended since all the texts are encoded
+        in a single batch.
+    unique_tokens : int
+        Number of unique tokens to use on each subsequence.
+    seq_len : int
+        Number of total tokens to output on each sequence, without counting special tokens.
+
+    Returns
+    -------
+    pd.Series
+        A series with one element per window containing the list of token ids. As with
+        `pd.Series.explode`, the index of the resulting series indicates which windows
+        belonged to the same text.
+    """
+    encodings = tokenizer(list(text), add_special_tokens=True, truncation=False,
+                          return_attention_mask=False, return_token_type_ids=False,
+                          return_special_tokens_mask=True)
+
+    windows = []
+    for token_ids, special_mask in zip(encodings['input_ids'], encodings['special_tokens_mask']):
+        content = [idx for idx, special in enumerate(special_mask) if not special]
+        if not content:
+            windows.append([token_ids])
+            continue
+
+        prefix, suffix = token_ids[:content[0]], token_ids[content[-1] + 1:]
+        windows.append([prefix + window + suffix for window in
+                        split_to_token_sequences(token_ids[content[0]:content[-1] + 1],
+                                                 unique_tokens, seq_len)])
+
+    return pd.Series(windows, index=text.index, dtype=object).explode()
+
 def load_examples(
         data_path: str, eval_size: float = 0, split_seq: bool = False,
-        unique_words: int = 150, seq_len: int = 200
+        unique_words: int = 150, seq_len: int = 200, random_state: int = None
     ) -> Union[Tuple[pd.Series, pd.Series], Tuple[pd.Series, pd.Series, pd.Series, pd.Series]]:
     """
-    Loads data examples from CSV files stored in the given folder. Wildcards are supported.
+    Loads data examples from CSV, Parquet or Arrow IPC files stored in the given folder.
+    Wildcards are supported. Files are read in parallel and text is kept in Arrow-backed
+    strings. See `iter_examples` for a streaming version of this method.
 
     Parameters
     ----------
@@ -65,37 +145,117 @@ def load_examples(
         Number of total words to output on each sequence. Each sequence would then contain
         `seq_len - unique_words` from the previous subsequence (context) and then `unique_words`
         from the current subsequence being generated.
+    random_state: int
+        Seed used to split the evaluation data. If None, then the split is random.
 
     Returns
     -------
     Tuple[pd.Series, pd.Series]
         The text samples along with the corresponding ground truth
     """
-    if os.path.isdir(data_path):
-        data_path = os.path.join(data_path, "*.csv")
-
-    if not str(data_path).endswith('.csv'):
-        raise TypeError('Only CSV files are supported by the loading data procedure.')
-
-    if not glob.glob(data_path):
-        raise FileNotFoundError(f"Path or directory {data_path} doesn't exists")
-
-    df = pd.concat(map(pd.read_csv, glob.glob(data_path)))
+    df = pd.concat(read_batches(data_path, columns=EXAMPLE_COLUMNS), ignore_index=True)
     if eval_size > 0:
-        train, test = train_test_split(df, test_size=eval_size, stratify=df['hate'])
+        train_idx, test_idx = _split_indices(df['hate'], eval_size, random_state)
+        train, test = df.iloc[train_idx], df.iloc[test_idx]
     else:
         train = df
 
     if split_seq:
-        train.loc[:,'text'] = train['text'].apply(split_to_sequences,
-                                            unique_words=unique_words,
-                                            seq_len=seq_len).explode('text').reset_index(drop=True)
+        train = _explode_sequences(train, unique_words, seq_len)
 
     if eval_size > 0:
         if split_seq:
-            test.loc[:,'text'] = test['text'].apply(split_to_sequences,
-                                            unique_words=unique_words,
-                                            seq_len=seq_len).explode('text').reset_index(drop=True)
-            return train['text'], train['hate'], test['text'], test['hate']
+            test = _explode_sequences(test, unique_words, seq_len)
+        return train['text'], train['hate'], test['text'], test['hate']
 
     return train['text'], train['hate']
+
+def iter_examples(
+        data_path: str, eval_size: float = 0, split_seq: bool = False,
+        unique_words: int = 150, seq_len: int = 200, random_state: int = None,
+        batch_size: int = 65536, num_workers: int = None
+    ) -> Union[Iterator[Tuple[pd.Series, pd.Series]], Iterator[Tuple[pd.Series, pd.Series, pd.Series, pd.Series]]]:
+    """
+    Streams data examples from CSV, Parquet or Arrow IPC files stored in the given folder in
+    batches of bounded size. Each batch has the same structure than the outputs of
+    `load_examples` and, for a given `random_state`, the concatenation of all the batches
+    contains the same examples than `load_examples`, in the order they appear in the files.
+    The index of the examples indicates their position in the whole dataset.
+
+    When `eval_size > 0`, the labels are read first (without the text) to compute the
+    stratified split, and then the files are streamed again to route each example.
+
+    Parameters
+    ----------
+    data_path: str
+        The path where the data is located.
+    eval_size: float
+        The evaluation proportion to withhold. If > 0, then yielded series include evaluation
+        data like (train_X, train_y, test_X, test_y)
+    split_seq: bool
+        Indicates if long sequences should be splitted in subsequences.
+    unique_words: int
+        Number of unique words to use on each subsequence.
+    seq_len : int
+        Number of total words to output on each sequence.
+    random_state: int
+        Seed used to split the evaluation data. If None, then the split is random.
+    batch_size: int
+        Maximum number of rows to read on each batch, before splitting sequences.
+    num_workers: int
+        Number of files to read concurrently.
+
+    Returns
+    -------
+    Iterator[Tuple[pd.Series, pd.Series]]
+        Batches of text samples along with the corresponding ground truth
+    """
+    if eval_size > 0:
+        labels = pd.concat(read_batches(data_path, columns=['hate'], num_workers=num_workers),
+                           ignore_index=True)['hate']
+        is_eval = np.zeros(len(labels), dtype=bool)
+        is_eval[_split_indices(labels, eval_size, random_state)[1]] = True
+        del labels
+
+    offset = 0
+    for batch in read_batches(data_path, columns=EXAMPLE_COLUMNS, batch_size=batch_size,
+                              num_workers=num_workers):
+        batch.index = pd.RangeIndex(offset, offset + len(batch))
+        offset += len(batch)
+
+        if eval_size > 0:
+            batch_eval = is_eval[batch.index]
+            train, test = batch[~batch_eval], batch[batch_eval]
+        else:
+            train = batch
+
+        if split_seq:
+            train = _explode_sequences(train, unique_words, seq_len)
+
+        if eval_size > 0:
+            if split_seq:
+                test = _explode_sequences(test, unique_words, seq_len)
+            yield train['text'], train['hate'], test['text'], test['hate']
+        else:
+            yield train['text'], train['hate']
+
+def _split_indices(labels: pd.Series, eval_size: float, random_state: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes a stratified split of the examples. Returns the positions of the training and
+    the evaluation examples.
+    """
+    return train_test_split(np.arange(len(labels)), test_size=eval_size, stratify=labels,
+                            random_state=random_state)
+
+def _explode_sequences(df: pd.DataFrame, unique_words: int, seq_len: int) -> pd.DataFrame:
+    """
+    Splits the text of each example in subsequences using `split_to_sequences`. Each
+    subsequence becomes an example with the same label and index than the original one.
+    Examples without words are dropped.
+    """
+    text_dtype = df['text'].dtype
+    df = df.assign(text=df['text'].apply(split_to_sequences,
+                                         unique_words=unique_words,
+                                         seq_len=seq_len)).explode('text')
+    df = df[df['text'].notna()]
+    return df.astype({ 'text': text_dtype })
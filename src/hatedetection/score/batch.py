@@ -0,0 +1,157 @@
+"""
+Batch scoring of large datasets. Input files are streamed in batches and the predictions of each
+batch are written to its own Parquet part file, so memory doesn't grow with the size of the
+dataset. Progress is checkpointed after each part, and a job that is interrupted resumes from the
+first part that wasn't written.
+"""
+import os
+import json
+import time
+import logging
+import itertools
+from typing import Callable, Dict
+
+import mlflow
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hatedetection.prep.readers import read_batches, files_fingerprint
+from hatedetection.model.hate_detection_classifier import load_classifier
+from hatedetection.score.parallel import score_parallel
+
+CHECKPOINT_NAME = '_checkpoint.json'
+
+def score_dataset(model_path: str, input_dataset: str, output_dir: str, text_column: str = 'text',
+                  id_column: str = None, batch_size: int = 16384, num_workers: int = 1,
+                  threads_per_worker: int = None):
+    """
+    Scores all the texts of a dataset with a model logged in MLflow and writes the predictions
+    to Parquet part files in `output_dir`. If `output_dir` contains the checkpoint of a previous
+    execution over the same dataset, scoring resumes where that execution stopped.
+
+    Parameters
+    ----------
+    model_path: str
+        The MLflow URI or path of the model.
+    input_dataset: str
+        Path to the CSV, Parquet or Arrow files with the texts. Wildcards are supported.
+    output_dir: str
+        The directory where the part files are written.
+    text_column: str
+        The column with the texts to score.
+    id_column: str
+        A column to copy from the inputs to the predictions, to join them later. If None, rows
+        are identified only by their position in the dataset.
+    batch_size: int
+        Number of rows on each part file.
+    num_workers: int
+        Number of processes used to score each batch. See `score_parallel`.
+    threads_per_worker: int
+        Number of threads each worker uses to run the model.
+    """
+    classifier = load_classifier(model_path)
+
+    def predict(text: pd.Series) -> pd.DataFrame:
+        if num_workers > 1:
+            return score_parallel(classifier, text, num_workers, threads_per_worker)
+        return classifier.predict(None, text)
+
+    return score_files(predict, input_dataset, output_dir, text_column, id_column, batch_size)
+
+def score_files(predict_fn: Callable[[pd.Series], pd.DataFrame], input_dataset: str, output_dir: str,
+                text_column: str = 'text', id_column: str = None, batch_size: int = 16384) -> Dict[str, float]:
+    """
+    Streams the files of a dataset in batches of `batch_size` rows and writes the predictions of
+    each batch to a part file named `part-{number}.parquet`. Part files contain the column `row`
+    with the position of the text in the dataset, the column `id_column` if indicated and the
+    columns returned by `predict_fn`.
+
+    Parts are written to a temporary file and renamed, and the checkpoint is updated afterwards,
+    so an interruption never leaves a partial file behind. The checkpoint stores a fingerprint of
+    the dataset and the parameters that determine the boundaries of the parts, and resuming with
+    a different dataset or parameters is refused.
+
+    Parameters
+    ----------
+    predict_fn: Callable[[pd.Series], pd.DataFrame]
+        The function that scores a batch of texts.
+    input_dataset: str
+        Path to the CSV, Parquet or Arrow files with the texts. Wildcards are supported.
+    output_dir: str
+        The directory where the part files are written.
+    text_column: str
+        The column with the texts to score.
+    id_column: str
+        A column to copy from the inputs to the predictions.
+    batch_size: int
+        Number of rows on each part file.
+
+    Returns
+    -------
+    Dict[str, float]
+        Progress of the job, including `parts`, `rows`, `resumed_rows` and `rows_per_second`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    columns = [text_column] + ([id_column] if id_column else [])
+    expected = { 'fingerprint': files_fingerprint(input_dataset), 'batch_size': batch_size, 'columns': columns }
+
+    checkpoint = _read_checkpoint(output_dir)
+    if checkpoint:
+        if { key: checkpoint[key] for key in expected } != expected:
+            raise ValueError(f"The checkpoint in {output_dir} belongs to a different dataset or parameters. "
+                             "Use an empty output directory.")
+        logging.info(f"[INFO] Resuming from checkpoint with {checkpoint['parts']} parts and {checkpoint['rows']} rows")
+    else:
+        checkpoint = dict(expected, parts=0, rows=0, complete=False)
+
+    progress = { 'parts': checkpoint['parts'], 'rows': checkpoint['rows'], 'resumed_rows': checkpoint['rows'],
+                 'rows_per_second': 0.0 }
+    if checkpoint['complete']:
+        logging.info("[INFO] All the parts were already written")
+        return progress
+
+    started = time.perf_counter()
+    # Batches are yielded in the order of the files and their boundaries don't change between
+    # executions, so the parts already written are skipped without scoring them.
+    batches = itertools.islice(read_batches(input_dataset, columns=columns, batch_size=batch_size),
+                               checkpoint['parts'], None)
+    for part, batch in enumerate(batches, start=checkpoint['parts']):
+        results = predict_fn(batch[text_column].reset_index(drop=True))
+        results.insert(0, 'row', pd.RangeIndex(checkpoint['rows'], checkpoint['rows'] + len(batch)))
+        if id_column:
+            results.insert(1, id_column, batch[id_column].to_numpy())
+        _write_part(results, os.path.join(output_dir, f"part-{part:05d}.parquet"))
+
+        checkpoint.update(parts=part + 1, rows=checkpoint['rows'] + len(batch))
+        _write_checkpoint(output_dir, checkpoint)
+
+        progress.update(parts=checkpoint['parts'], rows=checkpoint['rows'],
+                        rows_per_second=(checkpoint['rows'] - progress['resumed_rows']) / (time.perf_counter() - started))
+        mlflow.log_metrics({ 'rows_scored': progress['rows'], 'rows_per_second': progress['rows_per_second'] },
+                           step=part)
+        logging.info(f"[INFO] Part {part} written. {progress['rows']} rows scored at "
+                     f"{progress['rows_per_second']:.1f} rows/s")
+
+    checkpoint['complete'] = True
+    _write_checkpoint(output_dir, checkpoint)
+    mlflow.log_metrics({ 'total_rows': progress['rows'], 'total_parts': progress['parts'],
+                         'resumed_rows': progress['resumed_rows'] })
+    return progress
+
+def _write_part(results: pd.DataFrame, path: str):
+    pq.write_table(pa.Table.from_pandas(results, preserve_index=False), f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+def _read_checkpoint(output_dir: str) -> Dict:
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as checkpoint_file:
+        return json.load(checkpoint_file)
+
+def _write_checkpoint(output_dir: str, checkpoint: Dict):
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,183 @@
+"""
+Micro-batching of online requests. Requests usually carry only a few texts, so running the model
+for each of them wastes most of the capacity of the machine. Requests are queued and coalesced in
+micro-batches bounded by a budget of tokens and a maximum waiting time.
+"""
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+class Overloaded(Exception):
+    """
+    Raised when a request is rejected because the queue of pending requests is full.
+    """
+
+def count_words(text: str) -> int:
+    """
+    Estimates the number of tokens of a text as the number of words plus the special tokens. It
+    is much cheaper than tokenizing and good enough to bound the size of the batches.
+    """
+    return len(text.split()) + 2
+
+class _Request:
+    def __init__(self, texts: List[str], tokens: int, future: asyncio.Future):
+        self.texts = texts
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+class MicroBatcher:
+    """
+    Queues prediction requests and runs them in micro-batches. A batch is dispatched as soon as
+    it reaches `max_batch_tokens` or `max_batch_size` texts, or when the first request on it has
+    waited `max_wait_ms`. The model runs in a background thread, so the event loop keeps accepting
+    requests while a batch is being scored. When the queue is full, new requests are rejected
+    with `Overloaded`.
+
+    Parameters
+    ----------
+    predict_fn: Callable[[pd.Series], pd.DataFrame]
+        The function that scores a batch of texts, returning one row per text in the same order.
+    max_batch_tokens: int
+        Maximum number of estimated tokens on each batch.
+    max_batch_size: int
+        Maximum number of texts on each batch.
+    max_wait_ms: float
+        Maximum time, in milliseconds, a request waits for other requests to join its batch.
+    max_queue_size: int
+        Maximum number of requests waiting to be scored. Further requests are rejected.
+    count_tokens: Callable[[str], int]
+        Estimates the number of tokens of a text. Defaults to `count_words`.
+    """
+    def __init__(self, predict_fn: Callable[[pd.Series], pd.DataFrame], max_batch_tokens: int = 16384,
+                 max_batch_size: int = 256, max_wait_ms: float = 5.0, max_queue_size: int = 1024,
+                 count_tokens: Callable[[str], int] = count_words):
+        self.predict_fn = predict_fn
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.count_tokens = count_tokens
+        self.counters = { 'requests': 0, 'texts': 0, 'batches': 0, 'shed': 0, 'errors': 0 }
+
+        self._queue = None
+        self._carry = None
+        self._worker = None
+        self._executor = None
+
+    async def start(self):
+        """
+        Starts dispatching batches. Has to be called from the event loop that serves requests.
+        """
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """
+        Stops dispatching batches. Pending requests are cancelled.
+        """
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        while self._queue and not self._queue.empty():
+            self._queue.get_nowait().future.cancel()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+    async def submit(self, texts: List[str]) -> pd.DataFrame:
+        """
+        Scores the given texts as part of the next micro-batch.
+
+        Parameters
+        ----------
+        texts: List[str]
+            The texts to score.
+
+        Returns
+        -------
+        pd.DataFrame
+            The results for each text, in the same order.
+        """
+        if not self._worker:
+            raise RuntimeError("The batcher has not been started")
+
+        request = _Request(list(texts), sum(map(self.count_tokens, texts)),
+                           asyncio.get_running_loop().create_future())
+        try:
+            self._queue.put_nowait(request)
+        except asyncio.QueueFull as error:
+            self.counters['shed'] += 1
+            raise Overloaded(f"There are {self.max_queue_size} requests waiting. Try again later.") from error
+
+        self.counters['requests'] += 1
+        self.counters['texts'] += len(request.texts)
+        return await request.future
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Gets the counters of the batcher along with the current size of the queue and the mean
+        number of texts per batch.
+        """
+        return dict(self.counters,
+                    queue_size=self._queue.qsize() if self._queue else 0,
+                    mean_batch_size=self.counters['texts'] / max(self.counters['batches'], 1))
+
+    async def _next_batch(self) -> List[_Request]:
+        first = self._carry or await self._queue.get()
+        self._carry = None
+
+        batch, tokens, size = [first], first.tokens, len(first.texts)
+        deadline = first.enqueued_at + self.max_wait_ms / 1000
+
+        while tokens < self.max_batch_tokens and size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._queue.get_nowait() if timeout <= 0 else \
+                          await asyncio.wait_for(self._queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+
+            if tokens + request.tokens > self.max_batch_tokens or size + len(request.texts) > self.max_batch_size:
+                self._carry = request
+                break
+
+            batch.append(request)
+            tokens += request.tokens
+            size += len(request.texts)
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [request for request in await self._next_batch() if not request.future.cancelled()]
+            if not batch:
+                continue
+
+            texts = pd.Series([text for request in batch for text in request.texts])
+            self.counters['batches'] += 1
+            try:
+                results = await loop.run_in_executor(self._executor, self.predict_fn, texts)
+            except Exception as error: # pylint: disable=broad-except
+                logging.warning(f"[WARN] Batch of {len(texts)} texts failed. {error}")
+                self.counters['errors'] += 1
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(error)
+                continue
+
+            start = 0
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_result(results.iloc[start:start + len(request.texts)].reset_index(drop=True))
+                start += len(request.texts)
@@ -0,0 +1,161 @@
+"""
+Load tests for the scoring server. Requests are sent concurrently over persistent connections and
+the latency of each of them is recorded to report percentiles and throughput.
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, List
+
+import numpy as np
+import mlflow
+
+from hatedetection.prep.text_preparation import load_examples
+from hatedetection.score.batching import MicroBatcher
+from hatedetection.score.server import ScoringServer
+
+async def run_load_test(host: str, port: int, texts: List[str], concurrency: int = 32,
+                        n_requests: int = 1000, texts_per_request: int = 1,
+                        seed: int = 0) -> Dict[str, float]:
+    """
+    Sends requests to a scoring server from `concurrency` clients at the same time. Each client
+    sends its next request as soon as it gets the response of the previous one.
+
+    Parameters
+    ----------
+    host: str
+        The host of the server.
+    port: int
+        The port of the server.
+    texts: List[str]
+        The texts to sample requests from.
+    concurrency: int
+        Number of concurrent clients.
+    n_requests: int
+        Total number of requests to send.
+    texts_per_request: int
+        Number of texts on each request.
+    seed: int
+        Seed used to sample the texts.
+
+    Returns
+    -------
+    Dict[str, float]
+        The keys `requests`, `errors`, `shed`, `throughput` (texts per second), `latency_p50_ms`
+        and `latency_p99_ms`. Latencies only include successful requests.
+    """
+    rng = random.Random(seed)
+    payloads = [json.dumps({ 'text': rng.sample(texts, texts_per_request) }).encode('utf-8')
+                for _ in range(n_requests)]
+    latencies, statuses = [], []
+
+    async def client(requests: List[bytes]):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for body in requests:
+                start = time.perf_counter()
+                writer.write(f"POST /score HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+                await writer.drain()
+                status = await _read_status(reader)
+                statuses.append(status)
+                if status == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(payloads[idx::concurrency]) for idx in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    statuses = np.asarray(statuses)
+    return {
+        'requests': len(statuses),
+        'errors': int(((statuses != 200) & (statuses != 503)).sum()),
+        'shed': int((statuses == 503).sum()),
+        'throughput': len(latencies) * texts_per_request / elapsed,
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies else float('nan'),
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if latencies else float('nan'),
+    }
+
+async def _read_status(reader: asyncio.StreamReader) -> int:
+    status = int((await reader.readline()).split(b' ')[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+
+    await reader.readexactly(length)
+    return status
+
+def benchmark_serving(model_path: str, eval_dataset: str, concurrency: int = 32, n_requests: int = 1000,
+                      texts_per_request: int = 1, max_batch_tokens: int = 16384, max_batch_size: int = 256,
+                      max_wait_ms: float = 5.0, max_queue_size: int = 1024) -> Dict[str, Dict[str, float]]:
+    """
+    Benchmarks a model served with and without micro-batching, using texts of the evaluation
+    dataset. Results are logged in MLflow with the prefixes `batched_` and `unbatched_`.
+
+    Parameters
+    ----------
+    model_path: str
+        The MLflow URI or path of the model.
+    eval_dataset: str
+        Path to the dataset to sample texts from.
+    concurrency: int
+        Number of concurrent clients.
+    n_requests: int
+        Total number of requests to send.
+    texts_per_request: int
+        Number of texts on each request.
+    max_batch_tokens: int
+        Maximum number of estimated tokens on each micro-batch.
+    max_batch_size: int
+        Maximum number of texts on each micro-batch.
+    max_wait_ms: float
+        Maximum time, in milliseconds, a request waits for other requests to join its batch.
+    max_queue_size: int
+        Maximum number of requests waiting to be scored.
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        The results of the load test for the keys `batched` and `unbatched`.
+    """
+    model = mlflow.pyfunc.load_model(model_path)
+    texts, _ = load_examples(eval_dataset)
+    texts = texts.astype(str).tolist()
+
+    def predict(batch):
+        return model.predict(batch.to_frame('text'))
+
+    configurations = {
+        'batched': MicroBatcher(predict, max_batch_tokens=max_batch_tokens, max_batch_size=max_batch_size,
+                                max_wait_ms=max_wait_ms, max_queue_size=max_queue_size),
+        'unbatched': MicroBatcher(predict, max_batch_size=texts_per_request, max_wait_ms=0,
+                                  max_queue_size=max_queue_size),
+    }
+
+    async def run(batcher: MicroBatcher) -> Dict[str, float]:
+        server = ScoringServer(batcher, port=0)
+        await server.start()
+        try:
+            results = await run_load_test(server.host, server.port, texts, concurrency, n_requests,
+                                          texts_per_request)
+        finally:
+            await server.stop()
+        results['mean_batch_size'] = batcher.stats()['mean_batch_size']
+        return results
+
+    report = {}
+    for name, batcher in configurations.items():
+        report[name] = asyncio.run(run(batcher))
+        logging.info(f"[INFO] Load test {name}: {report[name]}")
+        mlflow.log_metrics({ f"{name}_{metric}": value for metric, value in report[name].items() })
+
+    return report
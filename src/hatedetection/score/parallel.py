@@ -0,0 +1,139 @@
+"""
+Batch scoring with multiple processes. The model is loaded once and worker processes are forked
+from the parent, so they share the weights instead of loading their own copy. Each worker runs a
+limited number of threads, which scales better than a single process using all the cores on
+short sequences.
+"""
+import os
+import time
+import math
+import logging
+import multiprocessing
+from typing import List
+
+import torch
+import mlflow
+import pandas as pd
+
+from hatedetection.model.backends import OnnxBackend
+from hatedetection.model.hate_detection_classifier import load_classifier
+from hatedetection.prep.arguments import parse_int_list
+from hatedetection.prep.text_preparation import load_examples
+
+_WORKER_CLASSIFIER = None
+
+def score_parallel(classifier, text: pd.Series, num_workers: int = None, threads_per_worker: int = None,
+                   shard_size: int = None) -> pd.DataFrame:
+    """
+    Scores texts with multiple worker processes that share the weights of the model. Rows are
+    split in contiguous shards which are distributed across the workers, and results are merged
+    back in the same order than the input.
+
+    Parameters
+    ----------
+    classifier: HateDetectionClassifier
+        The classifier, already built or loaded.
+    text: pd.Series
+        The texts to score.
+    num_workers: int
+        Number of worker processes. Defaults to the number of cores.
+    threads_per_worker: int
+        Number of threads each worker uses to run the model. Defaults to the number of cores
+        divided by the number of workers.
+    shard_size: int
+        Number of rows on each shard. Defaults to splitting the rows in 4 shards per worker.
+
+    Returns
+    -------
+    pd.DataFrame
+        The results of `predict`, one row per text.
+    """
+    global _WORKER_CLASSIFIER # pylint: disable=global-statement
+
+    cores = os.cpu_count() or 1
+    num_workers = num_workers or cores
+    threads_per_worker = threads_per_worker or max(1, cores // num_workers)
+    shard_size = shard_size or max(1, math.ceil(len(text) / (num_workers * 4)))
+
+    text = text.reset_index(drop=True)
+    shards = [text.iloc[start:start + shard_size] for start in range(0, len(text), shard_size)]
+    if num_workers == 1 or len(shards) <= 1:
+        torch.set_num_threads(threads_per_worker)
+        return classifier.predict(None, text)
+
+    # Tensors in shared memory are not copied when the reference counts of the objects holding
+    # them are updated in the workers, as it happens with copy-on-write pages.
+    classifier.model.share_memory()
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    _WORKER_CLASSIFIER = classifier
+
+    logging.info(f"[INFO] Scoring {len(text)} rows in {len(shards)} shards with {num_workers} workers "
+                 f"and {threads_per_worker} threads per worker")
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(num_workers, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+            results = pool.map(_score_shard, shards, chunksize=1)
+    finally:
+        _WORKER_CLASSIFIER = None
+
+    return pd.concat(results, ignore_index=True)
+
+def _init_worker(threads: int):
+    torch.set_num_threads(threads)
+    backend = getattr(_WORKER_CLASSIFIER, '_backend', None)
+    if isinstance(backend, OnnxBackend):
+        _WORKER_CLASSIFIER._backend = OnnxBackend(backend.model_path, intra_op_num_threads=threads)
+
+def _score_shard(shard: pd.Series) -> pd.DataFrame:
+    return _WORKER_CLASSIFIER.predict(None, shard)
+
+def benchmark_scaling(model_path: str, eval_dataset: str, workers: List[int] = (1, 2, 4, 8),
+                      threads: List[int] = (1, 2, 4), rows: int = 10000) -> pd.DataFrame:
+    """
+    Measures the throughput of `score_parallel` for combinations of number of workers and
+    threads per worker. Combinations using more threads than cores are skipped. Results are
+    logged in MLflow as the artifact `scaling.csv` and as metrics.
+
+    Parameters
+    ----------
+    model_path: str
+        The MLflow URI or path of the model.
+    eval_dataset: str
+        Path to the dataset with the texts to score.
+    workers: List[int]
+        The numbers of workers to try.
+    threads: List[int]
+        The numbers of threads per worker to try.
+    rows: int
+        The number of rows to score on each run. Texts of the dataset are repeated if needed.
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe with the columns `workers`, `threads`, `rows`, `seconds` and `rows_per_second`.
+    """
+    classifier = load_classifier(model_path)
+    classifier.cache_size = 0
+    texts, _ = load_examples(eval_dataset)
+    texts = pd.Series(texts.astype(str).tolist() * math.ceil(rows / len(texts))).iloc[:rows]
+
+    results = []
+    cores = os.cpu_count() or 1
+    for num_workers in parse_int_list(workers):
+        for threads_per_worker in parse_int_list(threads):
+            if num_workers * threads_per_worker > cores:
+                continue
+
+            classifier._cache = None
+            started = time.perf_counter()
+            score_parallel(classifier, texts, num_workers, threads_per_worker)
+            elapsed = time.perf_counter() - started
+
+            results.append({ 'workers': num_workers, 'threads': threads_per_worker, 'rows': len(texts),
+                             'seconds': elapsed, 'rows_per_second': len(texts) / elapsed })
+            logging.info(f"[INFO] Scaling benchmark: {results[-1]}")
+            mlflow.log_metric(f"rows_per_second_w{num_workers}_t{threads_per_worker}", len(texts) / elapsed)
+
+    report = pd.DataFrame(results)
+    mlflow.log_text(report.to_csv(index=False), 'scaling.csv')
+    return report
@@ -0,0 +1,185 @@
+"""
+End to end scaling harness. Synthetic corpora of increasing sizes are generated and each of them
+goes through loading, dataset construction and prediction, measuring wall time, peak resident
+memory and throughput of each stage. The results describe how the pipeline scales before running
+it on a real corpus of that size.
+"""
+import os
+import sys
+import time
+import logging
+import resource
+import threading
+from typing import Callable, Dict, List, Tuple, Any
+
+import mlflow
+import pandas as pd
+
+from hatedetection.prep.arguments import parse_int_list
+from hatedetection.prep.synthetic import generate_corpus
+from hatedetection.prep.text_preparation import load_examples
+from hatedetection.train.datasets import ClassificationDataset
+from hatedetection.model.hate_detection_classifier import load_classifier
+
+class PeakMemorySampler:
+    """
+    Samples the resident memory of the process in a background thread to find its peak while a
+    block of code runs. Unlike `ru_maxrss`, which is the peak of the whole life of the process,
+    the peak is reset on each use. On systems without `/proc`, `ru_maxrss` is used instead.
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current_rss() -> int:
+        """
+        Returns the resident memory of the process, in bytes.
+        """
+        try:
+            with open('/proc/self/statm', 'r', encoding='utf-8') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            # `ru_maxrss` is reported in kilobytes on Linux and in bytes on macOS
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current_rss())
+
+    def __enter__(self):
+        self.peak = self.current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current_rss())
+
+def measure_stage(stage: Callable[[], Any]) -> Tuple[Any, Dict[str, float]]:
+    """
+    Runs a stage of the pipeline measuring its wall time and peak resident memory.
+
+    Parameters
+    ----------
+    stage: Callable[[], Any]
+        The stage to run.
+
+    Returns
+    -------
+    Tuple[Any, Dict[str, float]]
+        What the stage returned, along with the keys `seconds` and `peak_rss_mb`.
+    """
+    with PeakMemorySampler() as sampler:
+        started = time.perf_counter()
+        result = stage()
+        elapsed = time.perf_counter() - started
+
+    return result, { 'seconds': elapsed, 'peak_rss_mb': sampler.peak / 2 ** 20 }
+
+def measure_pipeline(classifier, data_path: str, max_length: int = 400,
+                     max_predict_rows: int = None) -> pd.DataFrame:
+    """
+    Runs `load_examples`, `ClassificationDataset` and `predict` over a dataset, measuring each stage.
+
+    Parameters
+    ----------
+    classifier: HateDetectionClassifier
+        The classifier whose tokenizer is used to build the dataset and whose model predicts.
+    data_path: str
+        The path to the dataset.
+    max_length: int
+        Maximum number of tokens on each example of the dataset.
+    max_predict_rows: int
+        The maximum number of rows to predict. Prediction is much slower than the other stages,
+        so it can be measured on a sample of the rows. If None, all the rows are used.
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe with the columns `stage`, `rows`, `seconds`, `rows_per_second` and `peak_rss_mb`.
+    """
+    results = []
+    def record(stage: str, rows: int, measures: Dict[str, float]):
+        results.append(dict(stage=stage, rows=rows, rows_per_second=rows / measures['seconds'], **measures))
+
+    (text, labels), measures = measure_stage(lambda: load_examples(data_path))
+    record('load_examples', len(text), measures)
+
+    _, measures = measure_stage(lambda: ClassificationDataset(examples=text, labels=labels,
+                                                              tokenizer=classifier.tokenizer,
+                                                              max_length=max_length))
+    record('dataset', len(text), measures)
+
+    sample = text.iloc[:max_predict_rows] if max_predict_rows else text
+    classifier._cache = None
+    _, measures = measure_stage(lambda: classifier.predict(None, sample))
+    record('predict', len(sample), measures)
+
+    return pd.DataFrame(results, columns=['stage', 'rows', 'seconds', 'rows_per_second', 'peak_rss_mb'])
+
+def run_scaling(model_path: str, output_dir: str, scales: List[int] = (10000, 100000, 1000000),
+                file_format: str = 'parquet', max_length: int = 400, max_predict_rows: int = 10000,
+                duplicate_rate: float = 0.0, hate_rate: float = 0.22, mean_words: float = 16,
+                random_state: int = 0) -> pd.DataFrame:
+    """
+    Generates a synthetic corpus for each scale and measures the pipeline on it. Results are
+    logged in MLflow as the artifact `scaling_curve.csv` and as metrics, using the scale as step,
+    so each stage is plotted as a curve.
+
+    Parameters
+    ----------
+    model_path: str
+        The MLflow URI or path of the model.
+    output_dir: str
+        The directory where the corpora are generated.
+    scales: List[int]
+        The number of rows of each corpus. Comma separated strings, like `10000,100000`, are
+        also accepted.
+    file_format: str
+        The format of the corpora. Either `csv` or `parquet`.
+    max_length: int
+        Maximum number of tokens on each example of the dataset.
+    max_predict_rows: int
+        The maximum number of rows to predict on each scale.
+    duplicate_rate: float
+        The proportion of rows that repeat the text of a previous row.
+    hate_rate: float
+        The proportion of rows labeled as hate.
+    mean_words: float
+        The median number of words of each text.
+    random_state: int
+        Seed of the generator.
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe with the columns `scale`, `stage`, `rows`, `seconds`, `rows_per_second` and
+        `peak_rss_mb`.
+    """
+    classifier = load_classifier(model_path)
+    classifier.cache_size = 0
+
+    curves = []
+    for scale in sorted(parse_int_list(scales)):
+        corpus_dir = os.path.join(output_dir, f"{scale}")
+        generate_corpus(corpus_dir, scale, file_format=file_format, duplicate_rate=duplicate_rate,
+                        hate_rate=hate_rate, mean_words=mean_words, random_state=random_state)
+
+        report = measure_pipeline(classifier, corpus_dir, max_length, max_predict_rows)
+        report.insert(0, 'scale', scale)
+        curves.append(report)
+        logging.info(f"[INFO] Scaling curve at {scale} rows: {report.to_dict('records')}")
+
+        mlflow.log_metrics({ f"{row['stage']}_{name}": row[name] for row in report.to_dict('records')
+                             for name in ('seconds', 'rows_per_second', 'peak_rss_mb') }, step=scale)
+
+    curve = pd.concat(curves, ignore_index=True)
+    mlflow.log_text(curve.to_csv(index=False), 'scaling_curve.csv')
+    return curve
@@ -0,0 +1,216 @@
+"""
+A minimal HTTP front-end, built only with `asyncio`, that serves a hate detection model through a
+`MicroBatcher`. It is a local stand-in of the online endpoint used to test and benchmark the
+micro-batching layer. Routes:
+ - `POST /score`: scores a JSON body with the shape `{"text": [...]}` or `[{"text": ...}, ...]`.
+   Returns `[{"hate": ..., "confidence": ...}, ...]`, or 503 when the server is overloaded.
+   Malformed requests get a 400 and bodies larger than `max_body_bytes` get a 413.
+ - `GET /health`: returns the counters of the batcher.
+ - `GET /metrics`: returns the telemetry of the model in the Prometheus text format, when enabled.
+"""
+import json
+import asyncio
+import logging
+from typing import List, Tuple
+
+
+from hatedetection.score.batching import MicroBatcher, Overloaded
+from hatedetection.model.telemetry import DISABLED, render_prometheus
+from hatedetection.model.hate_detection_classifier import load_classifier
+
+STATUS_REASONS = { 200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+                   500: 'Internal Server Error', 503: 'Service Unavailable' }
+
+class BadRequest(Exception):
+    """
+    Raised when a request can't be read. The connection is answered with `status` and closed.
+    """
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class ScoringServer:
+    """
+    Serves requests over HTTP, coalescing them in micro-batches.
+
+    Parameters
+    ----------
+    batcher: MicroBatcher
+        The batcher used to score the requests.
+    host: str
+        The host to bind.
+    port: int
+        The port to bind. Use 0 to pick any free port.
+    telemetry: Telemetry
+        The telemetry served on `/metrics`. Disabled by default.
+    max_body_bytes: int
+        Maximum size of the body of a request. Larger requests are rejected without reading them.
+    """
+    def __init__(self, batcher: MicroBatcher, host: str = '127.0.0.1', port: int = 5001, telemetry = DISABLED,
+                 max_body_bytes: int = 1 << 20):
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.telemetry = telemetry
+        self.max_body_bytes = max_body_bytes
+        self._server = None
+
+    async def start(self):
+        """
+        Starts the batcher and starts listening for requests.
+        """
+        await self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"[INFO] Serving on http://{self.host}:{self.port}")
+
+    async def stop(self):
+        """
+        Stops listening for requests and stops the batcher.
+        """
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader, self.max_body_bytes)
+                except BadRequest as error:
+                    # The rest of the request can't be trusted, so the connection is closed
+                    _write_response(writer, error.status, { 'error': str(error) })
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                method, path, body = request
+                status, payload = await self._route(method, path, body)
+                _write_response(writer, status, payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, object]:
+        if method == 'GET' and path == '/health':
+            return 200, self.batcher.stats()
+        if method == 'GET' and path == '/metrics' and self.telemetry.enabled:
+            return 200, render_prometheus(self.telemetry)
+        if method != 'POST' or path != '/score':
+            return 404, { 'error': f"{method} {path} is not supported" }
+
+        try:
+            texts = parse_texts(json.loads(body))
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, { 'error': f"Invalid request: {error}" }
+
+        try:
+            results = await self.batcher.submit(texts)
+        except Overloaded as error:
+            return 503, { 'error': str(error) }
+        except Exception as error: # pylint: disable=broad-except
+            return 500, { 'error': str(error) }
+
+        return 200, results.to_dict('records')
+
+def parse_texts(payload) -> List[str]:
+    """
+    Gets the texts of a request, in either `{"text": [...]}` or `[{"text": ...}, ...]` format.
+    """
+    if isinstance(payload, dict):
+        texts = payload['text']
+        texts = [texts] if isinstance(texts, str) else list(texts)
+    else:
+        texts = [record['text'] for record in payload]
+
+    if not all(isinstance(text, str) for text in texts):
+        raise TypeError("All the texts have to be strings")
+
+    return texts
+
+async def _read_request(reader: asyncio.StreamReader, max_body_bytes: int):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    parts = request_line.decode('latin-1').split(' ', 2)
+    if len(parts) != 3:
+        raise BadRequest(400, f"Invalid request line: {request_line[:100]!r}")
+    method, path, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError as error:
+        raise BadRequest(400, f"Invalid Content-Length: {headers['content-length'][:100]}") from error
+    if length < 0:
+        raise BadRequest(400, f"Invalid Content-Length: {length}")
+    if length > max_body_bytes:
+        raise BadRequest(413, f"The body has {length} bytes and the maximum is {max_body_bytes}")
+
+    body = await reader.readexactly(length)
+    return method, path, body
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload):
+    if isinstance(payload, str):
+        body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+    else:
+        body, content_type = json.dumps(payload, default=float).encode('utf-8'), 'application/json'
+    writer.write(f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n"
+                 f"Content-Type: {content_type}\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+
+def serve(model_path: str, host: str = '127.0.0.1', port: int = 5001, max_batch_tokens: int = 16384,
+          max_batch_size: int = 256, max_wait_ms: float = 5.0, max_queue_size: int = 1024,
+          telemetry: bool = False, max_body_bytes: int = 1 << 20):
+    """
+    Loads a model from MLflow and serves it until the process is interrupted.
+
+    Parameters
+    ----------
+    model_path: str
+        The MLflow URI or path of the model.
+    host: str
+        The host to bind.
+    port: int
+        The port to bind.
+    max_batch_tokens: int
+        Maximum number of estimated tokens on each micro-batch.
+    max_batch_size: int
+        Maximum number of texts on each micro-batch.
+    max_wait_ms: float
+        Maximum time, in milliseconds, a request waits for other requests to join its batch.
+    max_queue_size: int
+        Maximum number of requests waiting to be scored.
+    telemetry: bool
+        Indicates if the telemetry of the model is recorded and served on `/metrics`. The sinks
+        given in `HATEDETECTION_TELEMETRY` are used too.
+    max_body_bytes: int
+        Maximum size, in bytes, of the body of a request.
+    """
+    classifier = load_classifier(model_path)
+    if telemetry and not classifier.telemetry.enabled:
+        classifier.enable_telemetry()
+    batcher = MicroBatcher(lambda texts: classifier.predict(None, texts),
+                           max_batch_tokens=max_batch_tokens, max_batch_size=max_batch_size,
+                           max_wait_ms=max_wait_ms, max_queue_size=max_queue_size)
+
+    async def run():
+        server = ScoringServer(batcher, host, port, classifier.telemetry, max_body_bytes)
+        await server.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
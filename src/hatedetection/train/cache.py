@@ -0,0 +1,12 @@
+"""
+Provides an on-disk cache for tokenized datasets, so the same corpus doesn't have to be tokenized
+again when the data, the tokenizer and the preprocessing parameters have not changed.
+"""
+from hatedetection.prep.storage import ArrayStore
+
+class TokenizationCache(ArrayStore):
+    """
+    Stores the arrays of tokenized datasets (see `ClassificationDataset.to_arrays`) in a
+    directory. Entries are identified by keys built with `build_cache_key` from the fingerprints
+    of the data and the tokenizer and the preprocessing parameters.
+    """
@@ -1,43 +1,199 @@
 """
 Provides a convenient way to work with text datasets with torch.
 """
-from typing import List
+import itertools
+from typing import Any, Dict, List, Union
 
 import torch
 import numpy as np
 from transformers import PreTrainedTokenizer
-from transformers.data.processors.utils import InputFeatures
+
+ARRAYS_VERSION = 3
 
 class ClassificationDataset(torch.utils.data.Dataset):
     """
     Provides a convenient way to work with text classification datasets in `torch` and
     `transformers`. This class handles the data transformation from text samples to tensors in
-    `torch` and transformed outputs are ready to be used in `transformers` pipelines.
+    `torch` and transformed outputs are ready to be used in `transformers` pipelines. Examples
+    can be either text samples or windows of token ids generated by `tokenize_to_sequences`, in
+    which case they are not tokenized again.
+
+    Token ids of all the sequences are stored without padding in a single `int32` buffer along
+    with the offsets where each sequence starts. Items are returned as tensors that are views
+    over this buffer, so batches have to be padded when collated using `PaddingCollator`.
     """
-    def __init__(self, examples: List[str], labels: List[str],
+    def __init__(self, examples: Union[List[str], List[List[int]]], labels: List[str],
                  tokenizer: PreTrainedTokenizer, max_length: int = 400):
-        #return_tensors='pt' tokenizer.model_max_length
-        self.batch_encoding = tokenizer.batch_encode_plus(list(examples),
-                                                          padding='longest',
-                                                          truncation=True,
-                                                          max_length=max_length,
-                                                          return_attention_mask=True,
-                                                          return_tensors = None)
-        self.batch_labels = list(labels)
-        self.batch_size = len(examples)
+        examples = list(examples)
+        if examples and not isinstance(examples[0], str):
+            sep_token_id = getattr(tokenizer, 'sep_token_id', None)
+            input_ids = [_truncate_window(list(ids), max_length, sep_token_id) for ids in examples]
+        else:
+            input_ids = tokenizer(examples,
+                                  padding=False,
+                                  truncation=True,
+                                  max_length=max_length,
+                                  return_attention_mask=False,
+                                  return_token_type_ids=False,
+                                  return_tensors = None)['input_ids']
+
+        lengths = np.fromiter(map(len, input_ids), dtype=np.int64, count=len(input_ids))
+        self.offsets = np.zeros(len(input_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+
+        self.input_ids = np.fromiter(itertools.chain.from_iterable(input_ids), dtype=np.int32,
+                                     count=int(self.offsets[-1]))
+        self._set_labels(np.asarray(labels))
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'ClassificationDataset':
+        """
+        Creates a dataset from the arrays returned by `to_arrays`. Arrays are used as they are,
+        so memory-mapped arrays are not copied.
+
+        Parameters
+        ----------
+        arrays: Dict[str, np.ndarray]
+            The arrays of the dataset, with the keys `input_ids`, `offsets` and `labels`.
+
+        Returns
+        -------
+        ClassificationDataset
+            The dataset.
+        """
+        dataset = cls.__new__(cls)
+        dataset.input_ids = arrays['input_ids']
+        dataset.offsets = arrays['offsets']
+        dataset._set_labels(arrays['labels'])
+
+        return dataset
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Gets all the arrays that represent the dataset, including the token ids, the offsets
+        where each sequence starts and the labels. Use `from_arrays` to create the dataset again.
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            The arrays of the dataset in the keys `input_ids`, `offsets` and `labels`.
+        """
+        return { 'input_ids': self.input_ids, 'offsets': self.offsets, 'labels': self.batch_labels }
+
+    def _set_labels(self, labels: np.ndarray):
+        self.batch_labels = labels
+        self.batch_size = len(labels)
 
         label_list = np.unique(labels)
         self.label_map = { label: idx for idx, label in enumerate(label_list) }
+        self.label_ids = np.searchsorted(label_list, labels)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """
+        Gets the number of tokens of each of the sequences in the dataset.
+        """
+        return np.diff(self.offsets)
 
-    def __getitem__(self, idx: int):
-        inputs = { feat: self.batch_encoding[feat][idx] for feat in self.batch_encoding }
-        return InputFeatures(**inputs, label=self.label_map[self.batch_labels[idx]])
+    def padding_ratio(self, batch_size: int = None, group_by_length: bool = False,
+                      seed: int = 0) -> float:
+        """
+        Computes the proportion of padding tokens the model would process over the dataset.
+
+        Parameters
+        ----------
+        batch_size: int
+            The size of the batches. If None, all the sequences are padded to the longest one
+            in the dataset, as when the whole dataset is padded at once. Otherwise, each batch
+            is padded to its own longest sequence.
+        group_by_length: bool
+            Indicates if batches are built grouping sequences of similar lengths, as
+            `LengthGroupedSampler` does. Otherwise, batches are built sequentially.
+        seed: int
+            Seed of the random permutation used to group sequences by length.
+
+        Returns
+        -------
+        float
+            The proportion of padding tokens, between 0 and 1.
+        """
+        lengths = self.lengths
+        if not len(lengths):
+            return 0.0
+        if not batch_size:
+            return float(1 - lengths.sum() / (lengths.max() * len(lengths)))
+
+        if group_by_length:
+            indices = np.random.default_rng(seed).permutation(len(lengths))
+            megabatch_size = batch_size * 50
+            indices = np.concatenate([sorted(indices[start:start + megabatch_size], key=lambda idx: -lengths[idx])
+                                      for start in range(0, len(indices), megabatch_size)])
+            lengths = lengths[indices]
+
+        padded = sum(lengths[start:start + batch_size].max() * len(lengths[start:start + batch_size])
+                     for start in range(0, len(lengths), batch_size))
+        return float(1 - lengths.sum() / padded)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        return { 'input_ids': torch.from_numpy(self.input_ids[self.offsets[idx]:self.offsets[idx + 1]]),
+                 'label': int(self.label_ids[idx]) }
 
     def __len__(self) -> int:
         return self.batch_size
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('input_ids', 'offsets', 'batch_labels'):
+            array = state[name]
+            if isinstance(array, np.memmap) and array.filename:
+                state[name] = ('memmap', array.filename, array.dtype.str, array.shape, array.offset)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            if isinstance(value, tuple) and value[0] == 'memmap':
+                _, filename, dtype, shape, offset = value
+                state[name] = np.memmap(filename, dtype=np.dtype(dtype), mode='c', shape=shape, offset=offset)
+        self.__dict__.update(state)
+
     def get_labels(self) -> List[str]:
         """
         Gets the list of all the labels in the dataset.
         """
         return list(self.label_map.keys())
+
+def _truncate_window(input_ids: List[int], max_length: int, sep_token_id: int = None) -> List[int]:
+    """
+    Truncates a window of token ids that already has special tokens around it. The trailing
+    separator is kept, so the window ends like the ones the model saw at training time.
+    """
+    if len(input_ids) <= max_length:
+        return input_ids
+    if sep_token_id is not None and input_ids[-1] == sep_token_id:
+        return input_ids[:max_length - 1] + [sep_token_id]
+    return input_ids[:max_length]
+
+class PaddingCollator:
+    """
+    Collates the items of a `ClassificationDataset` in a batch. Sequences are padded to the
+    longest one in the batch.
+    """
+    def __init__(self, pad_token_id: int = 0, pad_to_multiple_of: int = None):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        lengths = [len(feature['input_ids']) for feature in features]
+        max_length = max(lengths)
+        if self.pad_to_multiple_of:
+            max_length = -(-max_length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = torch.full((len(features), max_length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), max_length), dtype=torch.long)
+        for row, (feature, length) in enumerate(zip(features, lengths)):
+            input_ids[row, :length] = feature['input_ids']
+            attention_mask[row, :length] = 1
+
+        return { 'input_ids': input_ids,
+                 'attention_mask': attention_mask,
+                 'labels': torch.tensor([feature['label'] for feature in features], dtype=torch.long) }
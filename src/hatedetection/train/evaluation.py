@@ -0,0 +1,74 @@
+"""
+Evaluation of models during training with metrics that are accumulated batch by batch, instead of
+gathering the logits of the whole evaluation dataset in memory to compute metrics at the end.
+"""
+import torch
+import torch.distributed as dist
+from transformers import Trainer
+
+from hatedetection.model.statistics import StreamingMetrics
+
+class StreamingEvalTrainer(Trainer):
+    """
+    A `Trainer` that updates a `StreamingMetrics` accumulator with the logits of each evaluation
+    batch and then discards them. Metrics are added to the results of `evaluate` with the same
+    names `compute_classification_metrics` produces, so it replaces `compute_metrics`. Calls to
+    `predict` still return the logits.
+
+    Parameters
+    ----------
+    calibration_bins: int
+        Number of bins of confidence used to measure calibration. If 0, calibration is not measured.
+    kwargs:
+        Arguments of `Trainer`.
+    """
+    def __init__(self, *args, calibration_bins: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streaming_metrics = StreamingMetrics(self.model.config.num_labels, calibration_bins)
+        self._streaming = False
+
+    def evaluate(self, *args, **kwargs):
+        self._streaming = True
+        try:
+            return super().evaluate(*args, **kwargs)
+        finally:
+            self._streaming = False
+
+    def prediction_step(self, model, inputs, prediction_loss_only, ignore_keys=None):
+        if not self._streaming:
+            return super().prediction_step(model, inputs, prediction_loss_only, ignore_keys)
+
+        loss, logits, labels = super().prediction_step(model, inputs, False, ignore_keys)
+        # Batches without labels can't be scored, so they don't count towards the metrics
+        if labels is None:
+            return loss, None, None
+
+        if isinstance(logits, (tuple, list)):
+            logits = logits[0]
+        self.streaming_metrics.update(logits.detach().float().cpu().numpy(), labels.detach().cpu().numpy())
+        return loss, None, None
+
+    def evaluation_loop(self, *args, **kwargs):
+        if not self._streaming:
+            return super().evaluation_loop(*args, **kwargs)
+
+        self.streaming_metrics.reset()
+        output = super().evaluation_loop(*args, **kwargs)
+        self._reduce_metrics()
+
+        prefix = kwargs.get('metric_key_prefix', 'eval')
+        output.metrics.update({ f"{prefix}_{name}": value for name, value in self.streaming_metrics.compute().items() })
+        return output
+
+    def _reduce_metrics(self):
+        """
+        Sums the counts accumulated by each process when evaluation is distributed.
+        """
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+
+        metrics = self.streaming_metrics
+        for name in ('confusion', 'bin_counts', 'bin_confidence', 'bin_correct'):
+            counts = torch.as_tensor(getattr(metrics, name), dtype=torch.float64, device=self.args.device)
+            dist.all_reduce(counts)
+            setattr(metrics, name, counts.cpu().numpy().astype(getattr(metrics, name).dtype))
@@ -0,0 +1,231 @@
+"""
+Sequence packing for training. Tweets are much shorter than the maximum length of the model, so
+several examples are packed in each sequence instead of padding each of them. Attention is
+restricted to the tokens of the same example with a block diagonal mask, positions start again
+at each example, and the first token of each example (`[CLS]`) is pooled to classify it, so each
+example is seen by the model as if it were alone in the sequence.
+"""
+import os
+import bisect
+import importlib.util
+from typing import Any, Dict, List
+
+import torch
+import numpy as np
+from transformers import PreTrainedModel
+from transformers.modeling_outputs import SequenceClassifierOutput
+
+from hatedetection.train.datasets import ClassificationDataset, PaddingCollator
+from hatedetection.train.evaluation import StreamingEvalTrainer
+
+class PackedDataset(torch.utils.data.Dataset):
+    """
+    Packs the examples of a `ClassificationDataset` in sequences of up to `max_length` tokens
+    using best fit decreasing: examples are taken from the longest to the shortest and each one
+    goes to the pack with the least room left that can hold it. Examples longer than `max_length`
+    are not truncated, they get a pack of their own. Attention is computed densely over each
+    pack, so its cost grows with the square of `max_length`: packs only a few times longer than
+    the typical example waste little room without spending much on attention. Items hold the
+    token ids of all the examples of a pack, the length of each of them and their labels, and
+    have to be collated with `PackedCollator`.
+
+    Parameters
+    ----------
+    dataset: ClassificationDataset
+        The examples to pack.
+    max_length: int
+        Maximum number of tokens on each pack, unless it holds a single longer example.
+    """
+    def __init__(self, dataset: ClassificationDataset, max_length: int = 128):
+        self.dataset = dataset
+        self.max_length = max_length
+        self.lengths = dataset.lengths
+
+        # Packs are grouped by the room they have left. Only the distinct values of room are
+        # kept sorted, which are at most `max_length`, so finding the best pack is cheap.
+        packs, by_room, rooms = [], {}, []
+        for idx in np.argsort(-self.lengths, kind='stable'):
+            length = int(self.lengths[idx])
+            position = bisect.bisect_left(rooms, length)
+            if position < len(rooms):
+                room = rooms[position]
+                pack = by_room[room].pop()
+                if not by_room[room]:
+                    del rooms[position]
+            else:
+                room, pack = max_length, len(packs)
+                packs.append([])
+
+            packs[pack].append(idx)
+            room -= length
+            if room > 0:
+                if not by_room.get(room):
+                    by_room[room] = []
+                    bisect.insort(rooms, room)
+                by_room[room].append(pack)
+
+        self.pack_offsets = np.zeros(len(packs) + 1, dtype=np.int64)
+        np.cumsum([len(pack) for pack in packs], out=self.pack_offsets[1:])
+        self.order = np.fromiter((idx for pack in packs for idx in pack), dtype=np.int64,
+                                 count=int(self.pack_offsets[-1]))
+
+    @property
+    def num_examples(self) -> int:
+        """
+        Gets the number of examples in the packs.
+        """
+        return len(self.order)
+
+    def efficiency(self) -> float:
+        """
+        Computes the proportion of the tokens of the packs that belong to examples, as if the
+        packs shorter than `max_length` were padded to it.
+        """
+        pack_lengths = np.add.reduceat(self.lengths[self.order], self.pack_offsets[:-1]) if len(self) else []
+        return float(self.lengths.sum() / np.maximum(pack_lengths, self.max_length).sum()) if len(self) else 0.0
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        examples = self.order[self.pack_offsets[idx]:self.pack_offsets[idx + 1]]
+        input_ids, offsets = self.dataset.input_ids, self.dataset.offsets
+        return { 'input_ids': torch.from_numpy(np.concatenate([
+                    input_ids[offsets[example]:offsets[example + 1]] for example in examples
+                 ]).astype(np.int64)),
+                 'segment_lengths': torch.from_numpy(self.lengths[examples]),
+                 'label': torch.from_numpy(self.dataset.label_ids[examples].astype(np.int64)) }
+
+    def __len__(self) -> int:
+        return len(self.pack_offsets) - 1
+
+class PackedCollator:
+    """
+    Collates the items of a `PackedDataset` in a batch. Along with the padded token ids, it
+    returns the position of each token inside its example, the `segment_ids` of each token
+    (starting at 1, and 0 for padding) and the row and the position where each example starts.
+    Items of a `ClassificationDataset` are collated with `PaddingCollator`, so the same collator
+    can be used for evaluation.
+    """
+    def __init__(self, pad_token_id: int = 0, pad_to_multiple_of: int = None):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self._padding = PaddingCollator(pad_token_id, pad_to_multiple_of)
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        if 'segment_lengths' not in features[0]:
+            return self._padding(features)
+
+        lengths = [len(feature['input_ids']) for feature in features]
+        max_length = max(lengths)
+        if self.pad_to_multiple_of:
+            max_length = -(-max_length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = torch.full((len(features), max_length), self.pad_token_id, dtype=torch.long)
+        segment_ids = torch.zeros((len(features), max_length), dtype=torch.long)
+        position_ids = torch.zeros((len(features), max_length), dtype=torch.long)
+        segment_rows, segment_starts = [], []
+        for row, (feature, length) in enumerate(zip(features, lengths)):
+            segments = feature['segment_lengths'].long()
+            starts = torch.cumsum(segments, 0) - segments
+            input_ids[row, :length] = feature['input_ids']
+            segment_ids[row, :length] = torch.repeat_interleave(torch.arange(1, len(segments) + 1), segments)
+            position_ids[row, :length] = torch.arange(length) - torch.repeat_interleave(starts, segments)
+            segment_rows.append(torch.full((len(segments),), row, dtype=torch.long))
+            segment_starts.append(starts)
+
+        return { 'input_ids': input_ids,
+                 'segment_ids': segment_ids,
+                 'position_ids': position_ids,
+                 'segment_rows': torch.cat(segment_rows),
+                 'segment_starts': torch.cat(segment_starts),
+                 'labels': torch.cat([feature['label'] for feature in features]) }
+
+def block_diagonal_mask(segment_ids: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    """
+    Builds the attention mask that lets each token attend only to the tokens of its own example.
+    Versions of `transformers` with `masking_utils` take 4D masks as they are, with 0 where
+    attention is allowed and the minimum of the type elsewhere. Previous ones take a 3D mask of
+    0 and 1 and convert it themselves.
+
+    Parameters
+    ----------
+    segment_ids: torch.Tensor
+        The example each token belongs to, starting at 1, and 0 for padding.
+    dtype: torch.dtype
+        The type of the activations of the model.
+
+    Returns
+    -------
+    torch.Tensor
+        The mask, with shape `[batch, 1, length, length]` or `[batch, length, length]`.
+    """
+    allowed = (segment_ids[:, :, None] == segment_ids[:, None, :]) & (segment_ids[:, None, :] > 0)
+    if importlib.util.find_spec('transformers.masking_utils') is None:
+        return allowed.to(dtype)
+
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=segment_ids.device)
+    return mask.masked_fill_(~allowed, torch.finfo(dtype).min)[:, None, :, :]
+
+class PackedSequenceClassifier(torch.nn.Module):
+    """
+    Runs a sequence classification model over batches collated by `PackedCollator`, classifying
+    each of the examples of the packs. The model is shared, not copied, so it can be saved and
+    used for inference as usual once trained. Batches without `segment_ids` are passed to the
+    model as they are.
+
+    Only models that pool the first token with a `pooler` and classify it with `dropout` and
+    `classifier` layers are supported, like `BertForSequenceClassification`.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The sequence classification model.
+    """
+    def __init__(self, model: PreTrainedModel):
+        super().__init__()
+        if getattr(model.base_model, 'pooler', None) is None or not hasattr(model, 'classifier') \
+                or not hasattr(model, 'dropout'):
+            raise ValueError(f"Packing is not supported by {type(model).__name__}. The model needs a pooler "
+                             "and a classifier.")
+        self.model = model
+        self.config = model.config
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor = None, labels: torch.Tensor = None,
+                segment_ids: torch.Tensor = None, position_ids: torch.Tensor = None,
+                segment_rows: torch.Tensor = None, segment_starts: torch.Tensor = None) -> SequenceClassifierOutput:
+        if segment_ids is None:
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+
+        mask = block_diagonal_mask(segment_ids, self.model.dtype)
+        hidden_states = self.model.base_model(input_ids=input_ids, attention_mask=mask,
+                                              position_ids=position_ids)[0]
+        pooled = self.model.base_model.pooler(hidden_states[segment_rows, segment_starts][:, None, :])
+        logits = self.model.classifier(self.model.dropout(pooled))
+
+        loss = None
+        if labels is not None:
+            loss = torch.nn.functional.cross_entropy(logits.view(-1, self.config.num_labels), labels.view(-1))
+        return SequenceClassifierOutput(loss=loss, logits=logits)
+
+    def load_state_dict(self, state_dict: Dict[str, torch.Tensor], strict: bool = True, **kwargs):
+        # Checkpoints saved by `PackedTrainer` hold the weights of the wrapped model
+        if not any(name.startswith('model.') for name in state_dict):
+            return self.model.load_state_dict(state_dict, strict, **kwargs)
+        return super().load_state_dict(state_dict, strict, **kwargs)
+
+class PackedTrainer(StreamingEvalTrainer):
+    """
+    A `StreamingEvalTrainer` for a `PackedSequenceClassifier`. Checkpoints hold the wrapped model
+    saved with `save_pretrained`, so they can be loaded with `from_pretrained` as the checkpoints
+    of models trained without packing, instead of a state dict with the keys of the wrapper.
+    """
+    def _save(self, output_dir: str = None, state_dict: Dict[str, torch.Tensor] = None):
+        if not isinstance(self.model, PackedSequenceClassifier):
+            return super()._save(output_dir, state_dict)
+
+        output_dir = output_dir if output_dir is not None else self.args.output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        if state_dict is not None:
+            state_dict = { name[len('model.'):]: value for name, value in state_dict.items()
+                           if name.startswith('model.') }
+        self.model.model.save_pretrained(output_dir, state_dict=state_dict)
+        torch.save(self.args, os.path.join(output_dir, 'training_args.bin'))
+        return None
@@ -0,0 +1,187 @@
+"""
+Profiling of training jobs with `torch.profiler`. A window of training steps, and optionally of
+evaluation steps, is profiled and the results are logged in MLflow as Chrome traces, tables of
+the time and memory of each operator, and memory timelines. Time spent waiting for the data
+loader shows up as the `enumerate(DataLoader)` operators.
+"""
+import os
+import logging
+from typing import Dict
+
+import mlflow
+import pandas as pd
+import torch
+from torch.profiler import ProfilerActivity, profile, schedule
+from transformers import TrainerCallback
+
+class ProfilerCallback(TrainerCallback):
+    """
+    Profiles a window of steps of a `Trainer`. Training steps follow the schedule of
+    `torch.profiler`: `wait` steps are skipped, then `warmup` steps are traced but discarded, and
+    `active` steps are recorded, `repeat` times. During evaluation, the first step is skipped, the
+    next one is a warmup and the following `eval_steps` are recorded, only for the first evaluation that doesn't overlap
+    with the training window. CUDA activity is profiled only when a GPU is available.
+
+    Parameters
+    ----------
+    output_dir: str
+        The directory where the results are written before being logged in MLflow.
+    wait: int
+        Number of training steps skipped before each window.
+    warmup: int
+        Number of training steps traced, but discarded, before each window.
+    active: int
+        Number of training steps recorded on each window.
+    repeat: int
+        Number of windows recorded.
+    eval_steps: int
+        Number of evaluation steps recorded. If 0, evaluation is not profiled.
+    record_shapes: bool
+        Indicates if the shapes of the inputs of the operators are recorded.
+    profile_memory: bool
+        Indicates if memory allocations are recorded. It's needed for the memory tables and timelines.
+    with_stack: bool
+        Indicates if the stacks of the operators are recorded. Memory timelines need it, along
+        with `record_shapes` and `profile_memory`.
+    row_limit: int
+        Number of operators on the summary tables.
+    """
+    def __init__(self, output_dir: str, wait: int = 1, warmup: int = 1, active: int = 3, repeat: int = 1,
+                 eval_steps: int = 0, record_shapes: bool = True, profile_memory: bool = True,
+                 with_stack: bool = False, row_limit: int = 30):
+        self.output_dir = output_dir
+        self.wait = wait
+        self.warmup = warmup
+        self.active = active
+        self.repeat = repeat
+        self.eval_steps = eval_steps
+        self.record_shapes = record_shapes
+        self.profile_memory = profile_memory
+        self.with_stack = with_stack
+        self.row_limit = row_limit
+        self.activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            self.activities.append(ProfilerActivity.CUDA)
+        self._train_profiler = None
+        self._eval_profiler = None
+        self._eval_profiled = False
+        self._eval_recorded = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._train_profiler = self._start('train', schedule(wait=self.wait, warmup=self.warmup,
+                                                             active=self.active, repeat=self.repeat))
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self._train_profiler:
+            self._train_profiler.step()
+            # Once the window is recorded, the profiler is stopped so it doesn't add overhead
+            # to the rest of the training and evaluation can be profiled.
+            if self._train_profiler.step_num >= (self.wait + self.warmup + self.active) * self.repeat:
+                self._stop_train()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._train_profiler:
+            self._stop_train()
+
+    def on_prediction_step(self, args, state, control, **kwargs):
+        if self._eval_profiler:
+            self._eval_profiler.step()
+            self._eval_recorded += 1
+            if self._eval_recorded > self.eval_steps:
+                self._stop_eval()
+        elif self.eval_steps and not self._eval_profiled and not self._train_profiler:
+            self._eval_profiled = True
+            self._eval_profiler = self._start('eval', schedule(wait=0, warmup=1, active=self.eval_steps, repeat=1))
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        if self._eval_profiler:
+            self._stop_eval()
+
+    def _start(self, phase: str, steps_schedule) -> profile:
+        profiler = profile(activities=self.activities, schedule=steps_schedule,
+                           on_trace_ready=lambda prof: self._export(prof, phase),
+                           record_shapes=self.record_shapes, profile_memory=self.profile_memory,
+                           with_stack=self.with_stack)
+        profiler.start()
+        logging.info(f"[INFO] Profiling {phase} steps with {[str(activity) for activity in self.activities]}")
+        return profiler
+
+    def _stop_train(self):
+        self._train_profiler.stop()
+        self._train_profiler = None
+
+    def _stop_eval(self):
+        self._eval_profiler.stop()
+        self._eval_profiler = None
+
+    def _export(self, prof: profile, phase: str):
+        """
+        Writes the results of a profiling window and logs them in MLflow.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = os.path.join(self.output_dir, f"{phase}_step{prof.step_num}")
+        device = 'cuda' if ProfilerActivity.CUDA in self.activities else 'cpu'
+        files = [f"{name}_trace.json", f"{name}_operators.csv", f"{name}_time.txt"]
+
+        prof.export_chrome_trace(files[0])
+        averages = prof.key_averages()
+        operator_summary(averages).to_csv(files[1], index=False)
+        with open(files[2], 'w', encoding='utf-8') as table_file:
+            table_file.write(averages.table(sort_by=f"self_{device}_time_total", row_limit=self.row_limit))
+
+        if self.profile_memory:
+            files.append(f"{name}_memory.txt")
+            with open(files[-1], 'w', encoding='utf-8') as table_file:
+                table_file.write(averages.table(sort_by=f"self_{device}_memory_usage", row_limit=self.row_limit))
+
+            # Memory timelines are available since PyTorch 2.1
+            if self.record_shapes and self.with_stack and hasattr(prof, 'export_memory_timeline'):
+                try:
+                    prof.export_memory_timeline(f"{name}_memory_timeline.json",
+                                                device='cuda:0' if device == 'cuda' else 'cpu')
+                    files.append(f"{name}_memory_timeline.json")
+                except Exception as error: # pylint: disable=broad-except
+                    logging.warning(f"[WARN] Memory timeline couldn't be exported. {error}")
+
+        for file in files:
+            mlflow.log_artifact(file, artifact_path='profiler')
+        mlflow.log_metrics({ f"profiler_{phase}_{metric}": value
+                             for metric, value in profile_metrics(averages).items() }, step=prof.step_num)
+        logging.info(f"[INFO] Profile of {phase} steps logged up to step {prof.step_num}")
+
+def operator_summary(averages) -> pd.DataFrame:
+    """
+    Builds a table with the time and memory of each operator, from the results of `key_averages`.
+    Times are in milliseconds and memory in megabytes. Device columns are 0 on CPU only runs.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per operator, sorted by self CPU time.
+    """
+    rows = [{
+        'operator': event.key,
+        'calls': event.count,
+        'cpu_ms': event.cpu_time_total / 1000,
+        'self_cpu_ms': event.self_cpu_time_total / 1000,
+        # Renamed from `self_cuda_time_total` to `self_device_time_total` in PyTorch 2.4
+        'self_device_ms': getattr(event, 'self_device_time_total', getattr(event, 'self_cuda_time_total', 0)) / 1000,
+        'self_cpu_memory_mb': event.self_cpu_memory_usage / 2 ** 20,
+        'self_device_memory_mb': getattr(event, 'self_device_memory_usage',
+                                         getattr(event, 'self_cuda_memory_usage', 0)) / 2 ** 20,
+    } for event in averages]
+
+    return pd.DataFrame(rows).sort_values('self_cpu_ms', ascending=False, ignore_index=True)
+
+def profile_metrics(averages) -> Dict[str, float]:
+    """
+    Summarizes a profile with the total self CPU and device time, in milliseconds, and the
+    proportion of CPU time spent waiting for the data loader.
+    """
+    summary = operator_summary(averages)
+    dataloader = summary['operator'].str.startswith('enumerate(DataLoader)')
+    cpu_ms = summary['self_cpu_ms'].sum()
+
+    return { 'cpu_ms': cpu_ms, 'device_ms': summary['self_device_ms'].sum(),
+             'dataloader_ms': summary.loc[dataloader, 'self_cpu_ms'].sum(),
+             'dataloader_ratio': summary.loc[dataloader, 'self_cpu_ms'].sum() / cpu_ms if cpu_ms else 0.0 }
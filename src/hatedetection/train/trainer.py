@@ -1,23 +1,32 @@
 """
 Training routine for a language model using transformers
 """
+import copy
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 from types import SimpleNamespace
 
+import pandas as pd
+
 import mlflow
 from mlflow.models.signature import ModelSignature
 from mlflow.types.schema import Schema, ColSpec
 from mlflow.types import DataType
 
-from transformers import Trainer, TrainingArguments
+from transformers import PreTrainedModel, TrainingArguments, TrainerCallback
 from hatedetection.model.hate_detection_classifier import HateDetectionClassifier
-from hatedetection.model.evaluator import compute_classification_metrics
-from hatedetection.train.datasets import ClassificationDataset
-from hatedetection.prep.text_preparation import load_examples
+from hatedetection.model.evaluator import compute_precision_report
+from hatedetection.train.evaluation import StreamingEvalTrainer
+from hatedetection.train.profiling import ProfilerCallback
+from hatedetection.train.packing import PackedDataset, PackedCollator, PackedSequenceClassifier, PackedTrainer
+from hatedetection.train.datasets import ClassificationDataset, PaddingCollator, ARRAYS_VERSION
+from hatedetection.prep.storage import build_cache_key, tokenizer_fingerprint
+from hatedetection.train.cache import TokenizationCache
+from hatedetection.prep.text_preparation import load_examples, tokenize_to_sequences
+from hatedetection.prep.readers import files_fingerprint
 
-def train_and_evaluate(input_dataset: str, eval_dataset: str,
-                       params: SimpleNamespace) -> Dict[str, Dict[str, Any]]:
+def train_and_evaluate(input_dataset: str, eval_dataset: str, params: SimpleNamespace,
+                       cache_dir: str = None) -> Dict[str, Dict[str, Any]]:
     """
     Trains and evaluete the hate detection model
 
@@ -29,6 +38,10 @@ def train_and_evaluate(input_dataset: str, eval_dataset: str,
         The path to the evaluation dataset
     task: SimpleNamespace
         The training configuration for this task
+    cache_dir: Union[str, PathLike]
+        The directory where tokenized datasets are cached. It should outlive the run, like a
+        mounted datastore, so later runs can reuse them. If None, `data.cache_dir` of the
+        configuration is used.
 
     Returns
     -------
@@ -40,50 +53,100 @@ def train_and_evaluate(input_dataset: str, eval_dataset: str,
     classifier.build(baseline=params.model.baseline)
     classifier.split_unique_words = params.data.preprocessing.split_unique_words
     classifier.split_seq_len = params.data.preprocessing.split_seq_len
+    classifier.split_mode = getattr(params.data.preprocessing, 'split_mode', 'words')
+    classifier.aggregation = getattr(params.model, 'aggregation', 'majority')
+    classifier.backend = getattr(params.model, 'backend', 'torch')
+    classifier.precision = getattr(params.model, 'precision', 'fp32')
+    max_length = getattr(params.data.preprocessing, 'max_length', 400)
+    cache_dir = cache_dir or getattr(params.data, 'cache_dir', None)
+    train_arrays, eval_arrays = None, None
 
-    if eval_dataset:
-        X_train, y_train = load_examples(input_dataset,
-                                                     split_seq=True,
-                                                     unique_words=classifier.split_unique_words,
-                                                     seq_len = classifier.split_seq_len)
-        X_eval, y_eval = load_examples(eval_dataset,
-                                                   split_seq=True,
-                                                   unique_words=classifier.split_unique_words,
-                                                   seq_len = classifier.split_seq_len)
-    else:
-        logging.warning('[WARN] Evaluation will happen over the training dataset as evaluation \
-                        dataset has not been provided.')
-        X_train, y_train, X_eval, y_eval = load_examples(input_dataset,
-                                                    eval_size=0.3,
-                                                    split_seq=True,
-                                                    unique_words=classifier.split_unique_words,
-                                                    seq_len = classifier.split_seq_len)
+    if cache_dir:
+        cache = TokenizationCache(cache_dir)
+        cache_key = build_cache_key(input_dataset=files_fingerprint(input_dataset),
+                                    eval_dataset=files_fingerprint(eval_dataset) if eval_dataset else None,
+                                    tokenizer=tokenizer_fingerprint(classifier.tokenizer),
+                                    max_length=max_length,
+                                    split_mode=classifier.split_mode,
+                                    split_unique_words=classifier.split_unique_words,
+                                    split_seq_len=classifier.split_seq_len,
+                                    arrays_version=ARRAYS_VERSION)
+        train_arrays, eval_arrays = cache.get(f"{cache_key}-train"), cache.get(f"{cache_key}-eval")
 
-    train_dataset = ClassificationDataset(examples=X_train,
-                                          labels=y_train,
-                                          tokenizer=classifier.tokenizer)
-    eval_dataset = ClassificationDataset(examples=X_eval,
-                                         labels=y_eval,
-                                         tokenizer=classifier.tokenizer)
+    if train_arrays and eval_arrays:
+        train_dataset = ClassificationDataset.from_arrays(train_arrays)
+        eval_dataset = ClassificationDataset.from_arrays(eval_arrays)
+    else:
+        train_dataset, eval_dataset = _build_datasets(classifier, input_dataset, eval_dataset, max_length)
+        if cache_dir:
+            cache.put(f"{cache_key}-train", train_dataset.to_arrays())
+            cache.put(f"{cache_key}-eval", eval_dataset.to_arrays())
 
     training_args = TrainingArguments(**vars(params.trainer))
+    packing = getattr(params.data, 'packing', None)
+    packing = packing if packing and getattr(packing, 'enabled', True) else None
 
-    trainer = Trainer(
-        model=classifier.model,
-        args=training_args,
-        train_dataset=train_dataset,
-        eval_dataset=eval_dataset,
-        compute_metrics=compute_classification_metrics,
-    )
+    padding_metrics = {
+        'eval_padding_ratio_dataset': eval_dataset.padding_ratio(),
+        'eval_padding_ratio_batch': eval_dataset.padding_ratio(training_args.eval_batch_size),
+    }
+    # Packed training batches are described by `train_packing_efficiency` instead
+    if not packing:
+        padding_metrics.update({
+            'train_padding_ratio_dataset': train_dataset.padding_ratio(),
+            'train_padding_ratio_batch': train_dataset.padding_ratio(training_args.train_batch_size,
+                                                                     training_args.group_by_length),
+        })
+    logging.info(f"[INFO] Padding ratios: {padding_metrics}")
+    mlflow.log_metrics(padding_metrics)
 
-    logging.info('[INFO] Training will start now')
-    history = trainer.train()
+    callbacks = []
+    profiler = getattr(params, 'profiler', None)
+    if profiler and getattr(profiler, 'enabled', True):
+        logging.info('[INFO] Profiling is enabled')
+        options = { name: value for name, value in vars(profiler).items() if name != 'enabled' }
+        callbacks.append(ProfilerCallback(**dict({ 'output_dir': f"{params.model.output_dir}/profiler" }, **options)))
 
-    logging.info('[INFO] Evaluation will start now')
-    evaluation_metrics = trainer.evaluate()
+    if packing and getattr(packing, 'compare', False):
+        logging.info('[INFO] Training without packing to compare its throughput and F1 with packing')
+        unpacked_args = copy.copy(training_args)
+        unpacked_args.output_dir = f"{training_args.output_dir}/unpacked"
+        _, _, unpacked_metrics, unpacked_throughput = _fit(copy.deepcopy(classifier.model), unpacked_args,
+                                                           train_dataset, eval_dataset, classifier, params, [])
+
+    trainer, history, evaluation_metrics, throughput = _fit(classifier.model, training_args, train_dataset,
+                                                            eval_dataset, classifier, params, callbacks, packing)
+    mlflow.log_metric('train_examples_per_second', throughput)
+
+    if packing and getattr(packing, 'compare', False):
+        comparison = pd.DataFrame([
+            dict(mode='unpacked', examples_per_second=unpacked_throughput, f1=unpacked_metrics['eval_f1']),
+            dict(mode='packed', examples_per_second=throughput, f1=evaluation_metrics['eval_f1']),
+        ])
+        logging.info(f"[INFO] Packing comparison: {comparison.to_dict('records')}")
+        mlflow.log_text(comparison.to_csv(index=False), 'packing_comparison.csv')
+        mlflow.log_metrics({ 'unpacked_train_examples_per_second': unpacked_throughput,
+                             'unpacked_eval_f1': unpacked_metrics['eval_f1'],
+                             'packing_speedup': throughput / unpacked_throughput })
+
+    if trainer.streaming_metrics.calibration_bins:
+        mlflow.log_text(trainer.streaming_metrics.calibration().to_csv(index=False), 'calibration.csv')
+
+    precision_report = getattr(params.model, 'precision_report', None)
+    if precision_report:
+        logging.info('[INFO] Evaluating accuracy and latency of precision modes')
+        samples = min(len(eval_dataset), getattr(precision_report, 'samples', 2048))
+        report = compute_precision_report(classifier,
+                                          [eval_dataset[idx]['input_ids'].tolist() for idx in range(samples)],
+                                          eval_dataset.label_ids[:samples],
+                                          precisions=precision_report.precisions)
+        mlflow.log_text(report.to_csv(index=False), 'precision_report.csv')
+        mlflow.log_metrics({ f"{row['precision']}_{name}": row[name] for row in report.to_dict('records')
+                             for name in ('accuracy', 'f1', 'agreement', 'throughput', 'latency_p50_ms') })
 
     logging.info('[INFO] Training completed. Persisting model and tokenizer.')
-    artifacts = classifier.save_pretrained(f"{params.model.output_dir}/{params.model.name}")
+    artifacts = classifier.save_pretrained(f"{params.model.output_dir}/{params.model.name}",
+                                           export=getattr(params.model, 'export', None))
 
     signature = ModelSignature(
         inputs=Schema([
@@ -107,3 +170,160 @@ def train_and_evaluate(input_dataset: str, eval_dataset: str,
         'arguments': history.metrics,
         'artifacts': artifacts.keys()
     }
+
+def _fit(model: PreTrainedModel, training_args: TrainingArguments, train_dataset: ClassificationDataset,
+         eval_dataset: ClassificationDataset, classifier: HateDetectionClassifier, params: SimpleNamespace,
+         callbacks: List[TrainerCallback], packing: SimpleNamespace = None) -> Tuple[StreamingEvalTrainer,
+                                                                                    Any, Dict[str, float], float]:
+    """
+    Trains and evaluates a model. If packing is configured, training examples are packed in
+    sequences of `packing.max_length` tokens and checkpoints hold the model without the packing
+    wrapper. Evaluation examples are never packed, so metrics are comparable with and without
+    packing.
+
+    Parameters
+    ----------
+    model: PreTrainedModel
+        The model to train.
+    training_args: TrainingArguments
+        The arguments of the trainer.
+    train_dataset: ClassificationDataset
+        The training dataset.
+    eval_dataset: ClassificationDataset
+        The evaluation dataset.
+    classifier: HateDetectionClassifier
+        The classifier whose tokenizer is used to pad the batches.
+    params: SimpleNamespace
+        The training configuration.
+    callbacks: List[TrainerCallback]
+        Callbacks of the trainer.
+    packing: SimpleNamespace
+        The packing configuration. If None, examples are not packed.
+
+    Returns
+    -------
+    Tuple[StreamingEvalTrainer, Any, Dict[str, float], float]
+        The trainer, the results of the training, the evaluation metrics and the number of
+        training examples processed per second.
+    """
+    num_examples = len(train_dataset)
+    data_collator = PaddingCollator(classifier.tokenizer.pad_token_id)
+    trainer_class = StreamingEvalTrainer
+
+    if packing:
+        train_dataset = PackedDataset(train_dataset, getattr(packing, 'max_length', 128))
+        model, data_collator = PackedSequenceClassifier(model), PackedCollator(classifier.tokenizer.pad_token_id)
+        trainer_class = PackedTrainer
+        # Packs have similar lengths, so grouping them by length only adds work. Items of the packs
+        # have keys that are consumed by the collator, not by the model, so they have to be kept.
+        training_args = copy.copy(training_args)
+        training_args.group_by_length = False
+        training_args.remove_unused_columns = False
+
+        packing_metrics = { 'train_packs': len(train_dataset), 'train_packing_efficiency': train_dataset.efficiency() }
+        logging.info(f"[INFO] Packing {num_examples} examples: {packing_metrics}")
+        mlflow.log_metrics(packing_metrics)
+
+    trainer = trainer_class(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
+        data_collator=data_collator,
+        calibration_bins=getattr(params.model, 'calibration_bins', 0),
+        callbacks=callbacks,
+    )
+
+    logging.info('[INFO] Training will start now')
+    history = trainer.train()
+    throughput = num_examples * trainer.state.epoch / history.metrics['train_runtime']
+
+    logging.info('[INFO] Evaluation will start now')
+    evaluation_metrics = trainer.evaluate()
+
+    return trainer, history, evaluation_metrics, throughput
+
+def _build_datasets(classifier: HateDetectionClassifier, input_dataset: str, eval_dataset: str,
+                    max_length: int) -> Tuple[ClassificationDataset, ClassificationDataset]:
+    """
+    Loads the training and evaluation examples and builds the datasets for them according to
+    the preprocessing parameters of the classifier. If there is no evaluation dataset, a portion
+    of the training dataset is used for evaluation.
+
+    Parameters
+    ----------
+    classifier: HateDetectionClassifier
+        The classifier whose tokenizer and split parameters will be used.
+    input_dataset: str
+        The path to the training dataset
+    eval_dataset: str
+        The path to the evaluation dataset
+    max_length: int
+        Maximum number of tokens on each example.
+
+    Returns
+    -------
+    Tuple[ClassificationDataset, ClassificationDataset]
+        The training and evaluation datasets.
+    """
+    split_words = classifier.split_mode == 'words'
+
+    if eval_dataset:
+        X_train, y_train = load_examples(input_dataset,
+                                                     split_seq=split_words,
+                                                     unique_words=classifier.split_unique_words,
+                                                     seq_len = classifier.split_seq_len)
+        X_eval, y_eval = load_examples(eval_dataset,
+                                                   split_seq=split_words,
+                                                   unique_words=classifier.split_unique_words,
+                                                   seq_len = classifier.split_seq_len)
+    else:
+        logging.warning('[WARN] Evaluation will happen over the training dataset as evaluation \
+                        dataset has not been provided.')
+        X_train, y_train, X_eval, y_eval = load_examples(input_dataset,
+                                                    eval_size=0.3,
+                                                    split_seq=split_words,
+                                                    unique_words=classifier.split_unique_words,
+                                                    seq_len = classifier.split_seq_len)
+
+    if not split_words:
+        logging.info('[INFO] Splitting examples in windows of tokens')
+        X_train, y_train = _split_to_token_windows(classifier, X_train, y_train)
+        X_eval, y_eval = _split_to_token_windows(classifier, X_eval, y_eval)
+
+    train_dataset = ClassificationDataset(examples=X_train,
+                                          labels=y_train,
+                                          tokenizer=classifier.tokenizer,
+                                          max_length=max_length)
+    eval_dataset = ClassificationDataset(examples=X_eval,
+                                         labels=y_eval,
+                                         tokenizer=classifier.tokenizer,
+                                         max_length=max_length)
+
+    return train_dataset, eval_dataset
+
+def _split_to_token_windows(classifier: HateDetectionClassifier, examples: pd.Series,
+                            labels: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    Tokenizes the examples and splits them in windows of token ids according to the
+    preprocessing parameters of the classifier. Labels are repeated for each window.
+
+    Parameters
+    ----------
+    classifier: HateDetectionClassifier
+        The classifier whose tokenizer and split parameters will be used.
+    examples: pd.Series
+        The text samples.
+    labels: pd.Series
+        The ground truth of each of the samples.
+
+    Returns
+    -------
+    Tuple[pd.Series, pd.Series]
+        The windows of token ids along with the corresponding ground truth.
+    """
+    examples, labels = examples.reset_index(drop=True), labels.reset_index(drop=True)
+    windows = tokenize_to_sequences(examples, classifier.tokenizer,
+                                    unique_tokens=classifier.split_unique_words,
+                                    seq_len=classifier.split_seq_len)
+    return windows, labels.loc[windows.index]
@@ -0,0 +1,109 @@
+"""
+Helpers to measure the throughput and the peak memory of the hot paths of the code, and to compare
+them against baselines stored as JSON.
+"""
+import os
+import gc
+import json
+import time
+import platform
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+def measure(func: Callable[[], Any], items: int, repeat: int = 3, warmup: int = 1) -> Dict[str, float]:
+    """
+    Measures a function. Throughput is computed with the fastest of `repeat` runs, and peak memory
+    is measured on a separate run, since tracing allocations slows the code down. Only memory
+    allocated through Python's allocators (which includes NumPy arrays, but not PyTorch tensors)
+    is traced.
+
+    Parameters
+    ----------
+    func: Callable[[], Any]
+        The function to measure.
+    items: int
+        The number of items the function processes on each call, like texts or examples.
+    repeat: int
+        The number of timed runs.
+    warmup: int
+        The number of runs before timing.
+
+    Returns
+    -------
+    Dict[str, float]
+        The keys `throughput` (items per second), `seconds` and `peak_memory_mb`.
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return { 'throughput': items / min(timings), 'seconds': min(timings), 'peak_memory_mb': peak / 2 ** 20 }
+
+def compare(name: str, results: Dict[str, float], baseline: Dict[str, float], threshold: float,
+            memory_slack_mb: float = 1.0) -> List[str]:
+    """
+    Compares the results of a benchmark against its baseline.
+
+    Parameters
+    ----------
+    name: str
+        The name of the benchmark.
+    results: Dict[str, float]
+        The results of `measure`.
+    baseline: Dict[str, float]
+        The results of `measure` stored as baseline.
+    threshold: float
+        The maximum relative decrease of throughput, or increase of peak memory, allowed.
+    memory_slack_mb: float
+        An absolute increase of peak memory that is always allowed, since small allocations are
+        noisy.
+
+    Returns
+    -------
+    List[str]
+        A description of each regression found. Empty if there are none.
+    """
+    regressions = []
+    if results['throughput'] < baseline['throughput'] * (1 - threshold):
+        regressions.append(f"{name}: throughput {results['throughput']:.1f}/s is below the baseline of "
+                           f"{baseline['throughput']:.1f}/s")
+    if results['peak_memory_mb'] > baseline['peak_memory_mb'] * (1 + threshold) + memory_slack_mb:
+        regressions.append(f"{name}: peak memory {results['peak_memory_mb']:.1f}MB is above the baseline of "
+                           f"{baseline['peak_memory_mb']:.1f}MB")
+    return regressions
+
+def load_baselines(path: str) -> Dict[str, Dict[str, float]]:
+    """
+    Loads the baselines stored in a JSON file.
+    """
+    with open(path, 'r', encoding='utf-8') as baseline_file:
+        return json.load(baseline_file)['benchmarks']
+
+def save_baselines(path: str, benchmarks: Dict[str, Dict[str, float]]):
+    """
+    Stores the results of the benchmarks as baselines in a JSON file, along with a description of
+    the machine they ran on. Benchmarks stored before and not run again are kept.
+    """
+    if os.path.exists(path):
+        benchmarks = dict(load_baselines(path), **benchmarks)
+
+    with open(path, 'w', encoding='utf-8') as baseline_file:
+        json.dump({
+            'machine': { 'python': platform.python_version(), 'processor': platform.machine(),
+                         'cpus': os.cpu_count() },
+            'benchmarks': dict(sorted(benchmarks.items())),
+        }, baseline_file, indent=2)
@@ -1,6 +1,10 @@
 """
 PyTest configuration script
 """
+import pytest
+from tests.benchmark import measure, compare, load_baselines, save_baselines
+
+PERF_RESULTS = {}
 
 def pytest_addoption(parser):
     """
@@ -13,6 +17,50 @@ def pytest_addoption(parser):
         default=[],
         help="Workspace configuration file",
     )
+    parser.addoption(
+        "--perf",
+        dest="perf",
+        action="store_true",
+        default=False,
+        help="Run the benchmarks, which are skipped otherwise",
+    )
+    parser.addoption(
+        "--perf-save",
+        dest="perf_save",
+        default=None,
+        help="JSON file where the results of the benchmarks are stored as baselines",
+    )
+    parser.addoption(
+        "--perf-compare",
+        dest="perf_compare",
+        default=None,
+        help="JSON file with baselines. Benchmarks fail if they regress past the threshold",
+    )
+    parser.addoption(
+        "--perf-threshold",
+        dest="perf_threshold",
+        type=float,
+        default=0.3,
+        help="Maximum relative regression of throughput or peak memory allowed",
+    )
+
+def pytest_configure(config):
+    """
+    Registers the custom markers.
+    """
+    config.addinivalue_line("markers", "perf: measures throughput and peak memory of a hot path")
+
+def pytest_collection_modifyitems(config, items):
+    """
+    Skips the benchmarks unless they are requested.
+    """
+    if config.getoption("perf") or config.getoption("perf_save") or config.getoption("perf_compare"):
+        return
+
+    skip = pytest.mark.skip(reason="Benchmarks run only with --perf")
+    for item in items:
+        if "perf" in item.keywords:
+            item.add_marker(skip)
 
 def pytest_generate_tests(metafunc):
     """
@@ -21,3 +69,45 @@ def pytest_generate_tests(metafunc):
     """
     if "ws_config_file" in metafunc.fixturenames:
         metafunc.parametrize("ws_config_file", metafunc.config.getoption("ws_config_file"))
+
+def pytest_sessionfinish(session):
+    """
+    Stores the results of the benchmarks as baselines, if requested.
+    """
+    path = session.config.getoption("perf_save")
+    if path and PERF_RESULTS:
+        save_baselines(path, PERF_RESULTS)
+
+def pytest_terminal_summary(terminalreporter):
+    """
+    Reports the throughput and peak memory of each benchmark.
+    """
+    if PERF_RESULTS:
+        terminalreporter.section("benchmarks")
+        for name, results in PERF_RESULTS.items():
+            terminalreporter.write_line(f"{name}: {results['throughput']:.1f} items/s, "
+                                        f"{results['peak_memory_mb']:.1f}MB peak")
+
+@pytest.fixture
+def perf_benchmark(request):
+    """
+    Measures a function with `measure` and records the results under the name of the test, also
+    as user properties of the test so they are included in JUnit reports. When baselines are
+    given, the test fails if the function regresses.
+    """
+    baselines_path = request.config.getoption("perf_compare")
+    baselines = load_baselines(baselines_path) if baselines_path else {}
+    threshold = request.config.getoption("perf_threshold")
+
+    def run(func, items: int, **kwargs):
+        name = request.node.name
+        results = measure(func, items, **kwargs)
+        PERF_RESULTS[name] = results
+        request.node.user_properties.extend((f"perf_{metric}", value) for metric, value in results.items())
+
+        if name in baselines:
+            regressions = compare(name, results, baselines[name], threshold)
+            assert not regressions, "; ".join(regressions)
+        return results
+
+    return run
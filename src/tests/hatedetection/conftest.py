@@ -0,0 +1,45 @@
+"""
+Fixtures for the hate detection model tests. Tokenizers and models are built locally with a tiny
+configuration so tests can run offline and on CPU.
+"""
+import pytest
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+from hatedetection.model.hate_detection_classifier import HateDetectionClassifier
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+WORDS = ["mude", "seus", "pensamentos", "e", "você", "pode", "mudar", "seu", "mundo", "quando",
+         "não", "a", "direção", "do", "vento", "de", "sua", "vela", "ódio", "amor"]
+PIECES = ["##s", "##a", "##o", "##e", "##r"]
+CHARS = list("abcdefghijklmnopqrstuvwxyzáéíóúãõç.,!?")
+
+
+@pytest.fixture(scope="session")
+def tokenizer(tmp_path_factory) -> BertTokenizerFast:
+    """
+    A fast word piece tokenizer built from a small local vocabulary.
+    """
+    tokenizer_dir = tmp_path_factory.mktemp("tokenizer")
+    vocab = list(dict.fromkeys(SPECIAL_TOKENS + WORDS + PIECES + CHARS))
+    (tokenizer_dir / "vocab.txt").write_text("\n".join(vocab), encoding="utf-8")
+
+    return BertTokenizerFast.from_pretrained(str(tokenizer_dir), do_lower_case=True)
+
+
+@pytest.fixture
+def classifier(tokenizer: BertTokenizerFast) -> HateDetectionClassifier:
+    """
+    A hate detection classifier with a tiny randomly initialized BERT model.
+    """
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=64, max_position_embeddings=512,
+                        num_labels=2)
+
+    model = HateDetectionClassifier()
+    model.tokenizer = tokenizer
+    model.model = BertForSequenceClassification(config).eval()
+    model.split_unique_words = 5
+    model.split_seq_len = 10
+
+    return model
@@ -0,0 +1,93 @@
+import json
+import pytest
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+from hatedetection.model.hate_detection_classifier import HateDetectionClassifier
+from hatedetection.model.backends import TorchBackend, load_backend, check_parity
+from hatedetection.model.evaluator import compute_precision_report
+
+
+raw_data = pd.DataFrame(data=[
+    {"text": "Mude seus pensamentos e você pode mudar seu mundo."},
+    {"text": "Quando você não pode mudar a direção do vento, mude a direção de sua vela."},
+    {"text": "ódio"}])
+
+@pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+def test_backend_parity(classifier: HateDetectionClassifier, backend: str, tmp_path):
+    """ Unit test for exported backends matching eager PyTorch
+    """
+    pytest.importorskip("onnxruntime")
+    classifier.backend = backend
+    artifacts = classifier.save_pretrained(str(tmp_path))
+
+    with open(artifacts["inference"], encoding="utf-8") as config_file:
+        assert json.load(config_file)["backend"] == backend
+
+    reference = TorchBackend(classifier.model)
+    assert check_parity(load_backend(backend, classifier.model, str(tmp_path)), reference) < 1e-3
+
+    expected = classifier.predict(None, raw_data)
+    classifier.load_context(SimpleNamespace(artifacts=artifacts))
+    assert type(classifier._backend).name == backend
+
+    results = classifier.predict(None, raw_data)
+    assert results['hate'].tolist() == expected['hate'].tolist()
+    assert results['confidence'].to_numpy() == pytest.approx(expected['confidence'].to_numpy(), abs=1e-4)
+
+
+def test_backend_fallback(classifier: HateDetectionClassifier, tmp_path):
+    """ Unit test for falling back to PyTorch when the exported model is missing
+    """
+    classifier.save_pretrained(str(tmp_path))
+    classifier.load_backend("onnx", str(tmp_path))
+
+    assert isinstance(classifier._backend, TorchBackend)
+
+
+@pytest.mark.parametrize("precision", ["int8", "bf16"])
+def test_precision_modes(classifier: HateDetectionClassifier, precision: str, tmp_path, monkeypatch):
+    """ Unit test for reduced precision modes selected at load time
+    """
+    artifacts = classifier.save_pretrained(str(tmp_path))
+    expected = classifier.predict(None, raw_data)
+
+    monkeypatch.setenv("HATEDETECTION_PRECISION", precision)
+    classifier.load_context(SimpleNamespace(artifacts=artifacts))
+    results = classifier.predict(None, raw_data)
+
+    assert classifier._backend.precision == precision
+    assert len(results) == len(raw_data)
+    assert results['confidence'].to_numpy() == pytest.approx(expected['confidence'].to_numpy(), abs=0.05)
+
+
+def test_precision_report(classifier: HateDetectionClassifier):
+    """ Unit test for the accuracy versus latency report of precision modes
+    """
+    input_ids = classifier.tokenizer(raw_data['text'].tolist())['input_ids']
+    report = compute_precision_report(classifier, input_ids, np.array([0, 1, 0]), ["fp32", "int8"],
+                                      latency_samples=2)
+
+    assert report['precision'].tolist() == ["fp32", "int8"]
+    assert report.loc[0, 'agreement'] == 1
+    assert (report['latency_p50_ms'] > 0).all()
+
+
+def test_backend_is_reused(classifier: HateDetectionClassifier, monkeypatch):
+    """ Unit test for the backend being created once and again only when the precision changes
+    """
+    created = []
+    original_init = TorchBackend.__init__
+    def tracked_init(self, *args, **kwargs):
+        created.append(self)
+        original_init(self, *args, **kwargs)
+    monkeypatch.setattr(TorchBackend, "__init__", tracked_init)
+
+    classifier.precision = "int8"
+    classifier.predict(None, raw_data)
+    classifier.predict(None, raw_data['text'].iloc[:1])
+    assert len(created) == 1
+
+    classifier.precision = "fp32"
+    classifier.predict(None, raw_data)
+    assert len(created) == 2 and created[-1].precision == "fp32"
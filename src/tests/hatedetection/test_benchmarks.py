@@ -0,0 +1,73 @@
+"""
+Benchmarks of the hot paths. They run only with `--perf`. Use `--perf-save` to store the results
+as baselines and `--perf-compare` to fail when they regress, for instance:
+
+    python -m pytest tests/hatedetection/test_benchmarks.py --perf-compare tests/hatedetection/benchmarks.json
+
+Baselines depend on the machine they were measured on, which is recorded in the JSON file.
+Store new baselines before comparing on a different machine.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from transformers import EvalPrediction
+from hatedetection.prep.text_preparation import split_to_sequences, load_examples
+from hatedetection.train.datasets import ClassificationDataset
+from hatedetection.model.evaluator import compute_classification_metrics
+
+WORDS = ["mude", "seus", "pensamentos", "e", "você", "pode", "mudar", "seu", "mundo", "quando",
+         "não", "a", "direção", "do", "vento", "de", "sua", "vela", "ódio", "amor"]
+
+
+def random_texts(n_texts: int, max_words: int = 300, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    return pd.Series([" ".join(rng.choice(WORDS, size=rng.integers(5, max_words)))
+                      for _ in range(n_texts)])
+
+
+@pytest.mark.perf
+def test_benchmark_split_to_sequences(perf_benchmark):
+    text = random_texts(2000)
+    perf_benchmark(lambda: text.apply(split_to_sequences, unique_words=150, seq_len=200).explode(), len(text))
+
+
+@pytest.mark.perf
+def test_benchmark_load_examples(perf_benchmark, tmp_path):
+    text = random_texts(100000, max_words=40)
+    pd.DataFrame({ 'text': text, 'hate': np.arange(len(text)) % 2 }).to_csv(tmp_path / "data.csv", index=False)
+    perf_benchmark(lambda: load_examples(str(tmp_path / "data.csv"), eval_size=0.3, random_state=0), len(text), repeat=5)
+
+
+@pytest.mark.perf
+def test_benchmark_dataset_construction(perf_benchmark, tokenizer):
+    text = random_texts(2000, max_words=150)
+    labels = np.arange(len(text)) % 2 == 0
+    perf_benchmark(lambda: ClassificationDataset(text.tolist(), labels, tokenizer), len(text))
+
+
+@pytest.mark.perf
+def test_benchmark_dataset_getitem(perf_benchmark, tokenizer):
+    text = random_texts(2000, max_words=150)
+    dataset = ClassificationDataset(text.tolist(), np.arange(len(text)) % 2 == 0, tokenizer)
+    perf_benchmark(lambda: [dataset[idx] for _ in range(20) for idx in range(len(dataset))], 20 * len(dataset), repeat=5)
+
+
+@pytest.mark.perf
+def test_benchmark_classification_metrics(perf_benchmark):
+    rng = np.random.default_rng(0)
+    pred = EvalPrediction(predictions=rng.normal(size=(200000, 2)).astype(np.float32),
+                          label_ids=rng.integers(0, 2, 200000))
+    perf_benchmark(lambda: compute_classification_metrics(pred), len(pred.label_ids))
+
+
+@pytest.mark.perf
+def test_benchmark_predict(perf_benchmark, classifier):
+    text = random_texts(256, max_words=120)
+    classifier.cache_size = 0
+    classifier.split_unique_words, classifier.split_seq_len = 150, 200
+
+    def predict():
+        classifier._cache = None
+        classifier.predict(None, text)
+
+    perf_benchmark(predict, len(text))
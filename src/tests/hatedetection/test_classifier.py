@@ -0,0 +1,104 @@
+import pytest
+from types import SimpleNamespace
+import pandas as pd
+import torch
+from hatedetection.model.hate_detection_classifier import HateDetectionClassifier
+from hatedetection.model import weights
+from hatedetection.model.weights import load_model, save_weights
+
+
+raw_data = pd.DataFrame(data=[
+    {"text": "Mude seus pensamentos e você pode mudar seu mundo."},
+    {"text": "Mude seus pensamentos e você pode mudar seu mundo. \
+        Quando você não pode mudar a direção do vento, mude a direção de sua vela."},
+    {"text": "ódio"}])
+
+@pytest.mark.parametrize("split_mode", ["words", "tokens"])
+def test_predict_single_shape(classifier: HateDetectionClassifier, split_mode: str):
+    """ Unit test for HateDetectionClassifier.predict_single()
+    """
+    classifier.split_mode = split_mode
+    results = classifier.predict_single(None, raw_data)
+
+    assert len(results) == len(raw_data)
+    assert results['confidence'].between(0.5, 1).all()
+
+
+@pytest.mark.parametrize("split_mode", ["words", "tokens"])
+def test_predict_keeps_order(classifier: HateDetectionClassifier, split_mode: str):
+    """ Unit test for HateDetectionClassifier.predict() batching by token budget
+    """
+    classifier.split_mode = split_mode
+    classifier.max_batch_tokens = 64
+    data = pd.concat([raw_data] * 5, ignore_index=True).iloc[::-1]
+
+    results = classifier.predict(None, data)
+    expected = pd.concat([classifier.predict(None, data.iloc[idx:idx + 1]) for idx in range(len(data))])
+
+    assert len(results) == len(data)
+    assert results['hate'].tolist() == expected['hate'].tolist()
+    assert results['confidence'].to_numpy() == pytest.approx(expected['confidence'].to_numpy(), abs=1e-5)
+
+
+def test_unpickle_previous_versions(classifier: HateDetectionClassifier):
+    """ Unit test for HateDetectionClassifier unpickling models saved without newer attributes
+    """
+    state = classifier.__getstate__()
+    del state['chunk_size']
+    del state['precision']
+
+    restored = HateDetectionClassifier.__new__(HateDetectionClassifier)
+    restored.__setstate__(state)
+
+    assert restored.chunk_size == HateDetectionClassifier().chunk_size
+    assert restored.precision == 'fp32'
+    assert restored.split_seq_len == classifier.split_seq_len
+
+
+def test_load_context_startup(classifier: HateDetectionClassifier, tmp_path, monkeypatch):
+    """ Unit test for HateDetectionClassifier loading safetensors weights and warming up
+    """
+    artifacts = classifier.save_pretrained(str(tmp_path))
+    assert "model" in artifacts and artifacts["model"].endswith(".safetensors")
+
+    expected = classifier.predict(None, raw_data)
+    restored = HateDetectionClassifier()
+    restored.__setstate__(classifier.__getstate__())
+
+    monkeypatch.setenv("HATEDETECTION_WARMUP", "0")
+    restored.load_context(SimpleNamespace(artifacts=artifacts))
+    assert restored._tokenizer is None
+    assert {"import_seconds", "weights_seconds", "backend_seconds"} <= set(restored.startup_stats)
+
+    monkeypatch.setenv("HATEDETECTION_WARMUP", "1")
+    restored.load_context(SimpleNamespace(artifacts=artifacts))
+    assert {"tokenizer_seconds", "warmup_seconds"} <= set(restored.startup_stats)
+
+    results = restored.predict(None, raw_data)
+    assert results['confidence'].to_numpy() == pytest.approx(expected['confidence'].to_numpy(), abs=1e-5)
+
+
+@pytest.mark.parametrize("remove_pickle", [False, True])
+def test_save_weights_keeps_pickle(classifier: HateDetectionClassifier, remove_pickle: bool, tmp_path):
+    """ Unit test for save_weights keeping pytorch_model.bin unless asked to remove it
+    """
+    pickle_path = tmp_path / "pytorch_model.bin"
+    torch.save(classifier.model.state_dict(), str(pickle_path))
+    save_weights(classifier.model, str(tmp_path), remove_pickle=remove_pickle)
+
+    assert (tmp_path / "model.safetensors").exists()
+    assert pickle_path.exists() != remove_pickle
+    assert load_model(str(tmp_path)).config.hidden_size == classifier.model.config.hidden_size
+
+
+def test_load_model_memory_maps_safetensors(classifier: HateDetectionClassifier, tmp_path, monkeypatch):
+    """ Unit test for load_model reading safetensors with versions of transformers that don't support them
+    """
+    save_weights(classifier.model, str(tmp_path))
+    monkeypatch.setattr(weights, '_native_safetensors', lambda: False)
+
+    model = load_model(str(tmp_path))
+
+    expected = classifier.model.state_dict()
+    assert not model.training
+    assert all(torch.equal(tensor, expected[name]) for name, tensor in model.state_dict().items())
@@ -0,0 +1,78 @@
+import pickle
+import numpy as np
+import torch
+import pandas as pd
+from hatedetection.prep.text_preparation import tokenize_to_sequences
+from hatedetection.train.datasets import ClassificationDataset, PaddingCollator
+from hatedetection.prep.storage import build_cache_key, tokenizer_fingerprint
+from hatedetection.train.cache import TokenizationCache
+
+
+def test_dataset_from_token_windows(tokenizer):
+    """ Unit test for ClassificationDataset with windows of token ids as examples
+    """
+    text = pd.Series(["Mude seus pensamentos e você pode mudar seu mundo.", "ódio"])
+    labels = pd.Series([False, True])
+    windows = tokenize_to_sequences(text, tokenizer, unique_tokens=3, seq_len=5)
+
+    dataset = ClassificationDataset(windows, labels.loc[windows.index], tokenizer)
+
+    assert len(dataset) == len(windows)
+    assert dataset[0]['input_ids'].tolist() == windows.iloc[0]
+    assert [dataset[idx]['label'] for idx in range(len(dataset))] == [0] * (len(windows) - 1) + [1]
+
+
+def test_dataset_truncates_windows_keeping_separator(tokenizer):
+    """ Unit test for ClassificationDataset truncating windows of token ids before their [SEP]
+    """
+    windows = tokenize_to_sequences(pd.Series(["Mude seus pensamentos e você pode mudar seu mundo."]),
+                                    tokenizer, unique_tokens=15, seq_len=20)
+    dataset = ClassificationDataset(windows, [True], tokenizer, max_length=6)
+    input_ids = dataset[0]['input_ids'].tolist()
+
+    assert len(windows.iloc[0]) > 6
+    assert input_ids == windows.iloc[0][:5] + [tokenizer.sep_token_id]
+
+
+def test_dataset_cache_roundtrip(tokenizer, tmp_path):
+    """ Unit test for TokenizationCache with ClassificationDataset arrays
+    """
+    dataset = ClassificationDataset(["Mude seus pensamentos", "você pode mudar seu mundo"],
+                                    [True, False], tokenizer)
+    cache = TokenizationCache(str(tmp_path))
+    key = build_cache_key(data="sample", tokenizer=tokenizer_fingerprint(tokenizer), max_length=400)
+
+    assert cache.get(key) is None
+    cache.put(key, dataset.to_arrays())
+    cached = ClassificationDataset.from_arrays(cache.get(key))
+
+    assert len(cached) == len(dataset)
+    assert all(cached[idx]['input_ids'].equal(dataset[idx]['input_ids']) for idx in range(len(dataset)))
+    assert isinstance(cached.input_ids, np.memmap)
+
+    restored = pickle.loads(pickle.dumps(cached))
+    assert isinstance(restored.input_ids, np.memmap)
+    assert restored[1]['input_ids'].equal(dataset[1]['input_ids'])
+
+
+def test_dataset_padding_ratio(tokenizer):
+    """ Unit test for ClassificationDataset.padding_ratio()
+    """
+    text = [" ".join(["mude seus pensamentos"] * 10) if idx % 16 == 0 else "ódio" for idx in range(64)]
+    dataset = ClassificationDataset(text, [idx % 2 for idx in range(len(text))], tokenizer)
+
+    assert len(set(dataset.lengths)) == 2
+    assert dataset.padding_ratio() > 0.8
+    assert dataset.padding_ratio(batch_size=8, group_by_length=True) < dataset.padding_ratio(batch_size=8)
+    assert dataset.padding_ratio(batch_size=1) == 0
+
+
+def test_padding_collator(tokenizer):
+    """ Unit test for PaddingCollator
+    """
+    dataset = ClassificationDataset(["ódio", "Mude seus pensamentos"], [1, 0], tokenizer)
+    batch = PaddingCollator(tokenizer.pad_token_id)([dataset[0], dataset[1]])
+
+    assert batch['input_ids'].shape == (2, dataset.lengths.max())
+    assert batch['attention_mask'].sum(dim=1).tolist() == dataset.lengths.tolist()
+    assert batch['labels'].tolist() == [1, 0]
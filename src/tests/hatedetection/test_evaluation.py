@@ -0,0 +1,43 @@
+import numpy as np
+from hatedetection.train.datasets import ClassificationDataset, PaddingCollator
+from hatedetection.train.evaluation import StreamingEvalTrainer
+from hatedetection.model.evaluator import compute_classification_metrics
+from transformers import Trainer, TrainingArguments
+
+
+def test_streaming_eval_trainer_metrics(classifier, tmp_path):
+    """ Unit test for StreamingEvalTrainer computing the same metrics than gathering all the logits
+    """
+    texts = ["Mude seus pensamentos", "você pode mudar seu mundo", "ódio", "amor", "ódio e amor"] * 7
+    dataset = ClassificationDataset(texts, [idx % 2 == 0 for idx in range(len(texts))], classifier.tokenizer)
+    args = TrainingArguments(output_dir=str(tmp_path), per_device_eval_batch_size=4, report_to=[])
+    collator = PaddingCollator(classifier.tokenizer.pad_token_id)
+
+    streaming = StreamingEvalTrainer(model=classifier.model, args=args, eval_dataset=dataset,
+                                     data_collator=collator, calibration_bins=5)
+    gathering = Trainer(model=classifier.model, args=args, eval_dataset=dataset, data_collator=collator,
+                        compute_metrics=compute_classification_metrics)
+    metrics, expected = streaming.evaluate(), gathering.evaluate()
+
+    for name in ('eval_accuracy', 'eval_f1', 'eval_precision', 'eval_recall'):
+        assert np.isclose(metrics[name], expected[name])
+    assert streaming.streaming_metrics.calibration()['count'].sum() == len(dataset)
+    assert 0 <= metrics['eval_ece'] <= 1
+    assert streaming.predict(dataset).predictions.shape == (len(dataset), 2)
+
+
+def test_streaming_eval_trainer_without_labels(classifier, tmp_path):
+    """ Unit test for StreamingEvalTrainer skipping the metrics of batches without labels
+    """
+    texts = ["Mude seus pensamentos", "ódio", "amor"]
+    dataset = ClassificationDataset(texts, [True, False, True], classifier.tokenizer)
+    args = TrainingArguments(output_dir=str(tmp_path), report_to=[])
+    inputs = PaddingCollator(classifier.tokenizer.pad_token_id)([dataset[idx] for idx in range(len(dataset))])
+    del inputs['labels']
+
+    streaming = StreamingEvalTrainer(model=classifier.model, args=args)
+    streaming._streaming = True
+    loss, logits, labels = streaming.prediction_step(classifier.model, inputs, prediction_loss_only=False)
+
+    assert loss is None and logits is None and labels is None
+    assert streaming.streaming_metrics.confusion.sum() == 0
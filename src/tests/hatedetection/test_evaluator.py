@@ -0,0 +1,203 @@
+import copy
+import inspect
+import pytest
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.metrics import accuracy_score, f1_score, precision_recall_fscore_support
+from statsmodels.stats.contingency_tables import mcnemar
+from hatedetection.model import evaluator
+from hatedetection.model.hate_detection_classifier import HateDetectionClassifier
+from hatedetection.model.statistics import PairedOutcomes, paired_bootstrap
+from hatedetection.prep.arguments import parse_bool
+
+
+def test_paired_outcomes_matches_full_data():
+    """ Unit test for PairedOutcomes accumulating batches to the same results computed over all the data
+    """
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 2, 500)
+    predictions = { name: np.where(rng.random(500) < accuracy, labels, 1 - labels)
+                    for name, accuracy in [('a', 0.9), ('b', 0.8), ('c', 0.8)] }
+
+    outcomes = PairedOutcomes(list(predictions))
+    for start in range(0, 500, 128):
+        outcomes.update(labels[start:start + 128], { name: values[start:start + 128]
+                                                     for name, values in predictions.items() })
+    metrics = outcomes.metrics()
+    statistic, pvalue = outcomes.mcnemar()
+
+    correct_a, correct_b = predictions['a'] == labels, predictions['b'] == labels
+    expected = mcnemar([[0, np.sum(correct_a & ~correct_b)], [np.sum(~correct_a & correct_b), 0]], exact=False)
+    assert np.isclose(statistic.loc['a', 'b'], expected.statistic)
+    assert np.isclose(pvalue.loc['b', 'a'], expected.pvalue)
+    assert pvalue.loc['a', 'a'] == 1.0
+
+    _, _, f1, _ = precision_recall_fscore_support(labels, predictions['c'], average='weighted')
+    assert np.isclose(metrics.loc['c', 'accuracy'], accuracy_score(labels, predictions['c']))
+    assert np.isclose(metrics.loc['c', 'f1'], f1)
+
+
+def test_tournament_tokenizes_once(classifier: HateDetectionClassifier, tmp_path, monkeypatch):
+    """ Unit test for compute_tournament sharing the windows of each batch between models
+    """
+    texts = ["Mude seus pensamentos e você pode mudar seu mundo.", "ódio", "amor e ódio", "ódio ódio"] * 5
+    data_path = tmp_path / "eval.csv"
+    pd.DataFrame({ 'text': texts, 'hate': [1, 0] * 10 }).to_csv(data_path, index=False)
+
+    challenger = HateDetectionClassifier()
+    challenger.tokenizer, challenger.model = classifier.tokenizer, copy.deepcopy(classifier.model)
+    challenger.split_unique_words, challenger.split_seq_len = classifier.split_unique_words, classifier.split_seq_len
+    with torch.no_grad():
+        challenger.model.classifier.bias.add_(torch.tensor([0.0, 0.5]))
+    classifiers = { 'champion': classifier, 'challenger': challenger }
+    splits = []
+
+    monkeypatch.setattr(evaluator, 'load_classifier', lambda path: classifiers[path])
+    monkeypatch.setattr(evaluator.mlflow, 'log_metrics', lambda metrics: None)
+    monkeypatch.setattr(evaluator.mlflow, 'log_text', lambda text, path: None)
+    original_split = evaluator.InferenceEngine.split
+    monkeypatch.setattr(evaluator.InferenceEngine, 'split',
+                        lambda self, text, tokenizer=None: splits.append(len(text)) or original_split(self, text, tokenizer))
+
+    results = evaluator.compute_tournament({ name: name for name in classifiers }, str(data_path), batch_size=8)
+
+    assert splits == [8, 8, 4]
+    for name, model in classifiers.items():
+        expected = model.predict(None, pd.Series(texts))['hate'].to_numpy()
+        assert np.isclose(results['metrics'].loc[name, 'accuracy'], np.mean(expected == [1, 0] * 10))
+    assert results['pvalue'].shape == (2, 2)
+
+    splits.clear()
+    loaded = []
+    monkeypatch.setattr(evaluator, 'load_classifier', lambda path: loaded.append(path) or classifiers[path])
+    one_at_a_time = evaluator.compute_tournament({ name: name for name in classifiers }, str(data_path), batch_size=8,
+                                                 max_loaded_models=1)
+
+    assert loaded == ['champion', 'challenger']
+    assert splits == [8, 8, 4] * 2
+    assert one_at_a_time['metrics'].equals(results['metrics'])
+    assert one_at_a_time['pvalue'].equals(results['pvalue'])
+
+
+def test_sequential_tournament_stores_predictions(classifier: HateDetectionClassifier, tmp_path, monkeypatch):
+    """ Unit test for compute_tournament storing full predictions when the sequential test stops early
+    """
+    texts = pd.Series(["Mude seus pensamentos e você pode mudar seu mundo.", "ódio", "amor e ódio", "ódio ódio",
+                       "você pode mudar", "seu mundo"] * 40)
+    labels = classifier.predict(None, texts)['hate'].to_numpy()
+    data_path = tmp_path / "eval.csv"
+    pd.DataFrame({ 'text': texts, 'hate': labels }).to_csv(data_path, index=False)
+
+    challenger = HateDetectionClassifier()
+    challenger.tokenizer, challenger.model = classifier.tokenizer, copy.deepcopy(classifier.model)
+    challenger.split_unique_words, challenger.split_seq_len = classifier.split_unique_words, classifier.split_seq_len
+    with torch.no_grad():
+        # The challenger always predicts the class the champion predicts the least
+        challenger.model.classifier.bias.add_(torch.tensor([0.0, 20.0] if labels.mean() < 0.5 else [20.0, 0.0]))
+    classifiers, loaded = { 'champion': classifier, 'challenger': challenger }, []
+    model_paths = {}
+    for name in classifiers:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "MLmodel").write_text(f"run_id: {name}")
+        model_paths[name] = str(tmp_path / name)
+
+    monkeypatch.setattr(evaluator, 'classifier_params', lambda path: classifier.prediction_params())
+    monkeypatch.setattr(evaluator, 'load_classifier', lambda path: loaded.append(path) or classifiers[path.rsplit('/', 1)[-1]])
+    monkeypatch.setattr(evaluator.mlflow, 'log_metrics', lambda metrics: None)
+    monkeypatch.setattr(evaluator.mlflow, 'log_text', lambda text, path: None)
+
+    first = evaluator.compute_tournament(model_paths, str(data_path), batch_size=10, sequential=True,
+                                         prediction_store=str(tmp_path / "store"), bootstrap_resamples=0)
+    assert len(loaded) == 2
+    assert first['significant'].loc['champion', 'challenger']
+
+    loaded.clear()
+    second = evaluator.compute_tournament(model_paths, str(data_path), batch_size=10, sequential=True,
+                                          prediction_store=str(tmp_path / "store"), bootstrap_resamples=0)
+    assert loaded == []
+    assert second['metrics'].equals(first['metrics'])
+
+
+def test_sequential_mcnemar_controls_error():
+    """ Unit test for the sequential McNemar test keeping the type I error when checked after every batch
+    """
+    rng = np.random.default_rng(0)
+    rejected = 0
+    for _ in range(200):
+        outcomes = PairedOutcomes(['a', 'b'])
+        for _ in range(20):
+            labels = np.ones(50, dtype=int)
+            outcomes.update(labels, { 'a': rng.integers(0, 2, 50), 'b': rng.integers(0, 2, 50) })
+            if outcomes.decided(0.05):
+                rejected += 1
+                break
+    assert rejected / 200 <= 0.05
+
+    outcomes = PairedOutcomes(['a', 'b'])
+    for batch in range(20):
+        labels = np.ones(50, dtype=int)
+        outcomes.update(labels, { 'a': labels, 'b': rng.integers(0, 2, 50) })
+        if outcomes.decided(0.05):
+            break
+    assert outcomes.examples < 150
+    assert outcomes.sequential_pvalue().loc['a', 'b'] < 0.05
+    assert np.isclose(outcomes.sequential_statistic().loc['a', 'b'], 1 / outcomes.sequential_pvalue().loc['a', 'b'])
+
+
+@pytest.mark.parametrize("value,expected", [("true", True), ("True", True), ("false", False), ("0", False),
+                                            (True, True), (False, False)])
+def test_parse_bool_command_line(value, expected):
+    """ Unit test for parse_bool reading flags like `--sequential true` given by jobs
+    """
+    assert parse_bool(value) is expected
+
+
+def test_parse_bool_rejects_unknown_values():
+    """ Unit test for parse_bool failing on values that aren't booleans
+    """
+    with pytest.raises(ValueError):
+        parse_bool("sometimes")
+
+
+def test_paired_bootstrap_intervals():
+    """ Unit test for paired_bootstrap matching resampling with sklearn and PairedOutcomes rebuilding the examples
+    """
+    rng = np.random.default_rng(1)
+    labels = rng.integers(0, 2, 300)
+    first = np.where(rng.random(300) < 0.7, labels, 1 - labels)
+    second = np.where(rng.random(300) < 0.9, labels, 1 - labels)
+
+    report = paired_bootstrap(labels, first, second, n_resamples=500)
+
+    resamples = np.random.default_rng(0).integers(0, 300, size=(128, 300))
+    expected = [f1_score(labels[idx], second[idx], average='weighted') - f1_score(labels[idx], first[idx], average='weighted')
+                for idx in resamples]
+    assert np.isclose(report.loc['f1', 'delta'], f1_score(labels, second, average='weighted')
+                      - f1_score(labels, first, average='weighted'))
+    assert abs(report.loc['f1', 'lower'] - np.quantile(expected, 0.025)) < 0.03
+    assert 0 < report.loc['accuracy', 'lower'] < report.loc['accuracy', 'delta'] < report.loc['accuracy', 'upper']
+    assert report.loc['accuracy', 'pvalue'] < 0.05
+
+    outcomes = PairedOutcomes(['first', 'second'])
+    outcomes.update(labels, { 'first': first, 'second': second })
+    assert outcomes.bootstrap('first', 'second', n_resamples=500).equals(report)
+    reversed_report = outcomes.bootstrap('second', 'first', n_resamples=500)
+    assert np.allclose(reversed_report['delta'], -report['delta'])
+    assert (reversed_report['lower'] < 0).all() and (reversed_report['upper'] < 0).all()
+
+
+def test_resolve_and_compare_many_forwards_arguments(monkeypatch):
+    """ Unit test for resolve_and_compare_many passing its options to compute_tournament
+    """
+    calls = []
+    monkeypatch.setattr(evaluator, '_model_uri_or_none', lambda name, version: f"models:/{name}/{version}")
+    signature = inspect.signature(evaluator.compute_tournament)
+    monkeypatch.setattr(evaluator, 'compute_tournament',
+                        lambda *args, **kwargs: calls.append(signature.bind(*args, **kwargs).arguments))
+
+    evaluator.resolve_and_compare_many("model", ["1", "2"], "data", bootstrap_resamples=50, max_loaded_models=1)
+
+    assert calls[0]['model_paths'] == { "1": "models:/model/1", "2": "models:/model/2" }
+    assert calls[0]['bootstrap_resamples'] == 50
+    assert calls[0]['max_loaded_models'] == 1
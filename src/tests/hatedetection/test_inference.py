@@ -0,0 +1,101 @@
+import pytest
+import numpy as np
+import pandas as pd
+from hatedetection.model.aggregation import aggregate_windows, softmax, AGGREGATION_STRATEGIES
+from hatedetection.model.inference import InferenceEngine
+from hatedetection.model.telemetry import Histogram, InProcessSink, PrometheusSink, Telemetry, DISABLED
+
+
+def test_aggregate_windows_matches_pandas():
+    """ Unit test for aggregation.aggregate_windows() against the pandas group by aggregation
+    """
+    rng = np.random.default_rng(0)
+    doc_index = np.repeat(np.arange(200), 3)
+    logits = rng.normal(size=(len(doc_index), 2)).astype(np.float32)
+    probs = softmax(logits)
+
+    windows = pd.DataFrame({ 'index': doc_index, 'hate': probs.argmax(axis=1), 'confidence': probs.max(axis=1) })
+    expected = windows.groupby('index').agg({'hate': pd.Series.mode, 'confidence': 'mean' })
+    classes, confidence = aggregate_windows(logits, doc_index, 200)
+
+    assert classes.tolist() == expected['hate'].tolist()
+    assert confidence == pytest.approx(expected['confidence'].to_numpy(), abs=1e-6)
+
+
+@pytest.mark.parametrize("strategy", AGGREGATION_STRATEGIES)
+def test_aggregate_windows_strategies(strategy: str):
+    """ Unit test for aggregation.aggregate_windows() with ties and single windows
+    """
+    logits = np.log(np.array([[0.9, 0.1], [0.2, 0.8], [0.3, 0.7], [0.6, 0.4]]))
+    classes, confidence = aggregate_windows(logits, np.array([0, 0, 1, 2]), 3, strategy=strategy)
+
+    assert classes.dtype.kind == 'i'
+    assert classes.tolist() == [0, 1, 0]
+    assert ((confidence >= 0.5) & (confidence <= 1)).all()
+
+
+@pytest.mark.parametrize("split_mode", ["words", "tokens"])
+def test_pipelined_predict(classifier, split_mode: str):
+    """ Unit test for InferenceEngine.predict() processing chunks in a pipeline
+    """
+    texts = pd.Series(["Mude seus pensamentos e você pode mudar seu mundo.",
+                       "Quando você não pode mudar a direção do vento, mude a direção de sua vela.",
+                       "ódio"] * 7)
+    engine = InferenceEngine(classifier.tokenizer, classifier.model, split_mode=split_mode,
+                             split_unique_words=5, split_seq_len=10)
+    expected = engine.predict(texts)
+
+    engine = InferenceEngine(classifier.tokenizer, classifier.model, split_mode=split_mode,
+                             split_unique_words=5, split_seq_len=10, chunk_size=4, num_workers=3,
+                             queue_size=1)
+    results = engine.predict(texts)
+    stats = engine.stats.as_dict()
+
+    assert results['hate'].tolist() == expected['hate'].tolist()
+    assert results['confidence'].to_numpy() == pytest.approx(expected['confidence'].to_numpy(), abs=1e-5)
+    assert stats['chunks'] == 6
+    assert stats['forward_seconds'] > 0 and stats['tokenize_seconds'] > 0
+
+
+def test_histogram_quantiles():
+    """ Unit test for Histogram bucketing single and vectorized observations alike
+    """
+    single, many = Histogram((1, 2, 4, 8)), Histogram((1, 2, 4, 8))
+    values = np.array([0.5, 1, 1.5, 3, 3, 3, 7, 20])
+    for value in values:
+        single.observe(value)
+    many.observe_many(values)
+
+    assert single.counts == many.counts == [2, 1, 3, 1, 1]
+    assert single.sum == many.sum == values.sum()
+    assert single.quantile(0.5) == pytest.approx(2 + 2 * 1 / 3)
+    assert single.quantile(1.0) == 8
+
+
+def test_predict_records_telemetry(classifier, tmp_path):
+    """ Unit test for the telemetry of the inference path and its sinks
+    """
+    texts = pd.Series(["Mude seus pensamentos e você pode mudar seu mundo.", "ódio", "amor e ódio " * 40])
+    classifier.cache_size = 0
+    classifier.split_unique_words, classifier.split_seq_len = 20, 30
+    assert classifier.telemetry is DISABLED
+
+    memory, prometheus = InProcessSink(), PrometheusSink(str(tmp_path / "metrics.prom"))
+    telemetry = classifier.enable_telemetry(Telemetry([memory, prometheus]))
+    classifier.predict(None, texts)
+    telemetry.flush()
+    snapshot = memory.history[-1]
+
+    assert snapshot['rows'] == snapshot['request_rows'] == 3 and snapshot['requests'] == 1
+    assert snapshot['windows'] == snapshot['windows_per_row_sum'] > 3
+    assert snapshot['padded_tokens'] >= snapshot['tokens'] > 0
+    assert snapshot['batch_size_sum'] == snapshot['windows']
+    for stage in ('window', 'tokenizer', 'tokenize', 'forward', 'aggregate', 'batch', 'predict', 'request'):
+        assert snapshot[f"{stage}_seconds_count"] >= 1
+    text = (tmp_path / "metrics.prom").read_text()
+    assert 'hatedetection_rows_total 3' in text
+    assert 'hatedetection_windows_per_row_bucket{le="+Inf"} 3' in text
+
+    classifier.disable_telemetry()
+    classifier.predict(None, texts)
+    assert telemetry.snapshot()['rows'] == 3
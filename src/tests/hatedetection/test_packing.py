@@ -0,0 +1,64 @@
+import numpy as np
+import torch
+from transformers import TrainingArguments
+from hatedetection.train.datasets import ClassificationDataset
+from hatedetection.train.packing import PackedDataset, PackedCollator, PackedSequenceClassifier, PackedTrainer
+
+
+def test_packed_dataset_packs_every_example_once():
+    """ Unit test for PackedDataset filling packs without exceeding their length
+    """
+    lengths = np.random.default_rng(0).integers(3, 60, 500)
+    lengths[:3] = [200, 128, 127]
+    dataset = ClassificationDataset([[1] * length for length in lengths], np.arange(len(lengths)) % 2, None)
+    packed = PackedDataset(dataset, max_length=128)
+    packs = [packed[idx] for idx in range(len(packed))]
+
+    assert sorted(packed.order.tolist()) == list(range(len(lengths)))
+    assert all(len(pack['input_ids']) <= 128 or len(pack['segment_lengths']) == 1 for pack in packs)
+    assert sum(len(pack['input_ids']) for pack in packs) == lengths.sum()
+    assert packed.efficiency() > 0.95
+
+
+def test_packed_classifier_matches_unpacked(classifier):
+    """ Unit test for PackedSequenceClassifier scoring each packed example as if it were alone
+    """
+    texts = ["Mude seus pensamentos", "você pode mudar seu mundo " * 5, "ódio", "amor", "ódio e amor " * 3] * 3
+    dataset = ClassificationDataset(texts, [idx % 2 == 0 for idx in range(len(texts))], classifier.tokenizer)
+    packed = PackedDataset(dataset, max_length=40)
+    collator = PackedCollator(classifier.tokenizer.pad_token_id)
+    model = PackedSequenceClassifier(classifier.model)
+
+    batch = collator([packed[idx] for idx in range(len(packed))])
+    unpacked = collator([dataset[idx] for idx in range(len(dataset))])
+    with torch.no_grad():
+        outputs = model(**batch)
+        expected = model(**unpacked)
+
+    assert len(packed) < len(dataset)
+    assert batch['labels'].tolist() == dataset.label_ids[packed.order].tolist()
+    assert torch.allclose(outputs.logits, expected.logits[torch.from_numpy(packed.order)], atol=1e-5)
+    assert torch.isclose(outputs.loss, expected.loss, atol=1e-5)
+
+
+def test_packed_trainer_checkpoints_the_model(classifier, tmp_path):
+    """ Unit test for PackedTrainer saving checkpoints that load with from_pretrained and resume training
+    """
+    texts = ["Mude seus pensamentos", "você pode mudar seu mundo", "ódio", "amor", "ódio e amor"] * 4
+    dataset = ClassificationDataset(texts, [idx % 2 == 0 for idx in range(len(texts))], classifier.tokenizer)
+    args = TrainingArguments(output_dir=str(tmp_path / "results"), per_device_train_batch_size=2, max_steps=2,
+                             save_steps=2, remove_unused_columns=False, report_to=[])
+    model = PackedSequenceClassifier(classifier.model)
+
+    trainer = PackedTrainer(model=model, args=args, train_dataset=PackedDataset(dataset, max_length=16),
+                            data_collator=PackedCollator(classifier.tokenizer.pad_token_id))
+    trainer.train()
+    checkpoint = type(classifier.model).from_pretrained(str(tmp_path / "results" / "checkpoint-2"))
+
+    trained = classifier.model.state_dict()
+    assert checkpoint.state_dict().keys() == trained.keys()
+    assert all(torch.equal(value, trained[name]) for name, value in checkpoint.state_dict().items())
+
+    copy = PackedSequenceClassifier(type(classifier.model)(classifier.model.config))
+    copy.load_state_dict(checkpoint.state_dict())
+    assert torch.equal(copy.model.classifier.weight, classifier.model.classifier.weight)
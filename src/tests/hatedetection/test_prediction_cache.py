@@ -0,0 +1,155 @@
+import cloudpickle
+import pandas as pd
+from hatedetection.model.hate_detection_classifier import HateDetectionClassifier
+from hatedetection.model.prediction_cache import PredictionCache
+from hatedetection.model.prediction_store import PredictionStore, classifier_params
+
+
+class CountingPredictor:
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts: pd.Series) -> pd.DataFrame:
+        self.texts.extend(texts)
+        return pd.DataFrame({ 'hate': texts.str.len() % 2, 'confidence': texts.str.len() / 100 })
+
+
+def test_cache_deduplicates_batches():
+    """ Unit test for PredictionCache scoring repeated texts only once
+    """
+    predictor = CountingPredictor()
+    cache = PredictionCache('v1')
+    texts = pd.Series(["ódio", "amor", "ódio ", "  ódio", "mude seus pensamentos"])
+
+    results = cache.predict(texts, predictor)
+
+    assert predictor.texts == ["ódio", "amor", "mude seus pensamentos"]
+    assert results['hate'].tolist() == [0, 0, 0, 0, 1]
+    assert cache.stats()['duplicates'] == 2
+
+
+def test_cache_lru_eviction():
+    """ Unit test for PredictionCache evicting the least recently used entries
+    """
+    predictor = CountingPredictor()
+    cache = PredictionCache('v1', max_entries=2)
+
+    cache.predict(pd.Series(["a", "bb"]), predictor)
+    cache.predict(pd.Series(["a"]), predictor)
+    cache.predict(pd.Series(["ccc"]), predictor)
+    cache.predict(pd.Series(["a", "bb"]), predictor)
+
+    assert predictor.texts == ["a", "bb", "ccc", "bb"]
+    assert cache.stats()['evictions'] == 2
+    assert cache.stats()['hits'] == 2
+
+
+def test_cache_shared_tier(tmp_path):
+    """ Unit test for PredictionCache sharing entries through SQLite and invalidating versions
+    """
+    shared_path = str(tmp_path / "predictions.db")
+    predictor = CountingPredictor()
+
+    PredictionCache('v1', shared_path=shared_path).predict(pd.Series(["ódio", "amor"]), predictor)
+    other = PredictionCache('v1', shared_path=shared_path)
+    results = other.predict(pd.Series(["amor", "ódio"]), predictor)
+
+    assert predictor.texts == ["ódio", "amor"]
+    assert other.stats()['shared_hits'] == 2
+    assert results['confidence'].tolist() == [0.04, 0.04]
+
+    PredictionCache('v0', shared_path=shared_path).predict(pd.Series(["ódio"]), predictor)
+    other.invalidate('v2')
+    other.predict(pd.Series(["amor"]), predictor)
+    assert predictor.texts == ["ódio", "amor", "ódio", "amor"]
+
+    # Only entries of the replaced version are removed from the shared tier
+    assert PredictionCache('v1', shared_path=shared_path).get_many([PredictionCache('v1').key("amor")]) == {}
+    serving = PredictionCache('v0', shared_path=shared_path)
+    serving.predict(pd.Series(["ódio"]), predictor)
+    assert serving.stats()['shared_hits'] == 1
+
+
+def test_classifier_cache_version_without_model_version(classifier: HateDetectionClassifier, tmp_path):
+    """ Unit test for HateDetectionClassifier versioning predictions by its weights when it has no version
+    """
+    classifier.save_pretrained(str(tmp_path / "first"))
+    classifier.model.classifier.bias.data += 1
+    classifier.save_pretrained(str(tmp_path / "second"))
+
+    versions = []
+    for directory in ["first", "first", "second"]:
+        restored = HateDetectionClassifier()
+        restored.build(str(tmp_path / directory))
+        versions.append(restored.prediction_cache().model_version)
+
+    assert versions[0].startswith("weights-")
+    assert versions[0] == versions[1]
+    assert versions[0] != versions[2]
+
+
+def test_classifier_cache_invalidation(classifier: HateDetectionClassifier, tmp_path):
+    """ Unit test for HateDetectionClassifier reusing predictions until the model changes
+    """
+    data = pd.Series(["Mude seus pensamentos e você pode mudar seu mundo.", "ódio", "ódio"])
+
+    first = classifier.predict(None, data)
+    second = classifier.predict(None, data)
+    assert classifier.last_stats['cache_hits'] == 2
+    assert second.equals(first)
+
+    classifier.save_pretrained(str(tmp_path))
+    classifier.predict(None, data)
+    assert classifier.last_stats['cache_hits'] == 0
+    assert classifier.last_stats['cache_duplicates'] == 1
+
+
+def test_prediction_store_reuses_model_versions(tmp_path):
+    """ Unit test for PredictionStore computing the predictions of a model over a dataset only once
+    """
+    data_path, model_path = tmp_path / "eval.csv", tmp_path / "model"
+    pd.DataFrame({ 'text': ["ódio", "amor"], 'hate': [1, 0] }).to_csv(data_path, index=False)
+    model_path.mkdir()
+    (model_path / "MLmodel").write_text("run_id: 1")
+    predictor = CountingPredictor()
+
+    def predict():
+        return predictor(pd.Series(["ódio", "amor"]))
+
+    store = PredictionStore(str(tmp_path / "store"))
+    first = store.get_or_predict(str(model_path), str(data_path), predict)
+    second = PredictionStore(str(tmp_path / "store")).get_or_predict(str(model_path), str(data_path), predict)
+    assert predictor.texts == ["ódio", "amor"]
+    assert second.equals(first)
+
+    (model_path / "MLmodel").write_text("run_id: 2")
+    store.get_or_predict(str(model_path), str(data_path), predict)
+    pd.DataFrame({ 'text': ["ódio"], 'hate': [1] }).to_csv(data_path, index=False)
+    store.get_or_predict(str(model_path), str(data_path), predict)
+    assert len(predictor.texts) == 6
+    assert store.stats() == { 'hits': 0, 'misses': 3 }
+
+
+def test_prediction_store_keys_by_classifier_params(classifier: HateDetectionClassifier, tmp_path, monkeypatch):
+    """ Unit test for PredictionStore keeping apart predictions made with different preprocessing
+    """
+    data_path, model_path = tmp_path / "eval.csv", tmp_path / "model"
+    pd.DataFrame({ 'text': ["ódio", "amor"], 'hate': [1, 0] }).to_csv(data_path, index=False)
+    model_path.mkdir()
+    (model_path / "MLmodel").write_text("flavors:\n  python_function:\n    python_model: python_model.pkl\n")
+    def log_classifier():
+        with open(model_path / "python_model.pkl", 'wb') as pickle_file:
+            cloudpickle.dump(classifier, pickle_file)
+
+    log_classifier()
+    params = classifier_params(str(model_path))
+    assert params == classifier.prediction_params()
+
+    store = PredictionStore(str(tmp_path / "store"))
+    first = store.key(str(model_path), str(data_path), **params)
+    classifier.split_seq_len += 10
+    log_classifier()
+    assert store.key(str(model_path), str(data_path), **classifier_params(str(model_path))) != first
+
+    monkeypatch.setenv("HATEDETECTION_PRECISION", "int8")
+    assert classifier_params(str(model_path))['precision'] == "int8"
@@ -1,6 +1,9 @@
+import math
 import pytest
 import pandas as pd
-from hatedetection.prep.text_preparation import split_to_sequences
+from hatedetection.prep.text_preparation import split_to_sequences, split_to_token_sequences, \
+    tokenize_to_sequences, load_examples, iter_examples
+from hatedetection.prep.synthetic import generate_corpus, CATEGORIES
 
 
 raw_data = pd.DataFrame(data=[
@@ -20,4 +23,72 @@ def test_split_to_sequence_len(data: pd.DataFrame):
                             unique_words=unique_words,
                             seq_len=seq_len).explode()
 
-    assert all(data_split['text'].str.len() <= seq_len)
\ No newline at end of file
+    assert all(data_split['text'].str.len() <= seq_len)
+
+@pytest.mark.parametrize("data", data_samples)
+def test_split_to_token_sequences_len(data: pd.DataFrame, tokenizer):
+    """ Unit test for text_preparation.tokenize_to_sequences()
+    """
+    unique_tokens = 5
+    seq_len = 10
+
+    windows = tokenize_to_sequences(data['text'], tokenizer, unique_tokens, seq_len)
+    token_ids = tokenizer(list(data['text']), add_special_tokens=False)['input_ids']
+
+    assert all(windows.apply(len) <= seq_len + tokenizer.num_special_tokens_to_add())
+    assert all(windows.apply(lambda ids: ids[0] == tokenizer.cls_token_id))
+    assert windows.index.value_counts().sort_index().tolist() == \
+        [math.ceil(len(ids) / unique_tokens) for ids in token_ids]
+
+
+def test_split_to_token_sequences_context():
+    """ Unit test for text_preparation.split_to_token_sequences()
+    """
+    windows = split_to_token_sequences(list(range(12)), unique_tokens=5, seq_len=8)
+
+    assert windows == [list(range(0, 8)), list(range(5, 12)), list(range(10, 12))]
+    assert split_to_token_sequences([], unique_tokens=5, seq_len=8) == [[]]
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet", "arrow"])
+def test_iter_examples_matches_load_examples(tmp_path, file_format: str):
+    """ Unit test for text_preparation.iter_examples()
+    """
+    data = pd.DataFrame({ "text": [" ".join(["palavra"] * (idx % 7)) + f" fim {idx}" for idx in range(200)],
+                          "hate": [idx % 3 == 0 for idx in range(200)] })
+    for part, chunk in enumerate([data.iloc[:120], data.iloc[120:]]):
+        file_path = tmp_path / f"part-{part}.{file_format}"
+        if file_format == "csv":
+            chunk.to_csv(file_path, index=False)
+        elif file_format == "parquet":
+            chunk.to_parquet(file_path, index=False)
+        else:
+            chunk.reset_index(drop=True).to_feather(file_path)
+
+    X_train, _, X_eval, y_eval = load_examples(str(tmp_path), eval_size=0.3, split_seq=True,
+                                               unique_words=2, seq_len=4, random_state=0)
+    batches = list(iter_examples(str(tmp_path), eval_size=0.3, split_seq=True, unique_words=2,
+                                 seq_len=4, random_state=0, batch_size=32))
+
+    assert len(batches) > 2
+    assert pd.concat([batch[0] for batch in batches]).equals(X_train.sort_index(kind="stable"))
+    assert pd.concat([batch[2] for batch in batches]).equals(X_eval.sort_index(kind="stable"))
+    assert pd.concat([batch[3] for batch in batches]).equals(y_eval.sort_index(kind="stable"))
+    assert X_train.dtype == pd.StringDtype("pyarrow")
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_generate_corpus(tmp_path, file_format: str):
+    """ Unit test for generate_corpus honoring size, schema, duplicates and label skew
+    """
+    files = generate_corpus(str(tmp_path), 25000, file_format=file_format, rows_per_file=10000, chunk_size=4000,
+                            duplicate_rate=0.2, hate_rate=0.1, mean_words=12)
+    corpus = pd.concat([pd.read_csv(file) if file_format == 'csv' else pd.read_parquet(file) for file in files])
+    text, labels = load_examples(str(tmp_path))
+
+    assert len(files) == 3 and len(corpus) == len(text) == 25000
+    assert list(corpus.columns) == ['text', 'hate'] + CATEGORIES
+    assert (corpus[CATEGORIES].sum(axis=1) == corpus['hate']).all()
+    assert labels.mean() == pytest.approx(0.1, abs=0.01)
+    assert corpus['text'].duplicated().mean() == pytest.approx(0.2, abs=0.02)
+    assert corpus['text'].str.split().str.len().median() == pytest.approx(12, abs=1)
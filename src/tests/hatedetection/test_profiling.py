@@ -0,0 +1,36 @@
+import torch
+import pandas as pd
+from transformers import TrainingArguments
+from hatedetection.train.datasets import ClassificationDataset, PaddingCollator
+from hatedetection.train.evaluation import StreamingEvalTrainer
+from hatedetection.train import profiling
+
+
+def test_profiler_callback_logs_artifacts(classifier, tmp_path, monkeypatch):
+    """ Unit test for ProfilerCallback profiling training and evaluation steps on CPU
+    """
+    artifacts, metrics = [], []
+    monkeypatch.setattr(profiling.mlflow, 'log_artifact', lambda path, artifact_path=None: artifacts.append(path))
+    monkeypatch.setattr(profiling.mlflow, 'log_metrics', lambda values, step=None: metrics.append(values))
+    texts = ["Mude seus pensamentos", "você pode mudar seu mundo", "ódio", "amor", "ódio e amor"] * 4
+    dataset = ClassificationDataset(texts, [idx % 2 == 0 for idx in range(len(texts))], classifier.tokenizer)
+    args = TrainingArguments(output_dir=str(tmp_path / "results"), per_device_train_batch_size=2,
+                             per_device_eval_batch_size=2, max_steps=6, report_to=[])
+    callback = profiling.ProfilerCallback(str(tmp_path / "profiler"), wait=1, warmup=1, active=2, eval_steps=2,
+                                          with_stack=True)
+
+    trainer = StreamingEvalTrainer(model=classifier.model, args=args, train_dataset=dataset, eval_dataset=dataset,
+                                   data_collator=PaddingCollator(classifier.tokenizer.pad_token_id),
+                                   callbacks=[callback])
+    trainer.train()
+    trainer.evaluate()
+
+    names = sorted(path.rsplit('/', 1)[-1] for path in artifacts)
+    assert 'train_step4_memory.txt' in names and 'train_step4_operators.csv' in names
+    assert 'train_step4_trace.json' in names and 'eval_step3_trace.json' in names
+    # Memory timelines are only exported by versions of torch that support them
+    if hasattr(torch.profiler.profile, 'export_memory_timeline'):
+        assert 'train_step4_memory_timeline.json' in names
+    summary = pd.read_csv(tmp_path / "profiler" / "train_step4_operators.csv")
+    assert summary['operator'].str.startswith('enumerate(DataLoader)').any()
+    assert len(metrics) == 2 and 0 < metrics[0]['profiler_train_dataloader_ratio'] < 1
@@ -0,0 +1,225 @@
+import asyncio
+import threading
+import pytest
+from types import SimpleNamespace
+import pandas as pd
+from hatedetection.score.batching import MicroBatcher, Overloaded
+from hatedetection.score.server import ScoringServer
+from hatedetection.score.loadtest import run_load_test
+from hatedetection.score import parallel
+from hatedetection.score.parallel import score_parallel
+from hatedetection.prep.arguments import parse_int_list
+from hatedetection.score import batch as batch_scoring
+from hatedetection.score.batch import score_files
+from hatedetection.score import scaling
+
+
+def score_lengths(texts: pd.Series) -> pd.DataFrame:
+    return pd.DataFrame({ 'hate': texts.str.len(), 'confidence': 1.0 })
+
+
+def test_micro_batcher_coalesces_requests():
+    """ Unit test for MicroBatcher coalescing concurrent requests and resolving each caller
+    """
+    requests = [["a" * (idx % 7 + 1)] * (idx % 3 + 1) for idx in range(50)]
+
+    async def run():
+        batcher = MicroBatcher(score_lengths, max_batch_size=16, max_wait_ms=20)
+        await batcher.start()
+        results = await asyncio.gather(*[batcher.submit(texts) for texts in requests])
+        await batcher.stop()
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(run())
+
+    assert [result['hate'].tolist() for result in results] == [[len(text) for text in texts] for texts in requests]
+    assert stats['batches'] < len(requests)
+    assert stats['mean_batch_size'] <= 16
+
+
+def test_micro_batcher_sheds_load():
+    """ Unit test for MicroBatcher rejecting requests when the queue is full
+    """
+    release = threading.Event()
+
+    def blocking_predict(texts: pd.Series) -> pd.DataFrame:
+        release.wait(5)
+        return score_lengths(texts)
+
+    async def run():
+        batcher = MicroBatcher(blocking_predict, max_batch_size=1, max_wait_ms=0, max_queue_size=2)
+        await batcher.start()
+        pending = [asyncio.ensure_future(batcher.submit(["texto"])) for _ in range(6)]
+        await asyncio.sleep(0.1)
+        release.set()
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        await batcher.stop()
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(run())
+
+    assert any(isinstance(result, Overloaded) for result in results)
+    assert sum(isinstance(result, pd.DataFrame) for result in results) == 6 - stats['shed']
+
+
+def test_scoring_server_load_test(classifier):
+    """ Unit test for ScoringServer serving the classifier under concurrent load
+    """
+    texts = ["Mude seus pensamentos e você pode mudar seu mundo.", "ódio", "amor e ódio"]
+
+    async def run():
+        server = ScoringServer(MicroBatcher(lambda batch: classifier.predict(None, batch)), port=0)
+        await server.start()
+        try:
+            return await run_load_test(server.host, server.port, texts, concurrency=4, n_requests=20)
+        finally:
+            await server.stop()
+
+    report = asyncio.run(run())
+
+    assert report['requests'] == 20
+    assert report['errors'] == 0 and report['shed'] == 0
+    assert report['latency_p99_ms'] >= report['latency_p50_ms'] > 0
+
+
+def test_scoring_server_rejects_invalid_requests():
+    """ Unit test for ScoringServer answering malformed and oversized requests instead of dropping them
+    """
+    requests = [b"GARBAGE\r\n\r\n",
+                b"POST /score HTTP/1.1\r\nContent-Length: many\r\n\r\n",
+                b"POST /score HTTP/1.1\r\nContent-Length: 1000000\r\n\r\n"]
+
+    async def send(server, request):
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        writer.write(request)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def run():
+        server = ScoringServer(MicroBatcher(lambda batch: None), port=0, max_body_bytes=1024)
+        await server.start()
+        try:
+            return [await send(server, request) for request in requests]
+        finally:
+            await server.stop()
+
+    responses = asyncio.run(run())
+
+    assert [response.split(b" ", 2)[1] for response in responses] == [b"400", b"400", b"413"]
+
+
+def test_score_parallel_keeps_order(classifier):
+    """ Unit test for score_parallel merging the results of the workers in the order of the input
+    """
+    texts = pd.Series(["Mude seus pensamentos e você pode mudar seu mundo.", "ódio", "amor e ódio", "ódio"] * 3)
+    classifier.cache_size = 0
+
+    expected = classifier.predict(None, texts)
+    results = score_parallel(classifier, texts, num_workers=2, threads_per_worker=1, shard_size=5)
+
+    assert results['hate'].tolist() == expected['hate'].tolist()
+    assert results['confidence'].round(4).tolist() == expected['confidence'].round(4).tolist()
+
+
+@pytest.mark.parametrize("values", ["1,2,4", ["1", "2", "4"], ["1,2", "4"], [1, 2, 4]])
+def test_parse_int_list(values):
+    """ Unit test for parse_int_list reading lists given in the command line
+    """
+    assert parse_int_list(values) == [1, 2, 4]
+
+
+def test_benchmark_scaling_parses_command_line_lists(classifier, monkeypatch):
+    """ Unit test for benchmark_scaling with workers and threads given as comma separated strings
+    """
+    runs = []
+    monkeypatch.setattr(parallel, 'load_classifier', lambda model_path: classifier)
+    monkeypatch.setattr(parallel, 'load_examples', lambda path: (pd.Series(["ódio", "amor"]), None))
+    monkeypatch.setattr(parallel, 'score_parallel', lambda clf, texts, workers, threads: runs.append((workers, threads)))
+    monkeypatch.setattr(parallel.os, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(parallel.mlflow, 'log_metric', lambda name, value: None)
+    monkeypatch.setattr(parallel.mlflow, 'log_text', lambda text, artifact_file: None)
+
+    report = parallel.benchmark_scaling("model", "data", workers="1,2,4", threads="1,2", rows=10)
+
+    assert runs == [(1, 1), (1, 2), (2, 1), (2, 2), (4, 1)]
+    assert report['rows'].tolist() == [10] * 5
+
+
+def test_score_files_resumes_from_checkpoint(tmp_path, monkeypatch):
+    """ Unit test for score_files resuming an interrupted job without scoring parts twice
+    """
+    metrics = []
+    monkeypatch.setattr(batch_scoring.mlflow, 'log_metrics', lambda values, step=None: metrics.append(values))
+    texts = pd.DataFrame({ 'id': range(25), 'text': ["a" * (idx % 7 + 1) for idx in range(25)] })
+    texts.to_parquet(tmp_path / "texts.parquet")
+    output_dir = str(tmp_path / "predictions")
+    scored = []
+
+    def interrupted(batch: pd.Series) -> pd.DataFrame:
+        if len(scored) == 2:
+            raise KeyboardInterrupt()
+        scored.append(len(batch))
+        return score_lengths(batch)
+
+    with pytest.raises(KeyboardInterrupt):
+        score_files(interrupted, str(tmp_path / "texts.parquet"), output_dir, id_column='id', batch_size=10)
+
+    progress = score_files(lambda batch: scored.append(len(batch)) or score_lengths(batch),
+                           str(tmp_path / "texts.parquet"), output_dir, id_column='id', batch_size=10)
+    results = pd.read_parquet(output_dir)
+
+    assert scored == [10, 10, 5]
+    assert progress['resumed_rows'] == 20 and progress['rows'] == 25
+    assert results['row'].tolist() == results['id'].tolist() == list(range(25))
+    assert results['hate'].tolist() == texts['text'].str.len().tolist()
+    assert [values['rows_scored'] for values in metrics if 'rows_scored' in values] == [10, 20, 25]
+
+
+def test_run_scaling_reports_each_stage(classifier, tmp_path, monkeypatch):
+    """ Unit test for run_scaling measuring every stage of the pipeline on each scale
+    """
+    metrics = []
+    monkeypatch.setattr(scaling, 'load_classifier', lambda model_path: classifier)
+    monkeypatch.setattr(scaling.mlflow, 'log_metrics', lambda values, step=None: metrics.append(step))
+    monkeypatch.setattr(scaling.mlflow, 'log_text', lambda text, artifact_file: None)
+
+    curve = scaling.run_scaling("model", str(tmp_path), scales=["200", "50"], max_length=32, max_predict_rows=20)
+
+    assert curve['scale'].tolist() == [50] * 3 + [200] * 3
+    assert curve['stage'].tolist() == ['load_examples', 'dataset', 'predict'] * 2
+    assert curve['rows'].tolist() == [50, 50, 20, 200, 200, 20]
+    assert (curve['rows_per_second'] > 0).all() and (curve['peak_rss_mb'] > 0).all()
+    assert metrics == [50, 200]
+
+
+def test_run_scaling_parses_job_scales(tmp_path, monkeypatch):
+    """ Unit test for run_scaling reading the scales of scaling.job.yml, given as a single string
+    """
+    generated = []
+    monkeypatch.setattr(scaling, 'load_classifier', lambda model_path: pd.Series(dtype=object))
+    monkeypatch.setattr(scaling, 'generate_corpus', lambda output_dir, rows, **kwargs: generated.append(rows))
+    monkeypatch.setattr(scaling, 'measure_pipeline', lambda *args: pd.DataFrame({
+        'stage': ['predict'], 'rows': [1], 'seconds': [1.0], 'rows_per_second': [1.0], 'peak_rss_mb': [1.0] }))
+    monkeypatch.setattr(scaling.mlflow, 'log_metrics', lambda values, step=None: None)
+    monkeypatch.setattr(scaling.mlflow, 'log_text', lambda text, artifact_file: None)
+
+    curve = scaling.run_scaling("model", str(tmp_path), scales="10000,100000,1000000,10000000")
+
+    assert generated == [10000, 100000, 1000000, 10000000]
+    assert curve['scale'].tolist() == generated
+
+
+@pytest.mark.parametrize("platform,expected", [("darwin", 2048), ("linux", 2048 * 1024)])
+def test_peak_memory_sampler_without_proc(platform, expected, monkeypatch):
+    """ Unit test for PeakMemorySampler reading ru_maxrss in the units of each platform when /proc is missing
+    """
+    def missing_proc(*args, **kwargs):
+        raise OSError("No such file or directory: '/proc/self/statm'")
+
+    monkeypatch.setattr(scaling.sys, 'platform', platform)
+    monkeypatch.setattr(scaling, 'open', missing_proc, raising=False)
+    monkeypatch.setattr(scaling.resource, 'getrusage', lambda who: SimpleNamespace(ru_maxrss=2048))
+
+    assert scaling.PeakMemorySampler.current_rss() == expected